@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import logging
+import math
+import re
+import time
+
+from fastapi import APIRouter, HTTPException, status
+from starlette.responses import JSONResponse
+from starlette.websockets import WebSocketClose
+
+from config import ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER
+
+router = APIRouter()
+
+# Код закрытия 1013 (Try Again Later) для отклонённого подключения websocket
+WS_OVERLOAD_CLOSE_CODE = 1013
+# Выше этого числа ключей корзины, успевшие наполниться до краёв, удаляются
+MAX_BUCKET_KEYS = 10000
+
+# Все группы и корзины процесса, для метрик
+_groups = []
+_buckets = []
+
+
+class RouteGroup:
+    # Ограничение одновременных запросов группы маршрутов: limit выполняются, до queue_size ждут
+    # свободного места не дольше ADMISSION_QUEUE_TIMEOUT, остальные сразу получают 503 + Retry-After.
+    # methods — HTTP-методы или "WEBSOCKET", pattern — регулярное выражение от начала пути
+    def __init__(self, name: str, methods: tuple, pattern: str, limit: int, queue_size: int):
+        self.name = name
+        self.methods = methods
+        self.pattern = re.compile(pattern)
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self._semaphore = asyncio.Semaphore(limit)
+        _groups.append(self)
+
+    def matches(self, method: str, path: str) -> bool:
+        return method in self.methods and self.pattern.match(path) is not None
+
+    async def acquire(self) -> bool:
+        if self._semaphore.locked():
+            if self.queued >= self.queue_size:
+                self.shed += 1
+                return False
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), ADMISSION_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                return False
+            finally:
+                self.queued -= 1
+        else:
+            # Свободный слот занимается сразу: acquire не уступает управление, пока счётчик больше нуля
+            await self._semaphore.acquire()
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def metrics(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queue_depth": self.queued,
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+
+class AdmissionMiddleware:
+    # ASGI-middleware, а не @app.middleware("http"): так же ограничиваются и websocket-подключения.
+    # Слот занят до конца ответа, включая потоковые тела
+    def __init__(self, app, groups: list):
+        self.app = app
+        self.groups = groups
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"] if scope["type"] == "http" else "WEBSOCKET"
+        group = next((group for group in self.groups if group.matches(method, scope["path"])), None)
+        if group is None:
+            await self.app(scope, receive, send)
+            return
+        if not await group.acquire():
+            logging.warning(f"Admission: shedding {method} {scope['path']} ({group.name})")
+            if scope["type"] == "websocket":
+                await WebSocketClose(code=WS_OVERLOAD_CLOSE_CODE, reason="Service overloaded")(scope, receive, send)
+            else:
+                await JSONResponse(
+                    {"detail": "Service overloaded, retry later"},
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+                )(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            group.release()
+
+
+class TokenBucket:
+    # Ограничение частоты по ключу (пользователю): rate_per_minute запросов в минуту, до burst подряд
+    def __init__(self, name: str, rate_per_minute: float, burst: int):
+        self.name = name
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.limited = 0
+        self._buckets = {}  # ключ -> (оставшиеся токены, время обновления)
+        _buckets.append(self)
+
+    def take(self, key: str):
+        now = time.monotonic()
+        if len(self._buckets) >= MAX_BUCKET_KEYS:
+            full_after = self.burst / self.rate
+            for stale in [k for k, (_, updated) in self._buckets.items() if now - updated >= full_after]:
+                del self._buckets[stale]
+        key = hashlib.sha256(key.encode()).hexdigest()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return
+        self._buckets[key] = (tokens, now)
+        self.limited += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, retry later",
+            headers={"Retry-After": str(math.ceil((1 - tokens) / self.rate))},
+        )
+
+    def metrics(self) -> dict:
+        return {"rate_per_minute": self.rate * 60, "burst": self.burst, "keys": len(self._buckets), "limited": self.limited}
+
+
+@router.get("/admission/metrics")
+def get_admission_metrics():
+    return {
+        "groups": {group.name: group.metrics() for group in _groups},
+        "rate_limits": {bucket.name: bucket.metrics() for bucket in _buckets},
+    }
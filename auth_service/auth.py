@@ -1,16 +1,22 @@
 import base64
 import logging
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 
+import admission
 import schemas
 
 from utils import *
-from config import DEFAULT_USER_IMAGE_PATH, MAX_IMAGE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
+from config import DEFAULT_USER_IMAGE_PATH, MAX_IMAGE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS, \
+    LOGIN_RATE_PER_MINUTE, LOGIN_RATE_BURST
 
 
 router = APIRouter()
 
+# Частота входа на пару имя пользователя + адрес клиента; проверяется до запроса к БД и проверки пароля.
+# Ключ не только по имени: иначе кто угодно мог бы заблокировать вход чужому пользователю
+login_limiter = admission.TokenBucket("login", LOGIN_RATE_PER_MINUTE, LOGIN_RATE_BURST)
+
 
 @router.post("/register", response_model=schemas.UserResponse)
 def api_register(user: schemas.UserCreate, db: Session = Depends(get_db)):
@@ -72,7 +78,12 @@ def api_register(user: schemas.UserCreate, db: Session = Depends(get_db)):
     return db_user
 
 
-@router.post("/login")
+def login_rate_limit(user_login: schemas.UserLogin, request: Request):
+    client_host = request.client.host if request.client else ""
+    login_limiter.take(f"{user_login.username}\n{client_host}")
+
+
+@router.post("/login", dependencies=[Depends(login_rate_limit)])
 def api_login(user: schemas.UserLogin = Depends(validate_auth_user), db: Session = Depends(get_db)):
     # print(request.headers)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
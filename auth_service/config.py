@@ -12,6 +12,15 @@ PREFIX_POSSIBILITY_API = os.getenv("PREFIX_POSSIBILITY_API")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Реплика только для чтения (необязательна). Чтения идут в неё, пока отставание, измеряемое
+# по строке replica_heartbeat раз в DATABASE_REPLICA_CHECK_INTERVAL секунд, не больше
+# DATABASE_REPLICA_MAX_LAG; после записи клиент DATABASE_REPLICA_STICKY_SECONDS читает из основной БД.
+# Локально реплику можно изображать копией файла SQLite: sqlite3 main.db ".backup replica.db"
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or None
+DATABASE_REPLICA_MAX_LAG = float(os.getenv("DATABASE_REPLICA_MAX_LAG", "5"))
+DATABASE_REPLICA_STICKY_SECONDS = float(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "10"))
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", "1"))
+
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 
@@ -24,4 +33,21 @@ ALGORITHM = os.getenv("ALGORITHM")
 TOKEN_TYPE = os.getenv("TOKEN_TYPE", "Bearer")
 
 BASE_DIR = "C:\\Users\\azamat\\PycharmProjects\\KinematicsProblemSuite\\auth_service\\public\\user"
-UPLOAD_DIR = os.path.join(BASE_DIR, "images")
\ No newline at end of file
+UPLOAD_DIR = os.path.join(BASE_DIR, "images")
+
+# Быстрая сериализация списков (orjson без повторной валидации response_model)
+FAST_LIST_RESPONSES = os.getenv("FAST_LIST_RESPONSES", "false").lower() == "true"
+
+# Ограничение нагрузки по группам маршрутов (см. admission.py и main.py): ADMISSION_<ГРУППА>_LIMIT запросов
+# выполняются одновременно, до ADMISSION_<ГРУППА>_QUEUE ждут не дольше ADMISSION_QUEUE_TIMEOUT секунд,
+# остальные получают 503 с Retry-After: ADMISSION_RETRY_AFTER секунд
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_LOGIN_LIMIT = int(os.getenv("ADMISSION_LOGIN_LIMIT", "16"))
+ADMISSION_LOGIN_QUEUE = int(os.getenv("ADMISSION_LOGIN_QUEUE", "64"))
+ADMISSION_LISTINGS_LIMIT = int(os.getenv("ADMISSION_LISTINGS_LIMIT", "64"))
+ADMISSION_LISTINGS_QUEUE = int(os.getenv("ADMISSION_LISTINGS_QUEUE", "256"))
+
+# Частота входа для одного имени пользователя с одного адреса: в минуту и подряд
+LOGIN_RATE_PER_MINUTE = float(os.getenv("LOGIN_RATE_PER_MINUTE", "10"))
+LOGIN_RATE_BURST = int(os.getenv("LOGIN_RATE_BURST", "5"))
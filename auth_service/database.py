@@ -2,7 +2,7 @@ import logging
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+from config import DATABASE_URL, DATABASE_REPLICA_URL
 
 # Логирование для отладки
 logging.basicConfig(level=logging.INFO)
@@ -10,4 +10,8 @@ logging.info(f"Using DATABASE_URL: {DATABASE_URL}")
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Реплика для чтения, см. replica.py; без DATABASE_REPLICA_URL все чтения идут в основную БД
+replica_engine = create_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None
+ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) if replica_engine else None
 Base = declarative_base()
\ No newline at end of file
@@ -3,14 +3,18 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from datetime import datetime, timedelta, timezone
+import re
 import uvicorn
 import logging
 
 from database import engine, Base, SessionLocal
+import admission
 import auth
 import possibility
+import replica
 from models import AccessRefreshToken
-from config import PREFIX_AUTH_API, PREFIX_POSSIBILITY_API, REFRESH_TOKEN_EXPIRE_DAYS, HOST, PORT
+from config import PREFIX_AUTH_API, PREFIX_POSSIBILITY_API, REFRESH_TOKEN_EXPIRE_DAYS, HOST, PORT, \
+    ADMISSION_LOGIN_LIMIT, ADMISSION_LOGIN_QUEUE, ADMISSION_LISTINGS_LIMIT, ADMISSION_LISTINGS_QUEUE
 
 
 @asynccontextmanager
@@ -24,11 +28,13 @@ async def lifespan(_: FastAPI):
     scheduler.add_job(clean_expired_tokens, "interval", hours=24)
     scheduler.start()
     logging.info("Scheduler started")
+    replica.start()
 
     yield
 
     # Shutdown
     logging.info("Shutting down...")
+    await replica.stop()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -41,6 +47,15 @@ origins = [
     "http://127.0.0.1:8003",
 ]
 
+# Группы маршрутов с отдельными лимитами; добавляется раньше CORS, чтобы ответ 503 получал CORS-заголовки.
+# Вход, регистрация и обновление токена упираются в хэширование паролей и подпись токенов
+app.add_middleware(admission.AdmissionMiddleware, groups=[
+    admission.RouteGroup("login", ("POST",), rf"{re.escape(PREFIX_AUTH_API)}/(login|register|token/refresh)$",
+                         ADMISSION_LOGIN_LIMIT, ADMISSION_LOGIN_QUEUE),
+    admission.RouteGroup("listings", ("GET",), rf"{re.escape(PREFIX_POSSIBILITY_API)}/",
+                         ADMISSION_LISTINGS_LIMIT, ADMISSION_LISTINGS_QUEUE),
+])
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -49,6 +64,8 @@ app.add_middleware(
     allow_headers=["Content-Type", "Authorization"],
 )
 
+app.middleware("http")(replica.track_writes)
+
 # Логирование запросов
 logging.basicConfig(level=logging.INFO)
 
@@ -64,6 +81,7 @@ async def log_requests(request, call_next):
 # Маршруты
 app.include_router(router=auth.router, prefix=PREFIX_AUTH_API)
 app.include_router(router=possibility.router, prefix=PREFIX_POSSIBILITY_API)
+app.include_router(router=admission.router)
 
 
 def clean_expired_tokens():
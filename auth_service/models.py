@@ -1,6 +1,6 @@
 import datetime
 
-from sqlalchemy import Column, Integer, String, Enum, Boolean, DateTime, Text
+from sqlalchemy import Column, Integer, String, Enum, Boolean, DateTime, Text, BigInteger
 
 from database import Base
 import enum
@@ -37,3 +37,11 @@ class AccessRefreshToken(Base):
     secret_key = Column(String(50), nullable=False)
     algorithm = Column(String(20), nullable=False)
     created_at = Column(DateTime(), default=datetime.datetime.now(datetime.timezone.utc))
+
+
+class ReplicaHeartbeat(Base):
+    # Отметка времени, которую основная БД пишет, а реплика догоняет; по ней меряется отставание, см. replica.py
+    __tablename__ = "replica_heartbeat"
+
+    id = Column(Integer(), primary_key=True)
+    written_at = Column(BigInteger(), nullable=False)  # Unix-время, миллисекунды
@@ -8,6 +8,8 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
 import models, database, utils, schemas
+from responses import list_response
+from replica import get_read_db
 from config import MAX_IMAGE_SIZE, UPLOAD_DIR
 
 router = APIRouter()
@@ -22,7 +24,7 @@ def get_db():
 
 
 @router.get("/user")
-def user(db: Session = Depends(get_db), token: str = Depends(utils.oauth2_scheme)):
+def user(db: Session = Depends(get_read_db), token: str = Depends(utils.oauth2_scheme)):
 
     data = utils.decode_token(token)
 
@@ -58,18 +60,22 @@ def user(db: Session = Depends(get_db), token: str = Depends(utils.oauth2_scheme
 
 
 @router.get("/users", response_model=List[schemas.UserResponse])
-def get_users(db: Session = Depends(get_db), token: str = Depends(utils.oauth2_scheme)):
+def get_users(db: Session = Depends(get_read_db), token: str = Depends(utils.oauth2_scheme)):
     data = utils.decode_token(token)
     db_admin = db.query(models.User).filter(cast("ColumnElement[bool]", models.User.username == data["sub"] and models.User.is_active)).first()
     if not db_admin or db_admin.role != models.Role.admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can view users")
 
     users = db.query(models.User).filter(cast("ColumnElement[bool]", models.User.id != db_admin.id)).all()
-    return users
+    return list_response([
+        {"id": u.id, "first_name": u.first_name, "second_name": u.second_name or "", "username": u.username,
+         "role": u.role.value, "image": None}
+        for u in users
+    ])
 
 
 @router.get("/user/{user_id}", response_model=schemas.UserResponse)
-def get_user(user_id: int, db: Session = Depends(get_db)):
+def get_user(user_id: int, db: Session = Depends(get_read_db)):
     db_user = db.query(models.User).filter(cast("ColumnElement[bool]", models.User.id == user_id and models.User.is_active)).first()
     if not db_user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can view users")
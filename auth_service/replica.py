@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+
+from fastapi import Request
+from sqlalchemy import select, update
+from sqlalchemy.orm import sessionmaker
+
+import models
+import database
+from config import DATABASE_REPLICA_MAX_LAG, DATABASE_REPLICA_STICKY_SECONDS, DATABASE_REPLICA_CHECK_INTERVAL
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# Выше этого числа клиентов словарь привязок чистится от истёкших записей
+MAX_STICKY_CLIENTS = 10000
+# Cookie с Unix-временем (мс), до которого чтения клиента идут в основную БД: клиент приносит её
+# в любой воркер, без общего хранилища и без запроса к основной БД на каждое чтение
+STICKY_COOKIE = "replica_sticky_until"
+
+# Ключ клиента -> time.monotonic(), до которого его чтения идут в основную БД (в пределах процесса,
+# для клиентов без cookie — например, других сервисов)
+_sticky = {}
+# Последнее измеренное отставание реплики в секундах; None — не измерено или реплика недоступна
+_state = {"lag": None}
+_tasks = []
+
+
+def client_key(request: Request) -> str:
+    # Пользователь определяется по токену; без токена — по адресу клиента
+    credentials = request.headers.get("Authorization") or (request.client.host if request.client else "")
+    return hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def mark_write(request: Request):
+    now = time.monotonic()
+    if len(_sticky) >= MAX_STICKY_CLIENTS:
+        for key in [key for key, until in _sticky.items() if until <= now]:
+            del _sticky[key]
+    _sticky[client_key(request)] = now + DATABASE_REPLICA_STICKY_SECONDS
+
+
+async def track_writes(request: Request, call_next):
+    # Middleware: после любого изменяющего запроса клиент читает свои записи из основной БД
+    response = await call_next(request)
+    if request.method not in SAFE_METHODS:
+        mark_write(request)
+        if database.ReplicaSessionLocal is not None:
+            until = int((time.time() + DATABASE_REPLICA_STICKY_SECONDS) * 1000)
+            response.set_cookie(STICKY_COOKIE, str(until), max_age=math.ceil(DATABASE_REPLICA_STICKY_SECONDS),
+                                httponly=True, samesite="lax")
+    return response
+
+
+def sticky_cookie(request: Request) -> bool:
+    # Подделанная cookie лишь отправляет чтения самого клиента в основную БД
+    until = request.cookies.get(STICKY_COOKIE, "")
+    return until.isdigit() and int(until) > time.time() * 1000
+
+
+def use_replica(request: Request) -> bool:
+    if database.ReplicaSessionLocal is None:
+        return False
+    lag = _state["lag"]
+    if lag is None or lag > DATABASE_REPLICA_MAX_LAG:
+        return False
+    if _sticky.get(client_key(request), 0) > time.monotonic():
+        return False
+    # Запись могла пройти через другой воркер
+    return not sticky_cookie(request)
+
+
+def session_factory(request: Request) -> sessionmaker:
+    return database.ReplicaSessionLocal if use_replica(request) else database.SessionLocal
+
+
+def get_read_db(request: Request):
+    # Зависимость только для обработчиков, которые ничего не пишут
+    db = session_factory(request)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def check_lag() -> float | None:
+    # Отставание = сейчас - последняя отметка, которую видит реплика (с точностью до интервала проверки)
+    written_at = int(time.time() * 1000)
+    db = database.SessionLocal()
+    try:
+        heartbeat = models.ReplicaHeartbeat.__table__
+        result = db.execute(update(heartbeat).where(heartbeat.c.id == 1).values(written_at=written_at))
+        if result.rowcount == 0:
+            db.execute(heartbeat.insert().values(id=1, written_at=written_at))
+        db.commit()
+    finally:
+        db.close()
+    db = database.ReplicaSessionLocal()
+    try:
+        seen = db.execute(select(models.ReplicaHeartbeat.written_at).where(models.ReplicaHeartbeat.id == 1)).scalar()
+    finally:
+        db.close()
+    if seen is None:
+        return None
+    return max(0.0, (written_at - seen) / 1000)
+
+
+async def _monitor_loop():
+    healthy = None
+    while True:
+        try:
+            lag = await asyncio.to_thread(check_lag)
+            error = None
+        except Exception as e:
+            lag, error = None, str(e)
+        _state["lag"] = lag
+        # В лог — только смена состояния, а не каждая проверка
+        now_healthy = lag is not None and lag <= DATABASE_REPLICA_MAX_LAG
+        if healthy != now_healthy:
+            healthy = now_healthy
+            if healthy:
+                logging.info(f"Replica in use, lag {lag} s")
+            else:
+                logging.warning(f"Replica lagging or unavailable, reading from primary: lag {lag} s, error {error}")
+        await asyncio.sleep(DATABASE_REPLICA_CHECK_INTERVAL)
+
+
+def start():
+    if database.ReplicaSessionLocal is not None:
+        _tasks.append(asyncio.create_task(_monitor_loop()))
+
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    _state["lag"] = None
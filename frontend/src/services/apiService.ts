@@ -2,7 +2,8 @@ import axios, { AxiosError, AxiosRequestConfig, AxiosResponse, InternalAxiosRequ
 import { useNavigate } from 'react-router-dom';
 
 // Создаем экземпляр axios для избежания циклических зависимостей
-const axiosInstance = axios.create();
+// withCredentials: сервисы ставят cookie replica_sticky_until, чтобы после записи читать из основной БД
+const axiosInstance = axios.create({ withCredentials: true });
 
 
 // Функция для обновления токена
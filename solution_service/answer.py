@@ -1,12 +1,19 @@
+import hashlib
+
 import httpx
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+import canonical
+import idempotency
 import models
 import database
 import utils
 import schemas
-from config import AUTH_SERVICE_HOST, AUTH_SERVICE_PORT, AUTH_SERVICE_POSSIBILITY_PREFIX_API
+from config import AUTH_SERVICE_HOST, AUTH_SERVICE_PORT, AUTH_SERVICE_POSSIBILITY_PREFIX_API, ANSWER_BULK_MAX_ITEMS
 
 router = APIRouter()
 
@@ -19,12 +26,7 @@ def get_db():
         db.close()
 
 
-@router.post("/create", response_model=schemas.AnswerResponse)
-async def create_answer(
-        answer: schemas.AnswerCreate,
-        db: Session = Depends(get_db),
-        token: str = Depends(utils.oauth2_scheme)
-):
+async def get_user_data(token: str) -> dict:
     async with httpx.AsyncClient() as client:
         response = await client.get(
             f"http://{AUTH_SERVICE_HOST}:{AUTH_SERVICE_PORT}/{AUTH_SERVICE_POSSIBILITY_PREFIX_API}/user",
@@ -33,13 +35,121 @@ async def create_answer(
         if response.status_code != status.HTTP_200_OK:
             raise HTTPException(status_code=response.status_code,
                                 detail=response.json().get("detail", "Failed to fetch user data"))
-        user_data = response.json()
+        return response.json()
+
 
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.strip().encode()).hexdigest()
+
+
+def find_reusable_answer(db: Session, answer: schemas.AnswerCreate, hashed: str) -> models.Answer | None:
+    # Правка задачи без изменения ответа (например, только заголовка) оставляет прежний эталон
+    if answer.current_answer_id:
+        current = db.get(models.Answer, answer.current_answer_id)
+        if current and current.is_active and content_hash(current.text) == hashed:
+            return current
+    if answer.task_id:
+        return db.query(models.Answer).filter(
+            models.Answer.task_id == answer.task_id,
+            models.Answer.content_hash == hashed,
+            models.Answer.is_active,
+        ).order_by(models.Answer.id.desc()).first()
+    return None
+
+
+def replay_answer(db: Session, hashed: str, request_fingerprint: str) -> models.Answer | None:
+    answer_id = idempotency.lookup(db, hashed, request_fingerprint)
+    if answer_id is None:
+        return None
+    db_answer = db.get(models.Answer, answer_id)
+    if db_answer is None:
+        idempotency.forget(db, hashed)
+    return db_answer
+
+
+@router.post("/create", response_model=schemas.AnswerResponse)
+async def create_answer(
+        answer: schemas.AnswerCreate,
+        db: Session = Depends(get_db),
+        token: str = Depends(utils.oauth2_scheme),
+        idempotency_key: str | None = Header(None, alias="Idempotency-Key")
+):
+    # task-сервис передаёт ключ своего запроса: повтор создания задачи не плодит эталоны
+    user_data = await get_user_data(token)
     if user_data["role"] == "student":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers or admins can create answers")
 
-    db_answer = models.Answer(text=answer.answer, user_id=user_data["id"])
+    hashed = request_fingerprint = None
+    if idempotency_key:
+        hashed = idempotency.key_hash("answer", user_data["id"], idempotency_key)
+        request_fingerprint = idempotency.request_hash(answer.answer)
+        db_answer = replay_answer(db, hashed, request_fingerprint)
+        if db_answer is not None:
+            return db_answer
+
+    answer_hash = content_hash(answer.answer)
+    db_answer = find_reusable_answer(db, answer, answer_hash)
+    if db_answer is not None:
+        return db_answer
+
+    db_answer = models.Answer(text=answer.answer, user_id=user_data["id"], task_id=answer.task_id,
+                              content_hash=answer_hash, canonical=canonical.compile_answer(answer.answer))
     db.add(db_answer)
-    db.commit()
+    try:
+        if hashed:
+            db.flush()
+            key = idempotency.make_key(hashed, request_fingerprint)
+            key.resource_id = db_answer.id
+            db.add(key)
+        db.commit()
+    except IntegrityError:
+        # Параллельный повтор с тем же ключом успел раньше
+        if not hashed:
+            raise
+        db.rollback()
+        db_answer = replay_answer(db, hashed, request_fingerprint)
+        if db_answer is None:
+            raise
+        return db_answer
     db.refresh(db_answer)
-    return db_answer
\ No newline at end of file
+    return db_answer
+
+
+@router.post("/create/bulk", response_model=List[schemas.AnswerResponse])
+async def create_answers_bulk(
+        bulk: schemas.AnswerBulkCreate,
+        db: Session = Depends(get_db),
+        token: str = Depends(utils.oauth2_scheme)
+):
+    # Импорт набора задач: все эталоны одной проверкой токена и одной транзакцией.
+    # Ответ — эталоны в порядке запроса; одинаковые тексты получают одну запись
+    if len(bulk.answers) > ANSWER_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {ANSWER_BULK_MAX_ITEMS} answers per request")
+    user_data = await get_user_data(token)
+    if user_data["role"] == "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers or admins can create answers")
+
+    by_hash = {}
+    for text in bulk.answers:
+        answer_hash = content_hash(text)
+        if answer_hash not in by_hash:
+            by_hash[answer_hash] = models.Answer(text=text, user_id=user_data["id"], content_hash=answer_hash,
+                                                 canonical=canonical.compile_answer(text))
+    db.add_all(by_hash.values())
+    # Объекты не истекают при commit: id заполнен после flush, перечитывать каждую строку не нужно
+    db.expire_on_commit = False
+    db.commit()
+    return [by_hash[content_hash(text)] for text in bulk.answers]
+
+
+@router.get("/answers", response_model=List[schemas.AnswerResponse])
+async def get_answers(ids: List[int] = Query(...), db: Session = Depends(get_db),
+                      token: str = Depends(utils.oauth2_scheme)):
+    # Эталоны нескольких задач одним запросом (экспорт набора задач из task-сервиса)
+    if len(ids) > ANSWER_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {ANSWER_BULK_MAX_ITEMS} ids per request")
+    user_data = await get_user_data(token)
+    if user_data["role"] == "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers or admins can view answers")
+    return db.query(models.Answer).filter(models.Answer.id.in_(ids)).all()
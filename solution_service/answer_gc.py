@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from fastapi import status
+
+import models
+import database
+from config import TASK_SERVICE_HOST, TASK_SERVICE_PORT, TASK_SERVICE_TASK_PREFIX_API, \
+    ANSWER_GC_GRACE, ANSWER_GC_CHUNK_SIZE
+
+
+async def fetch_referenced_answer_ids() -> set | None:
+    async with httpx.AsyncClient() as client:
+        response = await client.get(
+            f"http://{TASK_SERVICE_HOST}:{TASK_SERVICE_PORT}/{TASK_SERVICE_TASK_PREFIX_API}/answer-ids"
+        )
+        if response.status_code != status.HTTP_200_OK:
+            logging.error(f"Answer GC: failed to fetch referenced answers: {response.status_code}")
+            return None
+        return set(response.json())
+
+
+def delete_orphans(referenced: set) -> int:
+    # Эталоны старше ANSWER_GC_GRACE, на которые не ссылается ни одна задача (в том числе удалённая).
+    # Просматриваем только id порциями по возрастанию, удаляем по списку id
+    created_before = datetime.now(timezone.utc) - timedelta(seconds=ANSWER_GC_GRACE)
+    deleted = 0
+    after_id = 0
+    db = database.SessionLocal()
+    try:
+        while True:
+            ids = [row.id for row in db.query(models.Answer.id).filter(
+                models.Answer.id > after_id,
+                models.Answer.created_at < created_before,
+            ).order_by(models.Answer.id).limit(ANSWER_GC_CHUNK_SIZE)]
+            if not ids:
+                break
+            after_id = ids[-1]
+            orphans = [answer_id for answer_id in ids if answer_id not in referenced]
+            if orphans:
+                db.query(models.Answer).filter(models.Answer.id.in_(orphans)).delete(synchronize_session=False)
+                db.commit()
+                deleted += len(orphans)
+        return deleted
+    finally:
+        db.close()
+
+
+async def collect():
+    try:
+        referenced = await fetch_referenced_answer_ids()
+    except httpx.HTTPError as e:
+        logging.error(f"Answer GC: task service unavailable: {str(e)}")
+        return
+    # Пустой список при непустой таблице задач не отличить от сбоя — в таком случае ничего не удаляем
+    if not referenced:
+        return
+    deleted = await asyncio.to_thread(delete_orphans, referenced)
+    logging.info(f"Answer GC: deleted {deleted} unreferenced answers")
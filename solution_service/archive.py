@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import DateTime, and_, func, insert, literal, or_, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+import models
+import database
+from attempt import get_user_data
+from config import ARCHIVE_GRADED_AGE_DAYS, ARCHIVE_INACTIVE_AGE_DAYS, ARCHIVE_CHUNK_SIZE, ATTEMPTS_PAGE_MAX_LIMIT
+from utils import oauth2_scheme
+
+router = APIRouter()
+
+# Колонки, общие для attempts и attempts_archive
+COLUMNS = [column.name for column in models.ArchivedAttempt.__table__.columns if column.name != "archived_at"]
+# Каждый замер задержки повторяется, в отчёт идёт лучший результат
+REPORT_RUNS = 3
+
+_lock = asyncio.Lock()
+
+
+def archivable(graded_before: datetime, inactive_before: datetime):
+    # PENDING не переносится никогда: такая попытка ещё ждёт оценки учителя
+    return or_(
+        and_(
+            models.Attempt.is_active,
+            models.Attempt.status != models.AttemptStatus.PENDING,
+            models.Attempt.created_at < graded_before,
+        ),
+        and_(
+            models.Attempt.is_active.is_(False),
+            models.Attempt.updated_at < inactive_before,
+        ),
+    )
+
+
+def archive_chunk(db: Session, ids: list, condition) -> tuple[int, int]:
+    # Строки блокируются и условие проверяется заново: попытку, которую сейчас оценивают,
+    # пропускаем до следующего запуска, а не теряем её изменение при DELETE
+    locked = db.query(models.Attempt.id, models.Attempt.is_active).filter(
+        models.Attempt.id.in_(ids), condition
+    ).with_for_update(skip_locked=True).all()
+    if not locked:
+        db.rollback()
+        return 0, 0
+    locked_ids = [row.id for row in locked]
+    source = select(
+        *(models.Attempt.__table__.c[name] for name in COLUMNS),
+        literal(datetime.now(timezone.utc), DateTime).label("archived_at"),
+    ).where(models.Attempt.id.in_(locked_ids))
+    db.execute(insert(models.ArchivedAttempt).from_select(COLUMNS + ["archived_at"], source))
+    db.query(models.Attempt).filter(models.Attempt.id.in_(locked_ids)).delete(synchronize_session=False)
+    db.commit()
+    inactive = sum(1 for row in locked if not row.is_active)
+    return len(locked) - inactive, inactive
+
+
+def archive_attempts() -> dict:
+    # Один проход по attempts в порядке id; каждая порция — отдельная транзакция INSERT ... SELECT + DELETE.
+    # Счётчики статистики, рейтинг и прогресс не меняются: их пересчёты читают и архив (models.scored_attempts)
+    now = datetime.now(timezone.utc)
+    condition = archivable(now - timedelta(days=ARCHIVE_GRADED_AGE_DAYS), now - timedelta(days=ARCHIVE_INACTIVE_AGE_DAYS))
+    moved = {"graded": 0, "inactive": 0}
+    after_id = 0
+    db = database.SessionLocal()
+    try:
+        while True:
+            ids = [row.id for row in db.query(models.Attempt.id).filter(
+                models.Attempt.id > after_id, condition
+            ).order_by(models.Attempt.id).limit(ARCHIVE_CHUNK_SIZE)]
+            if not ids:
+                break
+            after_id = ids[-1]
+            graded, inactive = archive_chunk(db, ids, condition)
+            moved["graded"] += graded
+            moved["inactive"] += inactive
+        return moved
+    finally:
+        db.close()
+
+
+def table_size(db: Session, table: str) -> int | None:
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return db.execute(text("SELECT pg_total_relation_size(:table)"), {"table": table}).scalar()
+    if dialect == "mysql":
+        return db.execute(text(
+            "SELECT data_length + index_length FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = :table"
+        ), {"table": table}).scalar()
+    if dialect == "sqlite":
+        try:
+            return db.execute(text("SELECT SUM(pgsize) FROM dbstat WHERE name = :table"), {"table": table}).scalar()
+        except DBAPIError:
+            # SQLite собран без dbstat
+            return None
+    return None
+
+
+def latency_ms(run) -> float:
+    best = None
+    for _ in range(REPORT_RUNS):
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 2)
+
+
+def report(db: Session) -> dict:
+    # Размер горячей таблицы и задержка запросов той же формы, что у списков, статистики и очереди проверки
+    active = db.query(models.Attempt.id).filter(models.Attempt.is_active)
+    return {
+        "hot_rows": db.query(func.count(models.Attempt.id)).scalar(),
+        "hot_inactive_rows": db.query(func.count(models.Attempt.id)).filter(models.Attempt.is_active.is_(False)).scalar(),
+        "archived_rows": db.query(func.count(models.ArchivedAttempt.id)).scalar(),
+        "hot_size_bytes": table_size(db, models.Attempt.__tablename__),
+        "archive_size_bytes": table_size(db, models.ArchivedAttempt.__tablename__),
+        "latency_ms": {
+            "listing": latency_ms(lambda: active.order_by(models.Attempt.id.desc()).limit(ATTEMPTS_PAGE_MAX_LIMIT).all()),
+            "pending": latency_ms(lambda: active.filter(
+                models.Attempt.status == models.AttemptStatus.PENDING
+            ).order_by(models.Attempt.id).limit(ATTEMPTS_PAGE_MAX_LIMIT).all()),
+            "stats": latency_ms(lambda: db.query(models.Attempt.task_id, func.count(models.Attempt.id)).filter(
+                models.Attempt.is_active
+            ).group_by(models.Attempt.task_id).all()),
+        },
+    }
+
+
+def make_report() -> dict:
+    db = database.SessionLocal()
+    try:
+        return report(db)
+    finally:
+        db.close()
+
+
+async def run() -> dict | None:
+    # Запуск по расписанию и вручную не пересекаются; None — архивация уже идёт
+    if _lock.locked():
+        return None
+    async with _lock:
+        before = await asyncio.to_thread(make_report)
+        moved = await asyncio.to_thread(archive_attempts)
+        after = await asyncio.to_thread(make_report)
+    logging.info(
+        f"Archive: moved {moved['graded']} graded and {moved['inactive']} inactive attempts, "
+        f"hot rows {before['hot_rows']} -> {after['hot_rows']}, "
+        f"latency {before['latency_ms']} -> {after['latency_ms']} ms"
+    )
+    return {"moved": moved, "before": before, "after": after}
+
+
+@router.get("/archive/report")
+async def get_archive_report(token: str = Depends(oauth2_scheme)):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can view the archive report")
+
+    return await asyncio.to_thread(make_report)
+
+
+@router.post("/archive/run")
+async def run_archive(token: str = Depends(oauth2_scheme)):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can run archiving")
+
+    result = await run()
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Archiving is already running")
+    return result
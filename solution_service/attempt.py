@@ -2,16 +2,27 @@ import base64
 import mimetypes
 import os
 from datetime import datetime, timezone
-from typing import List, cast
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket
+from typing import List, Literal, cast
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status, WebSocket
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, func, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 import httpx
-import asyncio
+import orjson
 import logging
 
+import admission
+import batching
+import bulk
+import canonical
 import models
+import connections
 import database
+import events
+import idempotency
 import schemas
+import stats
 from config import (
     AUTH_SERVICE_HOST,
     AUTH_SERVICE_PORT,
@@ -19,11 +30,18 @@ from config import (
     TASK_SERVICE_HOST,
     TASK_SERVICE_PORT,
     TASK_SERVICE_TASK_PREFIX_API, MAX_IMAGE_SIZE, UPLOAD_DIR, TASK_SERVICE_THEME_PREFIX_API,
+    ATTEMPTS_STREAM_CHUNK_SIZE, ATTEMPTS_PAGE_MAX_LIMIT, ATTEMPTS_SYNC_LIMIT, SSE_RETRY_MS, BULK_GRADE_MAX_ITEMS,
+    ATTEMPT_BATCH_MAX_ITEMS, ATTEMPT_RATE_PER_MINUTE, ATTEMPT_RATE_BURST,
 )
+from responses import list_response
+from replica import get_read_db
 from utils import oauth2_scheme, ensure_directories_exist
 
 router = APIRouter()
 
+# Частота отправки попыток на пользователя (токен), проверяется до обращения к auth-сервису
+submission_limiter = admission.TokenBucket("submissions", ATTEMPT_RATE_PER_MINUTE, ATTEMPT_RATE_BURST)
+
 
 def get_db():
     db = database.SessionLocal()
@@ -67,6 +85,17 @@ async def get_task_data(task_id: int) -> dict:
         return response.json()
 
 
+async def get_tasks_data(task_ids: list) -> list:
+    async with httpx.AsyncClient() as client:
+        response = await client.get(
+            f"http://{TASK_SERVICE_HOST}:{TASK_SERVICE_PORT}/{TASK_SERVICE_TASK_PREFIX_API}/batch",
+            params={"ids": task_ids}
+        )
+        if response.status_code != status.HTTP_200_OK:
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch tasks")
+        return response.json()
+
+
 async def get_theme_data(theme_id: int) -> dict:
     async with httpx.AsyncClient() as client:
         response = await client.get(
@@ -77,34 +106,346 @@ async def get_theme_data(theme_id: int) -> dict:
         return response.json()
 
 
+async def get_teacher_tasks_data(token: str) -> list:
+    async with httpx.AsyncClient() as client:
+        response = await client.get(
+            f"http://{TASK_SERVICE_HOST}:{TASK_SERVICE_PORT}/{TASK_SERVICE_TASK_PREFIX_API}/teacher",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        if response.status_code != status.HTTP_200_OK:
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch teacher tasks")
+        return response.json()
+
+
+async def get_theme_tasks_data(theme_id: int) -> list:
+    async with httpx.AsyncClient() as client:
+        response = await client.get(
+            f"http://{TASK_SERVICE_HOST}:{TASK_SERVICE_PORT}/{TASK_SERVICE_TASK_PREFIX_API}/",
+            params={"theme_id": theme_id, "view": "summary"}
+        )
+        if response.status_code != status.HTTP_200_OK:
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch theme tasks")
+        return response.json()
+
+
+def read_image_data(image_path: str | None) -> str | None:
+    if not image_path or not os.path.exists(image_path):
+        return None
+    try:
+        with open(image_path, "rb") as image_file:
+            base64_string = base64.b64encode(image_file.read()).decode("utf-8")
+            mime_type, _ = mimetypes.guess_type(image_path)
+            mime_type = mime_type or "image/jpeg"  # Значение по умолчанию
+            return f"data:{mime_type};base64,{base64_string}"
+    except Exception as e:
+        print(f"Error reading image: {str(e)}")
+        return None
+
+
+def get_answer_canonicals(db: Session, answer_ids: list) -> dict:
+    forms = {answer_id: canonical.cache.get(answer_id) for answer_id in set(answer_ids)}
+    missing = [answer_id for answer_id, answer_form in forms.items() if answer_form is None]
+    if missing:
+        answers = db.query(models.Answer).filter(models.Answer.id.in_(missing)).all()
+        if len(answers) != len(missing):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Answer not found")
+        for answer in answers:
+            if not canonical.is_current(answer.canonical):
+                # Ответы, созданные до появления канонической формы, разбираются при первой проверке
+                answer.canonical = canonical.compile_answer(answer.text)
+            canonical.cache.put(answer.id, answer.canonical)
+            forms[answer.id] = answer.canonical
+    return forms
+
+
+def get_answer_canonical(db: Session, answer_id: int) -> dict:
+    return get_answer_canonicals(db, [answer_id])[answer_id]
+
+
+async def _cached(cache: dict, key: tuple, fetch) -> dict | None:
+    # Кэш на время одного листинга: задачи, темы и пользователи повторяются от попытки к попытке
+    if key not in cache:
+        try:
+            cache[key] = await fetch()
+        except (HTTPException, httpx.HTTPError) as e:
+            print(f"Error fetching {key[0]} {key[1]}: {str(e)}")
+            cache[key] = None
+    return cache[key]
+
+
+async def enrich_attempt(
+        attempt: models.Attempt,
+        db: Session,
+        token: str,
+        cache: dict,
+        student_data: dict | None = None,
+        author_data: dict | None = None,
+) -> dict | None:
+    task_data = await _cached(cache, ("task", attempt.task_id), lambda: get_task_data(attempt.task_id))
+    if task_data is None:
+        return None  # Пропускаем попытку, если задача недоступна
+
+    theme_data = await _cached(cache, ("theme", task_data["theme_id"]),
+                               lambda: get_theme_data(task_data["theme_id"])) or {"name": "Unknown"}
+    if student_data is None:
+        student_data = await _cached(cache, ("user", attempt.student_id),
+                                     lambda: get_user_data_by_id(attempt.student_id, token)) or {"username": "Unknown"}
+    if author_data is None:
+        author_data = await _cached(cache, ("user", task_data["user_id"]),
+                                    lambda: get_user_data_by_id(task_data["user_id"], token)) or {"username": "Unknown"}
+
+    answer_key = ("answer", task_data["answer_id"])
+    if answer_key not in cache:
+        db_system_answer = db.query(models.Answer).filter(
+            models.Answer.id == task_data["answer_id"],
+            models.Answer.is_active
+        ).first()
+        cache[answer_key] = db_system_answer.text if db_system_answer else None
+
+    return {
+        "id": attempt.id,
+        "task_id": task_data.get("id"),
+        "task_name": task_data.get("title", "-"),
+        "theme_id": theme_data.get("id"),
+        "theme_name": theme_data.get("title", "-"),
+        "student_id": student_data.get("id", None),
+        "student_username": student_data.get("username", "-"),
+        "task_author_id": author_data.get("id", None),
+        "task_author_username": author_data.get("username", "-"),
+        "system_answer": cache[answer_key],
+        "answer": attempt.answer,
+        "status": attempt.status,
+        "system_grade": attempt.system_grade,
+        "teacher_grade": attempt.teacher_grade,
+        "created_at": attempt.created_at,
+        "image_data": read_image_data(attempt.image_path),
+    }
+
+
+def attempt_filters(
+        status_filter: schemas.AttemptStatus | None = Query(None, alias="status"),
+        task_id: int | None = None,
+        theme_id: int | None = None,
+        created_from: datetime | None = None,
+        created_to: datetime | None = None,
+        after_id: int | None = None,
+        limit: int | None = Query(None, ge=1, le=ATTEMPTS_PAGE_MAX_LIMIT),
+        output_format: Literal["json", "ndjson"] = Query("json", alias="format"),
+) -> dict:
+    return {
+        "status": status_filter,
+        "task_id": task_id,
+        "theme_id": theme_id,
+        "created_from": created_from,
+        "created_to": created_to,
+        "after_id": after_id,
+        "limit": limit,
+        "format": output_format,
+    }
+
+
+def filter_attempts(query, filters: dict, task_ids: list | None = None, student_id: int | None = None,
+                    model=models.Attempt):
+    # Keyset-пагинация по id: страница начинается строго после after_id.
+    # model — models.Attempt или models.ArchivedAttempt (архив читается только явно, см. /attempts/*/archive)
+    query = query.filter(cast("ColumnElement[bool]", model.is_active))
+    if task_ids is not None:
+        query = query.filter(model.task_id.in_(task_ids))
+    if student_id is not None:
+        query = query.filter(cast("ColumnElement[bool]", model.student_id == student_id))
+    if filters["status"]:
+        query = query.filter(cast("ColumnElement[bool]", model.status == models.AttemptStatus(filters["status"].value)))
+    if filters["task_id"]:
+        query = query.filter(cast("ColumnElement[bool]", model.task_id == filters["task_id"]))
+    if filters["created_from"]:
+        query = query.filter(cast("ColumnElement[bool]", model.created_at >= filters["created_from"]))
+    if filters["created_to"]:
+        query = query.filter(cast("ColumnElement[bool]", model.created_at < filters["created_to"]))
+    if filters["after_id"]:
+        query = query.filter(cast("ColumnElement[bool]", model.id > filters["after_id"]))
+    query = query.order_by(model.id)
+    if filters["limit"]:
+        query = query.limit(filters["limit"])
+    return query
+
+
+async def list_attempts(
+        db: Session,
+        token: str,
+        filters: dict,
+        task_ids: list | None = None,
+        student_id: int | None = None,
+        student_data: dict | None = None,
+        author_data: dict | None = None,
+        model=models.Attempt,
+):
+    if filters["format"] == "ndjson":
+        return StreamingResponse(
+            stream_attempts(token, filters, task_ids, student_id, student_data, author_data, model, db.get_bind()),
+            media_type="application/x-ndjson",
+        )
+
+    cache = {}
+    attempts_list = []
+    for attempt in filter_attempts(db.query(model), filters, task_ids, student_id, model):
+        attempt_data = await enrich_attempt(attempt, db, token, cache, student_data, author_data)
+        if attempt_data is not None:
+            attempts_list.append(attempt_data)
+    return list_response(attempts_list)
+
+
+async def stream_attempts(
+        token: str,
+        filters: dict,
+        task_ids: list | None,
+        student_id: int | None,
+        student_data: dict | None,
+        author_data: dict | None,
+        model=models.Attempt,
+        bind=database.engine,
+):
+    # Сессия запроса закрывается до отправки тела, поэтому поток открывает свои:
+    # одна держит серверный курсор, вторая нужна для поиска эталонных ответов
+    # (PyMySQL не позволяет выполнять запросы, пока читается небуферизованный курсор).
+    # bind — движок сессии запроса: основная БД или реплика.
+    stream_db = database.SessionLocal(bind=bind)
+    lookup_db = database.SessionLocal(bind=bind)
+    try:
+        cache = {}
+        query = filter_attempts(stream_db.query(model), filters, task_ids, student_id, model)
+        for attempt in query.execution_options(stream_results=True).yield_per(ATTEMPTS_STREAM_CHUNK_SIZE):
+            attempt_data = await enrich_attempt(attempt, lookup_db, token, cache, student_data, author_data)
+            if attempt_data is not None:
+                yield orjson.dumps(attempt_data) + b"\n"
+    finally:
+        lookup_db.close()
+        stream_db.close()
+
+
+async def sync_attempts(
+        db: Session,
+        token: str,
+        query,
+        since: int,
+        limit: int,
+        current_seq: int,
+        student_data: dict | None = None,
+        author_data: dict | None = None,
+) -> dict:
+    # Изменения после курсора в порядке change_seq; неактивные строки уходят надгробиями
+    attempts = query.filter(
+        cast("ColumnElement[bool]", models.Attempt.change_seq > since)
+    ).order_by(models.Attempt.change_seq).limit(limit).all()
+
+    cache = {}
+    attempts_list = []
+    deleted = []
+    for attempt in attempts:
+        if not attempt.is_active:
+            deleted.append(attempt.id)
+            continue
+        attempt_data = await enrich_attempt(attempt, db, token, cache, student_data, author_data)
+        if attempt_data is not None:
+            attempts_list.append(attempt_data)
+
+    has_more = len(attempts) == limit
+    if has_more:
+        cursor = attempts[-1].change_seq
+    else:
+        cursor = max([current_seq] + [attempt.change_seq for attempt in attempts[-1:]])
+    return {"cursor": cursor, "has_more": has_more, "attempts": attempts_list, "deleted": deleted}
+
+
+async def resolve_theme_filter(filters: dict, task_ids: list | None = None) -> list | None:
+    if not filters["theme_id"]:
+        return task_ids
+    theme_task_ids = [task["id"] for task in await get_theme_tasks_data(filters["theme_id"])]
+    if task_ids is None:
+        return theme_task_ids
+    theme_task_ids = set(theme_task_ids)
+    return [task_id for task_id in task_ids if task_id in theme_task_ids]
+
+
+def attempt_response(db_attempt: models.Attempt) -> dict:
+    attempt = {
+        'id': db_attempt.id,
+        'task_id': db_attempt.task_id,
+        'student_id': db_attempt.student_id,
+        'answer': db_attempt.answer,
+        'status': db_attempt.status,
+        'system_grade': db_attempt.system_grade,
+        'teacher_grade': db_attempt.teacher_grade,
+        'created_at': db_attempt.created_at,
+        'image_path': db_attempt.image_path,
+    }
+    image_path = attempt["image_path"]
+    image_data = None
+    if image_path and os.path.exists(image_path):
+        try:
+            with open(image_path, "rb") as image_file:
+                base64_string = base64.b64encode(image_file.read()).decode("utf-8")
+                mime_type, _ = mimetypes.guess_type(image_path)
+                mime_type = mime_type or "image/jpeg"  # Значение по умолчанию
+                image_data = f"data:{mime_type};base64,{base64_string}"
+        except Exception as e:
+            print(f"Error reading image: {str(e)}")
+    attempt["image_data"] = image_data
+    return attempt
+
+
+def replay_attempt(db: Session, hashed: str, request_fingerprint: str) -> dict | None:
+    attempt_id = idempotency.lookup(db, hashed, request_fingerprint)
+    if attempt_id is None:
+        return None
+    db_attempt = db.get(models.Attempt, attempt_id)
+    if not db_attempt or not db_attempt.is_active:
+        # Попытку удалили — повтор создаст новую
+        idempotency.forget(db, hashed)
+        return None
+    return attempt_response(db_attempt)
+
+
 @router.post("/attempts", response_model=schemas.AttemptResponse)
 async def create_attempt(
         attempt: schemas.AttemptCreate,
         db: Session = Depends(get_db),
-        token: str = Depends(oauth2_scheme)
+        token: str = Depends(oauth2_scheme),
+        idempotency_key: str | None = Header(None, alias="Idempotency-Key")
 ):
     user_data = await get_user_data(token)
     if user_data["role"] != "student":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only students can submit attempts")
+    # По id пользователя, а не по токену: новый вход или обновление токена не сбрасывают лимит
+    submission_limiter.take(str(user_data["id"]))
+
+    hashed = request_fingerprint = None
+    if idempotency_key:
+        # Повтор после таймаута возвращает уже созданную попытку: без обращения к task-сервису,
+        # повторной записи изображения и дубликата, который учителю пришлось бы проверять
+        hashed = idempotency.key_hash("attempt", user_data["id"], idempotency_key)
+        request_fingerprint = idempotency.request_hash(
+            attempt.task_id, attempt.answer, attempt.image_data.file_name if attempt.image_data else None
+        )
+        replay = replay_attempt(db, hashed, request_fingerprint)
+        if replay is not None:
+            return replay
 
     # Проверяем существование задачи
     task_data = await get_task_data(attempt.task_id)
     # Проверяем ответ
-    answer = db.query(models.Answer).filter(
-        cast("ColumnElement[bool]", models.Answer.id == task_data["answer_id"])).first()
-    if not answer:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Answer not found")
+    answer_form = get_answer_canonical(db, task_data["answer_id"])
 
     # Автоматическая проверка и оценка
-    is_correct = attempt.answer.strip().lower() == answer.text.strip().lower()
+    is_correct = canonical.matches(answer_form, attempt.answer)
     system_grade = 100 if is_correct else 0
     if system_grade == 0:
         db_attempt = models.Attempt(
             task_id=attempt.task_id,
             student_id=user_data["id"],
             answer=attempt.answer,
+            answer_fingerprint=canonical.fingerprint(attempt.answer),
             teacher_grade=0,
-            status=schemas.AttemptStatus.GRADED,
+            status=models.AttemptStatus.GRADED,
             system_grade=system_grade
         )
     else:
@@ -113,14 +454,36 @@ async def create_attempt(
             task_id=attempt.task_id,
             student_id=user_data["id"],
             answer=attempt.answer,
-            status=schemas.AttemptStatus.PENDING,
+            answer_fingerprint=canonical.fingerprint(attempt.answer),
+            status=models.AttemptStatus.PENDING,
             system_grade=system_grade
         )
 
-    # Сохраняем попытку в базе данных, чтобы получить ID
-    db.add(db_attempt)
-    db.commit()
-    db.refresh(db_attempt)
+    key = idempotency.make_key(hashed, request_fingerprint) if hashed else None
+    try:
+        if batching.writer.enabled and not attempt.image_data:
+            # Во время всплеска отправок вставки нескольких запросов фиксируются одним commit.
+            # Соединение запроса возвращаем в пул до ожидания: оно понадобится записывающей задаче
+            db.commit()
+            db_attempt = await batching.writer.submit(db_attempt, task_data, key)
+        else:
+            # Сохраняем попытку в базе данных, чтобы получить ID
+            bulk.insert_attempts(db, [db_attempt], {attempt.task_id: task_data})
+            if key is not None:
+                db.flush()
+                key.resource_id = db_attempt.id
+                db.add(key)
+            db.commit()
+            db.refresh(db_attempt)
+    except IntegrityError:
+        # Параллельный повтор с тем же ключом успел сохранить попытку раньше
+        if key is None:
+            raise
+        db.rollback()
+        replay = replay_attempt(db, hashed, request_fingerprint)
+        if replay is None:
+            raise
+        return replay
 
     # Обработка изображения, если оно есть
     if attempt.image_data:
@@ -142,394 +505,377 @@ async def create_attempt(
             db.refresh(db_attempt)
         except Exception as e:
             # Удаляем попытку в случае ошибки обработки изображения
+            stats.record_change(db, db_attempt.task_id, task_data["user_id"],
+                                (db_attempt.status, db_attempt.teacher_grade), None)
             db.delete(db_attempt)
+            if hashed:
+                idempotency.forget(db, hashed)
             db.commit()
             raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
-    attempt = {
-        'id': db_attempt.id,
-        'task_id': db_attempt.task_id,
-        'student_id': db_attempt.student_id,
-        'answer': db_attempt.answer,
-        'status': db_attempt.status,
-        'system_grade': db_attempt.system_grade,
-        'teacher_grade': db_attempt.teacher_grade,
-        'created_at': db_attempt.created_at,
-        'image_path': db_attempt.image_path,
-    }
-    image_path = attempt["image_path"]
-    image_data = None
-    if image_path and os.path.exists(image_path):
-        try:
-            with open(image_path, "rb") as image_file:
-                base64_string = base64.b64encode(image_file.read()).decode("utf-8")
-                mime_type, _ = mimetypes.guess_type(image_path)
-                mime_type = mime_type or "image/jpeg"  # Значение по умолчанию
-                image_data = f"data:{mime_type};base64,{base64_string}"
-        except Exception as e:
-            print(f"Error reading image: {str(e)}")
-    attempt["image_data"] = image_data
+    await events.publish_attempt(db_attempt, task_data["user_id"])
+    return attempt_response(db_attempt)
 
-    return attempt
+
+@router.post("/attempts/batch", response_model=List[schemas.AttemptBatchResult])
+async def create_attempts_batch(
+        batch: schemas.AttemptBatch,
+        db: Session = Depends(get_db),
+        token: str = Depends(oauth2_scheme)
+):
+    # Все ответы студента на тест одним запросом: одна проверка токена, один запрос задач,
+    # один запрос эталонов и одна транзакция
+    user_data = await get_user_data(token)
+    if user_data["role"] != "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only students can submit attempts")
+    submission_limiter.take(str(user_data["id"]))
+
+    if not batch.answers:
+        return []
+    if len(batch.answers) > ATTEMPT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {ATTEMPT_BATCH_MAX_ITEMS} answers per request")
+    task_ids = [item.task_id for item in batch.answers]
+    if len(set(task_ids)) != len(task_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Each task can be answered once per batch")
+
+    tasks = {task["id"]: task for task in await get_tasks_data(task_ids)}
+    missing = [task_id for task_id in task_ids if task_id not in tasks]
+    if missing:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Tasks not found: {missing}")
+    not_tests = [task_id for task_id in task_ids if tasks[task_id].get("type") != "test"]
+    if not_tests:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Batch submission is only for test tasks: {not_tests}")
+
+    answer_forms = get_answer_canonicals(db, [task["answer_id"] for task in tasks.values()])
+    db_attempts = []
+    for item in batch.answers:
+        task_data = tasks[item.task_id]
+        is_correct = canonical.matches(answer_forms[task_data["answer_id"]], item.answer)
+        db_attempt = models.Attempt(
+            task_id=item.task_id,
+            student_id=user_data["id"],
+            answer=item.answer,
+            answer_fingerprint=canonical.fingerprint(item.answer),
+            status=models.AttemptStatus.PENDING if is_correct else models.AttemptStatus.GRADED,
+            system_grade=100 if is_correct else 0,
+            teacher_grade=None if is_correct else 0,
+        )
+        db_attempts.append(db_attempt)
+
+    bulk.insert_attempts(db, db_attempts, tasks)
+    # id и change_seq уже известны после flush; без истечения объектов при commit
+    # ответ и события не перечитывают каждую попытку отдельным SELECT
+    db.expire_on_commit = False
+    db.commit()
+
+    for db_attempt in db_attempts:
+        await events.publish_attempt(db_attempt, tasks[db_attempt.task_id]["user_id"])
+    return [
+        {
+            "id": db_attempt.id,
+            "task_id": db_attempt.task_id,
+            "status": db_attempt.status.value,
+            "system_grade": db_attempt.system_grade,
+        }
+        for db_attempt in db_attempts
+    ]
 
 
 @router.get("/attempts/student", response_model=List[schemas.AttemptsResponse])
-async def get_student_attempts(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_student_attempts(
+        filters: dict = Depends(attempt_filters),
+        db: Session = Depends(get_read_db),
+        token: str = Depends(oauth2_scheme)
+):
     user_data = await get_user_data(token)
     if user_data["role"] != "student":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only students can view their attempts")
 
-    # Получаем попытки из локальной базы
-    attempts = db.query(models.Attempt).filter(
-        models.Attempt.student_id == user_data["id"],
-        models.Attempt.is_active
-    ).all()
+    task_ids = await resolve_theme_filter(filters)
+    if task_ids == []:
+        return []
 
-    attempts_list = []
-    for attempt in attempts:
-        try:
-            task_data = await get_task_data(attempt.task_id)
-        except httpx.HTTPStatusError as e:
-            print(f"Error fetching task {attempt.task_id}: {str(e)}")
-            continue  # Пропускаем попытку, если задача недоступна
-        except httpx.RequestError as e:
-            print(f"Network error fetching task {attempt.task_id}: {str(e)}")
-            continue
+    return await list_attempts(db, token, filters, task_ids, student_id=user_data["id"], student_data=user_data)
 
-        # Запрашиваем данные темы
-        try:
-            theme_data = await get_theme_data(task_data['theme_id'])
-        except httpx.HTTPStatusError as e:
-            print(f"Error fetching theme {task_data['theme_id']}: {str(e)}")
-            theme_data = {"name": "Unknown"}  # Значение по умолчанию
-        except httpx.RequestError as e:
-            print(f"Network error fetching theme {task_data['theme_id']}: {str(e)}")
-            theme_data = {"name": "Unknown"}
-
-        # Запрашиваем данные автора
-        try:
-            author_data = await get_user_data_by_id(task_data['user_id'], token)
-        except httpx.HTTPStatusError as e:
-            print(f"Error fetching user {task_data['user_id']}: {str(e)}")
-            author_data = {"username": "Unknown"}  # Значение по умолчанию
-        except httpx.RequestError as e:
-            print(f"Network error fetching user {task_data['author_id']}: {str(e)}")
-            author_data = {"username": "Unknown"}
-
-        # Обрабатываем изображение
-        image_data = None
-        if attempt.image_path and os.path.exists(attempt.image_path):
-            try:
-                with open(attempt.image_path, "rb") as image_file:
-                    base64_string = base64.b64encode(image_file.read()).decode("utf-8")
-                    mime_type, _ = mimetypes.guess_type(attempt.image_path)
-                    mime_type = mime_type or "image/jpeg"
-                    image_data = f"data:{mime_type};base64,{base64_string}"
-            except Exception as e:
-                print(f"Error reading image: {str(e)}")
-        db_system_answer = db.query(models.Answer).filter(
-            models.Answer.id == task_data["answer_id"],
-                        models.Answer.is_active
-        ).first()
-        # Формируем запись попытки
-        attempt_data = {
-            "id": attempt.id,
-            "task_id": task_data.get("id"),
-            "task_name": task_data.get("title", "-"),
-            "theme_id": theme_data.get("id"),
-            "theme_name": theme_data.get("title", "-"),
-            "student_id": user_data.get("id", None),
-            "student_username": user_data.get("username", None),
-            "task_author_id": author_data.get("id", None),
-            "task_author_username": author_data.get("username", "-"),
-            "system_answer": db_system_answer.text or None,
-            "answer": attempt.answer,
-            "status": attempt.status,
-            "system_grade": attempt.system_grade,
-            "teacher_grade": attempt.teacher_grade,
-            "created_at": attempt.created_at,
-            "image_data": image_data,
-        }
-        attempts_list.append(attempt_data)
 
-    return attempts_list
+@router.get("/attempts/student/sync", response_model=schemas.AttemptsSync)
+async def sync_student_attempts(
+        since: int = Query(0, ge=0),
+        limit: int = Query(ATTEMPTS_SYNC_LIMIT, ge=1, le=ATTEMPTS_PAGE_MAX_LIMIT),
+        db: Session = Depends(get_db),
+        token: str = Depends(oauth2_scheme)
+):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only students can view their attempts")
+
+    # Ничего не менялось с прошлого опроса: отвечаем без запросов к attempts
+    current_seq = models.current_change_seq(db.connection())
+    if since >= current_seq:
+        return {"cursor": since, "has_more": False, "attempts": [], "deleted": []}
+
+    query = db.query(models.Attempt).filter(cast("ColumnElement[bool]", models.Attempt.student_id == user_data["id"]))
+    return await sync_attempts(db, token, query, since, limit, current_seq, student_data=user_data)
 
 
 @router.get("/attempts/teacher", response_model=List[schemas.AttemptsResponse])
-async def get_teacher_attempts(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_teacher_attempts(
+        filters: dict = Depends(attempt_filters),
+        db: Session = Depends(get_read_db),
+        token: str = Depends(oauth2_scheme)
+):
     user_data = await get_user_data(token)
     if user_data["role"] != "teacher":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can view attempts")
 
     # Получаем все задачи учителя
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"http://{TASK_SERVICE_HOST}:{TASK_SERVICE_PORT}/{TASK_SERVICE_TASK_PREFIX_API}/teacher",
-            headers={"Authorization": f"Bearer {token}"}
-        )
-        if response.status_code != status.HTTP_200_OK:
-            raise HTTPException(status_code=response.status_code, detail="Failed to fetch teacher tasks")
-        teacher_tasks = response.json()
-
+    teacher_tasks = await get_teacher_tasks_data(token)
+    if filters["theme_id"]:
+        teacher_tasks = [task for task in teacher_tasks if task["theme_id"] == filters["theme_id"]]
     task_ids = [task["id"] for task in teacher_tasks]
     if not task_ids:
         return []
 
-    attempts = db.query(models.Attempt).filter(
-        models.Attempt.task_id.in_(task_ids),
-        cast("ColumnElement[bool]", models.Attempt.is_active)).all()
-    attempts_list = []
-    async with httpx.AsyncClient() as client:
-        for attempt in attempts:
-            try:
-                task_data = await get_task_data(attempt.task_id)
-            except httpx.HTTPStatusError as e:
-                print(f"Error fetching task {attempt.task_id}: {str(e)}")
-                continue  # Пропускаем попытку, если задача недоступна
-            except httpx.RequestError as e:
-                print(f"Network error fetching task {attempt.task_id}: {str(e)}")
-                continue
-
-            # Запрашиваем данные темы
-            try:
-                theme_data = await get_theme_data(task_data['theme_id'])
-            except httpx.HTTPStatusError as e:
-                print(f"Error fetching theme {task_data['theme_id']}: {str(e)}")
-                theme_data = {"name": "Unknown"}  # Значение по умолчанию
-            except httpx.RequestError as e:
-                print(f"Network error fetching theme {task_data['theme_id']}: {str(e)}")
-                theme_data = {"name": "Unknown"}
-
-            # Запрашиваем данные ученика
-            try:
-                student_data = await get_user_data_by_id(attempt.student_id, token)
-            except httpx.HTTPStatusError as e:
-                print(f"Error fetching user {attempt.student_id}: {str(e)}")
-                student_data = {"username": "Unknown"}  # Значение по умолчанию
-            except httpx.RequestError as e:
-                print(f"Network error fetching user {attempt.student_id}: {str(e)}")
-                student_data = {"username": "Unknown"}
-
-            # Обрабатываем изображение
-            image_data = None
-            if attempt.image_path and os.path.exists(attempt.image_path):
-                try:
-                    with open(attempt.image_path, "rb") as image_file:
-                        base64_string = base64.b64encode(image_file.read()).decode("utf-8")
-                        mime_type, _ = mimetypes.guess_type(attempt.image_path)
-                        mime_type = mime_type or "image/jpeg"
-                        image_data = f"data:{mime_type};base64,{base64_string}"
-                except Exception as e:
-                    print(f"Error reading image: {str(e)}")
-            db_system_answer = db.query(models.Answer).filter(
-                models.Answer.id == task_data["answer_id"],
-                models.Answer.is_active
-            ).first()
-            # Формируем запись попытки
-            attempt_data = {
-                "id": attempt.id,
-                "task_id": task_data.get("id"),
-                "task_name": task_data.get("title", "-"),
-                "theme_id": theme_data.get("id"),
-                "theme_name": theme_data.get("title", "-"),
-                "student_id": student_data.get("id", None),
-                "student_username": student_data.get("username", "-"),
-                "task_author_id": user_data.get("id", None),
-                "task_author_username": user_data.get("username", '-'),
-                "system_answer": db_system_answer.text or None,
-                "answer": attempt.answer,
-                "status": attempt.status,
-                "system_grade": attempt.system_grade,
-                "teacher_grade": attempt.teacher_grade,
-                "created_at": attempt.created_at,
-                "image_data": image_data,
-            }
-            attempts_list.append(attempt_data)
-
-    return attempts_list
+    return await list_attempts(db, token, filters, task_ids, author_data=user_data)
 
 
 @router.get("/attempts/teacher/grade", response_model=List[schemas.AttemptsResponse])
-async def get_teacher_attempts(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_teacher_pending_attempts(
+        filters: dict = Depends(attempt_filters),
+        db: Session = Depends(get_read_db),
+        token: str = Depends(oauth2_scheme)
+):
     user_data = await get_user_data(token)
     if user_data["role"] != "teacher":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can view attempts")
 
     # Получаем все задачи учителя
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"http://{TASK_SERVICE_HOST}:{TASK_SERVICE_PORT}/{TASK_SERVICE_TASK_PREFIX_API}/teacher",
-            headers={"Authorization": f"Bearer {token}"}
-        )
-        if response.status_code != status.HTTP_200_OK:
-            raise HTTPException(status_code=response.status_code, detail="Failed to fetch teacher tasks")
-        teacher_tasks = response.json()
-
+    teacher_tasks = await get_teacher_tasks_data(token)
+    if filters["theme_id"]:
+        teacher_tasks = [task for task in teacher_tasks if task["theme_id"] == filters["theme_id"]]
     task_ids = [task["id"] for task in teacher_tasks]
     if not task_ids:
         return []
 
-    attempts = db.query(models.Attempt).filter(
+    filters["status"] = schemas.AttemptStatus.PENDING
+    return await list_attempts(db, token, filters, task_ids, author_data=user_data)
+
+
+def backfill_fingerprints(db: Session, task_ids: list):
+    # Попытки, созданные до появления отпечатков; отпечаток производный, change_seq не меняется
+    rows = db.query(models.Attempt.id, models.Attempt.answer).filter(
         models.Attempt.task_id.in_(task_ids),
-        cast("ColumnElement[bool]",
-             models.Attempt.status == models.AttemptStatus.PENDING and models.Attempt.is_active)).all()
-    attempts_list = []
-    async with httpx.AsyncClient() as client:
-        for attempt in attempts:
-            try:
-                task_data = await get_task_data(attempt.task_id)
-            except httpx.HTTPStatusError as e:
-                print(f"Error fetching task {attempt.task_id}: {str(e)}")
-                continue  # Пропускаем попытку, если задача недоступна
-            except httpx.RequestError as e:
-                print(f"Network error fetching task {attempt.task_id}: {str(e)}")
-                continue
-
-            # Запрашиваем данные темы
-            try:
-                theme_data = await get_theme_data(task_data['theme_id'])
-            except httpx.HTTPStatusError as e:
-                print(f"Error fetching theme {task_data['theme_id']}: {str(e)}")
-                theme_data = {"name": "Unknown"}  # Значение по умолчанию
-            except httpx.RequestError as e:
-                print(f"Network error fetching theme {task_data['theme_id']}: {str(e)}")
-                theme_data = {"name": "Unknown"}
-
-            # Запрашиваем данные ученика
-            try:
-                student_data = await get_user_data_by_id(attempt.student_id, token)
-            except httpx.HTTPStatusError as e:
-                print(f"Error fetching user {attempt.student_id}: {str(e)}")
-                student_data = {"username": "Unknown"}  # Значение по умолчанию
-            except httpx.RequestError as e:
-                print(f"Network error fetching user {attempt.student_id}: {str(e)}")
-                student_data = {"username": "Unknown"}
-
-            # Обрабатываем изображение
-            image_data = None
-            if attempt.image_path and os.path.exists(attempt.image_path):
-                try:
-                    with open(attempt.image_path, "rb") as image_file:
-                        base64_string = base64.b64encode(image_file.read()).decode("utf-8")
-                        mime_type, _ = mimetypes.guess_type(attempt.image_path)
-                        mime_type = mime_type or "image/jpeg"
-                        image_data = f"data:{mime_type};base64,{base64_string}"
-                except Exception as e:
-                    print(f"Error reading image: {str(e)}")
-            db_system_answer = db.query(models.Answer).filter(
-                models.Answer.id == task_data["answer_id"],
-                models.Answer.is_active
-            ).first()
-            # Формируем запись попытки
-            attempt_data = {
-                "id": attempt.id,
-                "task_id": task_data.get("id"),
-                "task_name": task_data.get("title", "-"),
-                "theme_id": theme_data.get("id"),
-                "theme_name": theme_data.get("title", "-"),
-                "student_id": student_data.get("id", None),
-                "student_username": student_data.get("username", "-"),
-                "task_author_id": user_data.get("id", None),
-                "task_author_username": user_data.get("username", '-'),
-                "system_answer": db_system_answer.text or None,
-                "answer": attempt.answer,
-                "status": attempt.status,
-                "system_grade": attempt.system_grade,
-                "teacher_grade": attempt.teacher_grade,
-                "created_at": attempt.created_at,
-                "image_data": image_data,
-            }
-            attempts_list.append(attempt_data)
+        models.Attempt.status == models.AttemptStatus.PENDING,
+        models.Attempt.answer_fingerprint.is_(None),
+    ).all()
+    if rows:
+        db.execute(update(models.Attempt), [
+            {"id": row.id, "answer_fingerprint": canonical.fingerprint(row.answer)} for row in rows
+        ])
+        db.commit()
+
+
+@router.get("/attempts/teacher/grade/clusters", response_model=List[schemas.AttemptCluster])
+async def get_teacher_pending_clusters(
+        task_id: int | None = None,
+        theme_id: int | None = None,
+        db: Session = Depends(get_db),
+        token: str = Depends(oauth2_scheme)
+):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "teacher":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can view attempts")
+
+    teacher_tasks = await get_teacher_tasks_data(token)
+    task_ids = [
+        task["id"] for task in teacher_tasks
+        if (task_id is None or task["id"] == task_id) and (theme_id is None or task["theme_id"] == theme_id)
+    ]
+    if not task_ids:
+        return []
+
+    backfill_fingerprints(db, task_ids)
+    # Одинаковые ответы на одну задачу — одна строка с числом попыток
+    rows = db.query(
+        models.Attempt.task_id,
+        models.Attempt.answer_fingerprint,
+        func.min(models.Attempt.answer),
+        func.count(models.Attempt.id),
+        func.min(models.Attempt.id),
+        func.max(models.Attempt.id),
+    ).filter(
+        models.Attempt.task_id.in_(task_ids),
+        models.Attempt.status == models.AttemptStatus.PENDING,
+        models.Attempt.is_active,
+    ).group_by(
+        models.Attempt.task_id, models.Attempt.answer_fingerprint
+    ).order_by(func.count(models.Attempt.id).desc(), models.Attempt.task_id).all()
+    return [
+        {
+            "task_id": row_task_id,
+            "answer_fingerprint": fingerprint,
+            "sample_answer": sample_answer,
+            "count": count,
+            "first_attempt_id": first_id,
+            "last_attempt_id": last_id,
+        }
+        for row_task_id, fingerprint, sample_answer, count, first_id, last_id in rows
+    ]
+
+
+@router.post("/attempts/teacher/grade/clusters", response_model=schemas.GradeClusterResponse)
+async def grade_cluster(
+        cluster: schemas.GradeCluster,
+        db: Session = Depends(get_db),
+        token: str = Depends(oauth2_scheme)
+):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "teacher":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can grade attempts")
+
+    if cluster.teacher_grade < 0 or cluster.teacher_grade > 100:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Teacher grade must be between 0 and 100")
+
+    task_data = await get_task_data(cluster.task_id)
+    if task_data["user_id"] != user_data["id"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Teachers can only grade attempts for their own tasks")
+
+    query = db.query(
+        models.Attempt.id,
+        models.Attempt.task_id,
+        models.Attempt.student_id,
+        models.Attempt.answer,
+        models.Attempt.status,
+        models.Attempt.system_grade,
+        models.Attempt.teacher_grade,
+    ).filter(
+        models.Attempt.task_id == cluster.task_id,
+        models.Attempt.status == models.AttemptStatus.PENDING,
+        models.Attempt.answer_fingerprint == cluster.answer_fingerprint,
+        models.Attempt.is_active,
+    )
+    if cluster.max_attempt_id is not None:
+        query = query.filter(models.Attempt.id <= cluster.max_attempt_id)
+    # Блокируем строки, чтобы параллельная оценка одной попытки не применилась дважды
+    rows = query.with_for_update().all()
+    if not rows:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No pending attempts in this cluster")
+
+    updates = [
+        {"id": row.id, "status": graded_status(row.system_grade, cluster.teacher_grade), "teacher_grade": cluster.teacher_grade}
+        for row in rows
+    ]
+    attempts = bulk.apply_attempt_updates(db, rows, updates, {cluster.task_id: task_data["user_id"]})
+    db.commit()
+    for db_attempt in attempts:
+        await events.publish_attempt(db_attempt, task_data["user_id"])
+    return {"graded": len(attempts), "attempt_ids": [row.id for row in rows]}
+
+
+@router.get("/attempts/teacher/sync", response_model=schemas.AttemptsSync)
+async def sync_teacher_attempts(
+        since: int = Query(0, ge=0),
+        limit: int = Query(ATTEMPTS_SYNC_LIMIT, ge=1, le=ATTEMPTS_PAGE_MAX_LIMIT),
+        db: Session = Depends(get_db),
+        token: str = Depends(oauth2_scheme)
+):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "teacher":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can view attempts")
+
+    # Ничего не менялось с прошлого опроса: не ходим ни в task-сервис, ни в attempts
+    current_seq = models.current_change_seq(db.connection())
+    if since >= current_seq:
+        return {"cursor": since, "has_more": False, "attempts": [], "deleted": []}
 
-    return attempts_list
+    task_ids = [task["id"] for task in await get_teacher_tasks_data(token)]
+    if not task_ids:
+        return {"cursor": current_seq, "has_more": False, "attempts": [], "deleted": []}
+
+    query = db.query(models.Attempt).filter(models.Attempt.task_id.in_(task_ids))
+    return await sync_attempts(db, token, query, since, limit, current_seq, author_data=user_data)
 
 
 @router.get("/attempts/admin", response_model=List[schemas.AttemptsResponse])
-async def get_all_attempts(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_all_attempts(
+        filters: dict = Depends(attempt_filters),
+        db: Session = Depends(get_read_db),
+        token: str = Depends(oauth2_scheme)
+):
     user_data = await get_user_data(token)
     if user_data["role"] != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can view all attempts")
 
-    attempts = db.query(models.Attempt).filter(cast("ColumnElement[bool]", models.Attempt.is_active)).all()
-    attempts_list = []
-    async with httpx.AsyncClient() as client:
-        for attempt in attempts:
-            try:
-                task_data = await get_task_data(attempt.task_id)
-            except httpx.HTTPStatusError as e:
-                print(f"Error fetching task {attempt.task_id}: {str(e)}")
-                continue  # Пропускаем попытку, если задача недоступна
-            except httpx.RequestError as e:
-                print(f"Network error fetching task {attempt.task_id}: {str(e)}")
-                continue
-
-            # Запрашиваем данные темы
-            try:
-                theme_data = await get_theme_data(task_data['theme_id'])
-            except httpx.HTTPStatusError as e:
-                print(f"Error fetching theme {task_data['theme_id']}: {str(e)}")
-                theme_data = {"name": "Unknown"}  # Значение по умолчанию
-            except httpx.RequestError as e:
-                print(f"Network error fetching theme {task_data['theme_id']}: {str(e)}")
-                theme_data = {"name": "Unknown"}
-
-            # Запрашиваем данные ученика
-            try:
-                student_data = await get_user_data_by_id(attempt.student_id, token)
-            except httpx.HTTPStatusError as e:
-                print(f"Error fetching user {attempt.student_id}: {str(e)}")
-                student_data = {"username": "Unknown"}  # Значение по умолчанию
-            except httpx.RequestError as e:
-                print(f"Network error fetching user {attempt.student_id}: {str(e)}")
-                student_data = {"username": "Unknown"}
-
-            # Запрашиваем данные автора
-            try:
-                author_data = await get_user_data_by_id(task_data['user_id'], token)
-            except httpx.HTTPStatusError as e:
-                print(f"Error fetching user {task_data['user_id']}: {str(e)}")
-                author_data = {"username": "Unknown"}  # Значение по умолчанию
-            except httpx.RequestError as e:
-                print(f"Network error fetching user {task_data['author_id']}: {str(e)}")
-                author_data = {"username": "Unknown"}
-
-            # Обрабатываем изображение
-            image_data = None
-            if attempt.image_path and os.path.exists(attempt.image_path):
-                try:
-                    with open(attempt.image_path, "rb") as image_file:
-                        base64_string = base64.b64encode(image_file.read()).decode("utf-8")
-                        mime_type, _ = mimetypes.guess_type(attempt.image_path)
-                        mime_type = mime_type or "image/jpeg"
-                        image_data = f"data:{mime_type};base64,{base64_string}"
-                except Exception as e:
-                    print(f"Error reading image: {str(e)}")
-            db_system_answer = db.query(models.Answer).filter(
-                models.Answer.id == task_data["answer_id"],
-                models.Answer.is_active
-            ).first()
-            # Формируем запись попытки
-            attempt_data = {
-                "id": attempt.id,
-                "task_id": task_data.get("id"),
-                "task_name": task_data.get("title", "-"),
-                "theme_id": theme_data.get("id"),
-                "theme_name": theme_data.get("title", "-"),
-                "student_id": student_data.get("id", None),
-                "student_username": student_data.get("username", "-"),
-                "task_author_id": author_data.get("id", None),
-                "task_author_username": author_data.get("username", "-"),
-                "system_answer": db_system_answer.text or None,
-                "answer": attempt.answer,
-                "status": attempt.status,
-                "system_grade": attempt.system_grade,
-                "teacher_grade": attempt.teacher_grade,
-                "created_at": attempt.created_at,
-                "image_data": image_data,
-            }
-            attempts_list.append(attempt_data)
+    task_ids = await resolve_theme_filter(filters)
+    if task_ids == []:
+        return []
+
+    return await list_attempts(db, token, filters, task_ids)
+
+
+@router.get("/attempts/student/archive", response_model=List[schemas.AttemptsResponse])
+async def get_student_archived_attempts(
+        filters: dict = Depends(attempt_filters),
+        db: Session = Depends(get_read_db),
+        token: str = Depends(oauth2_scheme)
+):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only students can view their attempts")
+
+    task_ids = await resolve_theme_filter(filters)
+    if task_ids == []:
+        return []
+
+    return await list_attempts(db, token, filters, task_ids, student_id=user_data["id"], student_data=user_data,
+                               model=models.ArchivedAttempt)
+
+
+@router.get("/attempts/teacher/archive", response_model=List[schemas.AttemptsResponse])
+async def get_teacher_archived_attempts(
+        filters: dict = Depends(attempt_filters),
+        db: Session = Depends(get_read_db),
+        token: str = Depends(oauth2_scheme)
+):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "teacher":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can view attempts")
+
+    teacher_tasks = await get_teacher_tasks_data(token)
+    if filters["theme_id"]:
+        teacher_tasks = [task for task in teacher_tasks if task["theme_id"] == filters["theme_id"]]
+    task_ids = [task["id"] for task in teacher_tasks]
+    if not task_ids:
+        return []
+
+    return await list_attempts(db, token, filters, task_ids, author_data=user_data, model=models.ArchivedAttempt)
+
+
+@router.get("/attempts/admin/archive", response_model=List[schemas.AttemptsResponse])
+async def get_all_archived_attempts(
+        filters: dict = Depends(attempt_filters),
+        db: Session = Depends(get_read_db),
+        token: str = Depends(oauth2_scheme)
+):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can view all attempts")
+
+    task_ids = await resolve_theme_filter(filters)
+    if task_ids == []:
+        return []
 
-    return attempts_list
+    return await list_attempts(db, token, filters, task_ids, model=models.ArchivedAttempt)
+
+
+def graded_status(system_grade: int | None, teacher_grade: int) -> models.AttemptStatus:
+    # Если система дала 100 и учитель подтверждает (teacher_grade >= 90), статус CORRECT
+    if system_grade == 100 and teacher_grade >= 90:
+        return models.AttemptStatus.CORRECT
+    return models.AttemptStatus.GRADED
 
 
 @router.post("/attempts/{attempt_id}/grade", response_model=schemas.AttemptResponse)
@@ -544,12 +890,12 @@ async def grade_attempt(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can grade attempts")
 
     db_attempt = db.query(models.Attempt).filter(
-        cast("ColumnElement[bool]", models.Attempt.id == attempt_id and models.Attempt.is_active)).first()
+        and_(models.Attempt.id == attempt_id, models.Attempt.is_active)).first()
     if not db_attempt:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attempt not found")
 
     # Проверяем, принадлежит ли задача учителю
-    task_data = await get_task_data(db_attempt.task_id, token)
+    task_data = await get_task_data(db_attempt.task_id)
     if task_data["user_id"] != user_data["id"]:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Teachers can only grade attempts for their own tasks")
@@ -557,114 +903,190 @@ async def grade_attempt(
     if grade.teacher_grade < 0 or grade.teacher_grade > 100:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Teacher grade must be between 0 and 100")
 
-    # Если система дала 100 и учитель подтверждает (teacher_grade >= 90), статус CORRECT
-    if db_attempt.system_grade == 100 and grade.teacher_grade >= 90:
-        db_attempt.status = models.AttemptStatus.CORRECT
-    else:
-        db_attempt.status = models.AttemptStatus.GRADED
-
+    old_state = (db_attempt.status, db_attempt.teacher_grade)
+    db_attempt.status = graded_status(db_attempt.system_grade, grade.teacher_grade)
     db_attempt.teacher_grade = grade.teacher_grade
     db_attempt.updated_at = datetime.now(timezone.utc)
+    stats.record_change(db, db_attempt.task_id, task_data["user_id"], old_state,
+                        (db_attempt.status, db_attempt.teacher_grade))
     db.commit()
     db.refresh(db_attempt)
-    attempt = {
-        'id': db_attempt.id,
-        'task_id': db_attempt.task_id,
-        'student_id': db_attempt.student_id,
-        'answer': db_attempt.answer,
-        'status': db_attempt.status,
-        'system_grade': db_attempt.system_grade,
-        'teacher_grade': db_attempt.teacher_grade,
-        'created_at': db_attempt.created_at,
-        'image_path': db_attempt.image_path,
-    }
-    image_path = attempt["image_path"]
-    image_data = None
-    if image_path and os.path.exists(image_path):
-        try:
-            with open(image_path, "rb") as image_file:
-                base64_string = base64.b64encode(image_file.read()).decode("utf-8")
-                mime_type, _ = mimetypes.guess_type(image_path)
-                mime_type = mime_type or "image/jpeg"  # Значение по умолчанию
-                image_data = f"data:{mime_type};base64,{base64_string}"
-        except Exception as e:
-            print(f"Error reading image: {str(e)}")
-    attempt["image_data"] = image_data
+    await events.publish_attempt(db_attempt, task_data["user_id"])
+    return attempt_response(db_attempt)
 
-    return attempt
+
+@router.post("/attempts/grade/bulk", response_model=schemas.BulkGradeResponse)
+async def grade_attempts_bulk(
+        bulk_grade: schemas.BulkGrade,
+        db: Session = Depends(get_db),
+        token: str = Depends(oauth2_scheme)
+):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "teacher":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can grade attempts")
+
+    if len(bulk_grade.grades) > BULK_GRADE_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {BULK_GRADE_MAX_ITEMS} grades per request")
+    grades = {item.attempt_id: item.teacher_grade for item in bulk_grade.grades}
+    if any(grade < 0 or grade > 100 for grade in grades.values()):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Teacher grade must be between 0 and 100")
+
+    # Владение проверяется одним запросом списка задач учителя, а не по запросу на попытку
+    teacher_task_ids = {task["id"] for task in await get_teacher_tasks_data(token)}
+    rows = db.query(
+        models.Attempt.id,
+        models.Attempt.task_id,
+        models.Attempt.student_id,
+        models.Attempt.answer,
+        models.Attempt.status,
+        models.Attempt.system_grade,
+        models.Attempt.teacher_grade,
+    ).filter(
+        models.Attempt.id.in_(list(grades)),
+        models.Attempt.is_active,
+    ).with_for_update().all()
+    found = {row.id: row for row in rows}
+
+    results = {}
+    updates = []
+    owned_rows = []
+    for attempt_id, teacher_grade in grades.items():
+        row = found.get(attempt_id)
+        if row is None:
+            results[attempt_id] = {"attempt_id": attempt_id, "error": "not_found"}
+        elif row.task_id not in teacher_task_ids:
+            results[attempt_id] = {"attempt_id": attempt_id, "error": "forbidden"}
+        else:
+            new_status = graded_status(row.system_grade, teacher_grade)
+            updates.append({"id": attempt_id, "status": new_status, "teacher_grade": teacher_grade})
+            owned_rows.append(row)
+            results[attempt_id] = {"attempt_id": attempt_id, "status": new_status.value, "teacher_grade": teacher_grade}
+
+    attempts = bulk.apply_attempt_updates(
+        db, owned_rows, updates, {row.task_id: user_data["id"] for row in owned_rows}
+    )
+    db.commit()
+    for db_attempt in attempts:
+        await events.publish_attempt(db_attempt, user_data["id"])
+    return {"results": list(results.values())}
 
 
 @router.get("/teacher/stats")
-async def get_teacher_stats(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_teacher_stats(db: Session = Depends(get_read_db), token: str = Depends(oauth2_scheme)):
     user_data = await get_user_data(token)
     if user_data["role"] != "teacher":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can view stats")
 
-    # Получаем задачи учителя
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"http://{TASK_SERVICE_HOST}:{TASK_SERVICE_PORT}/{TASK_SERVICE_TASK_PREFIX_API}/teacher",
-            headers={"Authorization": f"Bearer {token}"}
+    # Счётчики ведутся в create_attempt/grade_attempt, здесь только сумма по индексу teacher_id
+    return stats.teacher_totals(db, user_data["id"])
+
+
+def teacher_backlog(task_ids: list, last_event_id: int | None) -> tuple[list, int]:
+    # Короткая сессия: на время жизни сокета соединение с БД не удерживается
+    db = database.SessionLocal()
+    try:
+        watermark = models.current_change_seq(db.connection())
+        query = db.query(models.Attempt).filter(
+            models.Attempt.task_id.in_(task_ids),
+            cast("ColumnElement[bool]", models.Attempt.is_active),
+            cast("ColumnElement[bool]", models.Attempt.change_seq <= watermark),
         )
-        if response.status_code != status.HTTP_200_OK:
-            raise HTTPException(status_code=response.status_code, detail="Failed to fetch teacher tasks")
-        teacher_tasks = response.json()
+        if last_event_id is None:
+            # Первое подключение: текущая очередь непроверенных попыток
+            query = query.filter(cast("ColumnElement[bool]", models.Attempt.status == models.AttemptStatus.PENDING))
+        else:
+            # Переподключение: всё, что изменилось после последнего полученного события
+            query = query.filter(cast("ColumnElement[bool]", models.Attempt.change_seq > last_event_id))
+        return [events.attempt_event(attempt) for attempt in query.order_by(models.Attempt.change_seq)], watermark
+    finally:
+        db.close()
 
-    task_ids = [task["id"] for task in teacher_tasks]
-    if not task_ids:
-        return {"attempts": 0, "solved": 0}
 
-    attempt_count = db.query(models.Attempt).filter(
-        models.Attempt.task_id.in_(task_ids),
-        cast("ColumnElement[bool]", models.Attempt.is_active)).count()
-    solved_count = db.query(models.Attempt).filter(
-        models.Attempt.task_id.in_(task_ids),
-        cast("ColumnElement[bool]",
-             models.Attempt.status == models.AttemptStatus.CORRECT and models.Attempt.is_active)).count()
-    return {"attempts": attempt_count, "solved": solved_count}
+def student_backlog(student_id: int, last_event_id: int | None) -> tuple[list, int]:
+    db = database.SessionLocal()
+    try:
+        watermark = models.current_change_seq(db.connection())
+        if last_event_id is None:
+            return [], watermark
+        attempts = db.query(models.Attempt).filter(
+            cast("ColumnElement[bool]", models.Attempt.student_id == student_id),
+            cast("ColumnElement[bool]", models.Attempt.is_active),
+            cast("ColumnElement[bool]", models.Attempt.change_seq > last_event_id),
+            cast("ColumnElement[bool]", models.Attempt.change_seq <= watermark),
+        ).order_by(models.Attempt.change_seq)
+        return [events.attempt_event(attempt) for attempt in attempts], watermark
+    finally:
+        db.close()
+
+
+def sse_format(event: dict) -> bytes:
+    if event.get("event") == "ping":
+        return b": ping\n\n"
+    lines = f"event: {event['event']}\n"
+    if event.get("id"):
+        lines = f"id: {event['id']}\n" + lines
+    return lines.encode() + b"data: " + orjson.dumps(event) + b"\n\n"
 
 
 @router.websocket("/ws/teacher/{teacher_id}")
-async def notify_teacher(websocket: WebSocket, teacher_id: int, db: Session = Depends(get_db)):
+async def notify_teacher(websocket: WebSocket, teacher_id: int, last_event_id: int | None = None):
     await websocket.accept()
+    token = websocket.headers.get('authorization', '').replace('Bearer ', '')
     try:
         # Проверяем, что teacher_id соответствует токену
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"http://{AUTH_SERVICE_HOST}:{AUTH_SERVICE_PORT}/{AUTH_SERVICE_POSSIBILITY_PREFIX_API}/user",
-                headers={"Authorization": f"Bearer {websocket.headers.get('authorization', '').replace('Bearer ', '')}"}
-            )
-            if response.status_code != 200 or response.json()["id"] != teacher_id:
-                await websocket.close()
-                return
-
-        while True:
-            # Получаем задачи учителя
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"http://{TASK_SERVICE_HOST}:{TASK_SERVICE_PORT}/{TASK_SERVICE_TASK_PREFIX_API}/teacher",
-                    headers={
-                        "Authorization": f"Bearer {websocket.headers.get('authorization', '').replace('Bearer ', '')}"}
-                )
-                if response.status_code != status.HTTP_200_OK:
-                    continue
-                teacher_tasks = response.json()
-
-            task_ids = [task["id"] for task in teacher_tasks]
-            if task_ids:
-                new_attempts = db.query(models.Attempt).filter(
-                    models.Attempt.task_id.in_(task_ids),
-                    cast("ColumnElement[bool]",
-                         models.Attempt.status == models.AttemptStatus.PENDING and models.Attempt.is_active)).all()
-                for attempt in new_attempts:
-                    await websocket.send_json({
-                        "attempt_id": attempt.id,
-                        "task_id": attempt.task_id,
-                        "student_id": attempt.student_id,
-                        "answer": attempt.answer,
-                        "system_grade": attempt.system_grade
-                    })
-            await asyncio.sleep(10)
-    except Exception as e:
+        user_data = await get_user_data(token)
+        if user_data["id"] != teacher_id:
+            await websocket.close()
+            return
+        task_ids = [task["id"] for task in await get_teacher_tasks_data(token)]
+    except (HTTPException, httpx.HTTPError) as e:
+        logging.error(f"WebSocket auth error: {str(e)}")
         await websocket.close()
-        logging.error(f"WebSocket error: {str(e)}")
+        return
+
+    await connections.manager.serve(
+        websocket, "teacher", teacher_id, events.teacher_topic(teacher_id),
+        lambda: teacher_backlog(task_ids, last_event_id) if task_ids else ([], 0),
+    )
+
+
+@router.get("/attempts/student/events")
+async def stream_student_events(
+        request: Request,
+        last_event_id: int | None = Header(None, alias="Last-Event-ID"),
+        access_token: str | None = Query(None)
+):
+    # EventSource в браузере не передаёт заголовки, поэтому токен можно прислать параметром access_token
+    token = access_token or request.headers.get("authorization", "").replace("Bearer ", "")
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Bearer"})
+    user_data = await get_user_data(token)
+    if user_data["role"] != "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only students can view their attempts")
+
+    # Поток изменений статуса попыток ученика; при обрыве EventSource сам присылает Last-Event-ID,
+    # и пропущенное досылается из БД по change_seq
+    async def event_stream():
+        yield f"retry: {SSE_RETRY_MS}\n\n".encode()
+        async for event in connections.manager.stream(
+                "student", user_data["id"], events.student_topic(user_data["id"]),
+                lambda: student_backlog(user_data["id"], last_event_id),
+        ):
+            yield sse_format(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/ws/metrics")
+async def get_ws_metrics(token: str = Depends(oauth2_scheme)):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can view connection metrics")
+
+    return connections.manager.metrics()
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+
+import models
+import database
+import bulk
+from broker import collect_batch
+from config import WRITE_BATCHING, WRITE_BATCH_SIZE, WRITE_BATCH_WINDOW_MS, WRITE_BATCH_QUEUE_SIZE
+
+
+def write_attempts(items: list):
+    # items — (попытка, данные задачи, запись Idempotency-Key или None).
+    # Объекты не истекают при commit: id, change_seq и created_at уже заполнены после flush
+    db = database.SessionLocal(expire_on_commit=False)
+    try:
+        bulk.insert_attempts(db, [attempt for attempt, _, _ in items], {task["id"]: task for _, task, _ in items})
+        keys = [(attempt, key) for attempt, _, key in items if key is not None]
+        if keys:
+            db.flush()
+            for attempt, key in keys:
+                key.resource_id = attempt.id
+                db.add(key)
+        db.commit()
+    finally:
+        db.close()
+
+
+class AttemptWriter:
+    # Групповая фиксация: запросы кладут попытку в очередь и ждут future, фоновая задача
+    # собирает пачку (не больше WRITE_BATCH_SIZE строк и WRITE_BATCH_WINDOW_MS ожидания)
+    # и фиксирует её одной транзакцией — один fsync на пачку вместо одного на попытку
+    def __init__(self, enabled: bool = WRITE_BATCHING):
+        self.enabled = enabled
+        self._queue = None
+        self._task = None
+
+    async def start(self):
+        if not self.enabled:
+            return
+        self._queue = asyncio.Queue(maxsize=WRITE_BATCH_QUEUE_SIZE)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        # Дописываем то, что успело попасть в очередь
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._flush(batch)
+
+    async def submit(self, attempt: models.Attempt, task_data: dict,
+                     key: models.IdempotencyKey | None = None) -> models.Attempt:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((attempt, task_data, key, future))
+        return await future
+
+    async def _flush_loop(self):
+        while True:
+            batch = await collect_batch(self._queue, WRITE_BATCH_SIZE, WRITE_BATCH_WINDOW_MS / 1000)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        try:
+            await asyncio.to_thread(write_attempts, [item[:3] for item in batch])
+        except Exception as e:
+            # Одна ошибочная строка не должна ронять всю пачку: пишем по одной
+            logging.error(f"Batched attempt insert failed, retrying one by one: {str(e)}")
+            for attempt, task_data, key, future in batch:
+                try:
+                    await asyncio.to_thread(write_attempts, [(attempt, task_data, key)])
+                except Exception as item_error:
+                    if not future.done():
+                        future.set_exception(item_error)
+                else:
+                    if not future.done():
+                        future.set_result(attempt)
+            return
+        for attempt, _, _, future in batch:
+            if not future.done():
+                future.set_result(attempt)
+
+
+writer = AttemptWriter()
@@ -0,0 +1,74 @@
+import sys
+import time
+from datetime import datetime, timezone
+from typing import List
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import schemas
+from responses import list_response
+
+# Сравнение стандартного пути (response_model + json) с быстрым (orjson без повторной валидации)
+# на листинге попыток: python bench_list_serialization.py [rows] [repeats]
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+
+def make_rows(count: int) -> List[dict]:
+    created_at = datetime.now(timezone.utc)
+    return [
+        {
+            "id": i,
+            "task_id": i % 200,
+            "task_name": f"Задача {i % 200}",
+            "theme_id": i % 20,
+            "theme_name": f"Тема {i % 20}",
+            "student_id": i % 500,
+            "student_username": f"student_{i % 500}",
+            "task_author_id": 1,
+            "task_author_username": "teacher",
+            "system_answer": "2.5 м/с",
+            "answer": "2,5 м/с",
+            "status": schemas.AttemptStatus.PENDING,
+            "system_grade": 100,
+            "teacher_grade": None,
+            "created_at": created_at,
+            "image_data": None,
+        }
+        for i in range(count)
+    ]
+
+
+rows = make_rows(ROWS)
+app = FastAPI()
+
+
+@app.get("/standard", response_model=List[schemas.AttemptsResponse])
+def standard():
+    return list_response(rows, fast=False)
+
+
+@app.get("/fast", response_model=List[schemas.AttemptsResponse])
+def fast():
+    return list_response(rows, fast=True)
+
+
+def bench(client: TestClient, path: str) -> float:
+    client.get(path)  # прогрев
+    best = float("inf")
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        response = client.get(path)
+        best = min(best, time.perf_counter() - started)
+        assert response.status_code == 200 and len(response.json()) == ROWS
+    return best
+
+
+if __name__ == "__main__":
+    with TestClient(app) as client:
+        standard_time = bench(client, "/standard")
+        fast_time = bench(client, "/fast")
+    print(f"rows={ROWS} repeats={REPEATS}")
+    print(f"standard: {standard_time * 1000:.1f} ms")
+    print(f"fast:     {fast_time * 1000:.1f} ms ({standard_time / fast_time:.1f}x)")
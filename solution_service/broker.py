@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import os
+import socket
+from urllib.parse import urlparse
+
+import orjson
+
+from config import (
+    EVENT_BROKER_URL,
+    EVENT_BROKER_CHANNEL,
+    EVENT_BROKER_QUEUE_SIZE,
+    EVENT_BROKER_BATCH_SIZE,
+    EVENT_BROKER_BATCH_WINDOW_MS,
+)
+
+# Размер одного сообщения: у pg_notify предел 8000 байт, у датаграммы берём с запасом
+PG_NOTIFY_MAX_PAYLOAD = 7900
+UNIX_DATAGRAM_MAX_PAYLOAD = 60 * 1024
+# Пауза перед повторным подключением LISTEN: удваивается после каждой неудачи, до максимума
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+
+
+class Broker:
+    # Общая часть: ограниченная очередь (publish ждёт, если она заполнена)
+    # и фоновая отправка пачками не больше batch_size за окно batch_window_ms.
+    def __init__(self):
+        self._queue = asyncio.Queue(maxsize=EVENT_BROKER_QUEUE_SIZE)
+        self._deliver = None
+        self._tasks = []
+
+    async def start(self, deliver):
+        self._deliver = deliver
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def publish(self, topic: str, event: dict):
+        await self._queue.put((topic, event))
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def _flush_loop(self):
+        while True:
+            batch = await collect_batch(self._queue, EVENT_BROKER_BATCH_SIZE, EVENT_BROKER_BATCH_WINDOW_MS / 1000)
+            try:
+                await self._send_batch(batch)
+            except Exception as e:
+                logging.error(f"Broker error: failed to send {len(batch)} events: {str(e)}")
+
+    def _receive(self, payload: bytes):
+        for topic, event in orjson.loads(payload):
+            self._deliver(topic, event)
+
+    async def _send_batch(self, batch: list):
+        raise NotImplementedError
+
+
+class MemoryBroker(Broker):
+    # Один воркер: события доставляются в шину этого же процесса
+    async def _send_batch(self, batch: list):
+        for topic, event in batch:
+            self._deliver(topic, event)
+
+
+class PostgresBroker(Broker):
+    # LISTEN/NOTIFY: уведомление получают все воркеры, включая отправителя
+    def __init__(self, url: str, channel: str):
+        super().__init__()
+        self._url = url
+        self._channel = channel
+        self._listen_conn = None
+        self._notify_conn = None
+
+    async def _connect(self):
+        import psycopg
+
+        return await psycopg.AsyncConnection.connect(self._url, autocommit=True)
+
+    async def start(self, deliver):
+        self._listen_conn = await self._connect()
+        self._notify_conn = await self._connect()
+        await self._listen_conn.execute(f"LISTEN {self._channel}")
+        await super().start(deliver)
+        self._tasks.append(asyncio.create_task(self._listen_loop()))
+
+    async def stop(self):
+        await super().stop()
+        for conn in (self._listen_conn, self._notify_conn):
+            if conn is not None:
+                await conn.close()
+
+    async def _listen_loop(self):
+        # Обрыв соединения LISTEN не должен навсегда остановить рассылку между воркерами.
+        # Уведомления за время обрыва теряются; клиенты догоняются из БД при переподключении
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            try:
+                if self._listen_conn.closed:
+                    self._listen_conn = await self._connect()
+                    await self._listen_conn.execute(f"LISTEN {self._channel}")
+                    logging.info("Broker: LISTEN connection restored")
+                    delay = RECONNECT_MIN_DELAY
+                async for notify in self._listen_conn.notifies():
+                    self._receive(notify.payload.encode())
+            except Exception as e:
+                logging.error(f"Broker error: LISTEN connection lost, reconnecting in {delay} s: {str(e)}")
+                await self._listen_conn.close()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def _send_batch(self, batch: list):
+        if self._notify_conn.closed:
+            self._notify_conn = await self._connect()
+        # Каждое сообщение отдельно: ошибка одного не теряет остальную пачку
+        for payload in split_payloads(batch, PG_NOTIFY_MAX_PAYLOAD):
+            try:
+                await self._notify_conn.execute("SELECT pg_notify(%s, %s)", (self._channel, payload.decode()))
+            except Exception as e:
+                logging.error(f"Broker error: failed to send {len(payload)} bytes: {str(e)}")
+
+
+class UnixSocketBroker(Broker):
+    # Замена LISTEN/NOTIFY для одного хоста и тестов: каждый воркер слушает свой
+    # датаграммный сокет в общем каталоге, пачка рассылается во все сокеты каталога.
+    def __init__(self, directory: str):
+        super().__init__()
+        self._directory = directory
+        self._path = os.path.join(directory, f"worker-{os.getpid()}.sock")
+        self._sock = None
+
+    async def start(self, deliver):
+        os.makedirs(self._directory, exist_ok=True)
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self._path)
+        self._sock.setblocking(False)
+        await super().start(deliver)
+        self._tasks.append(asyncio.create_task(self._listen_loop()))
+
+    async def stop(self):
+        await super().stop()
+        if self._sock is not None:
+            self._sock.close()
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+    async def _listen_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                payload = await loop.sock_recv(self._sock, UNIX_DATAGRAM_MAX_PAYLOAD + 1024)
+                self._receive(payload)
+            except Exception as e:
+                # Одна битая датаграмма или сбой сокета не останавливает приём
+                logging.error(f"Broker error: failed to receive: {str(e)}")
+                await asyncio.sleep(RECONNECT_MIN_DELAY)
+
+    async def _send_batch(self, batch: list):
+        peers = [os.path.join(self._directory, name) for name in os.listdir(self._directory) if name.endswith(".sock")]
+        for payload in split_payloads(batch, UNIX_DATAGRAM_MAX_PAYLOAD):
+            for peer in peers:
+                await self._send_to(peer, payload)
+
+    async def _send_to(self, peer: str, payload: bytes):
+        for _ in range(50):
+            try:
+                self._sock.sendto(payload, peer)
+                return
+            except BlockingIOError:
+                await asyncio.sleep(0.002)  # Очередь получателя заполнена — ждём, пока он разберёт
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Сокет остался от завершившегося воркера
+                if peer != self._path and os.path.exists(peer):
+                    os.unlink(peer)
+                return
+            except OSError as e:
+                # Например, EMSGSIZE: датаграмма больше, чем допускает система
+                logging.error(f"Broker error: failed to send {len(payload)} bytes to {peer}: {str(e)}")
+                return
+        logging.error(f"Broker error: peer {peer} is not reading, dropped {len(payload)} bytes")
+
+
+async def collect_batch(queue: asyncio.Queue, max_size: int, window: float) -> list:
+    # Ждём первый элемент, затем добираем пачку до max_size, пока не истечёт окно.
+    # Без wait_for(queue.get()): он может проглотить отмену задачи, и остановка зависает
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + window
+    while len(batch) < max_size:
+        try:
+            batch.append(queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        await asyncio.sleep(min(timeout, 0.001))
+    return batch
+
+
+def split_payloads(batch: list, max_size: int) -> list:
+    payloads = []
+    chunk = []
+    size = 2
+    for item in batch:
+        item_size = len(orjson.dumps(item)) + 1
+        if item_size + 2 > max_size:
+            # Не делится на части: теряем одно событие, а не всё сообщение
+            logging.error(f"Broker error: event {item[1].get('id')} for {item[0]} exceeds {max_size} bytes, dropped")
+            continue
+        if chunk and size + item_size > max_size:
+            payloads.append(orjson.dumps(chunk))
+            chunk, size = [], 2
+        chunk.append(item)
+        size += item_size
+    if chunk:
+        payloads.append(orjson.dumps(chunk))
+    return payloads
+
+
+def create_broker(url: str = EVENT_BROKER_URL) -> Broker:
+    if not url or url.startswith("memory://"):
+        return MemoryBroker()
+    parsed = urlparse(url)
+    scheme = parsed.scheme.split("+")[0]  # postgresql+psycopg2://... из SQLAlchemy тоже подходит
+    if scheme in ("postgres", "postgresql"):
+        return PostgresBroker(parsed._replace(scheme="postgresql").geturl(), EVENT_BROKER_CHANNEL)
+    if parsed.scheme == "unix":
+        return UnixSocketBroker(parsed.path)
+    raise ValueError(f"Unsupported EVENT_BROKER_URL scheme: {parsed.scheme}")
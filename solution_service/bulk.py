@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+import models
+import stats
+import task_refs
+
+
+def insert_attempts(db: Session, attempts: list, tasks: dict):
+    # Общий путь вставки новых попыток: change_seq ставит событие before_flush,
+    # счётчики статистики меняются одной дельтой на задачу. tasks — task_id -> данные задачи.
+    deltas = {}
+    for attempt in attempts:
+        delta = deltas.setdefault(attempt.task_id, dict.fromkeys(stats.COUNTERS, 0))
+        for name, value in stats.contribution(attempt.status, attempt.teacher_grade).items():
+            delta[name] += value
+    db.add_all(attempts)
+    for task_id, delta in deltas.items():
+        task_refs.remember_task(db, tasks[task_id])
+        stats.apply_delta(db, task_id, tasks[task_id]["user_id"], delta)
+
+
+def apply_attempt_updates(db: Session, rows: list, updates: list, teacher_ids: dict) -> list:
+    # Массовый UPDATE по первичному ключу вместо загрузки и сохранения каждой попытки.
+    # rows — прочитанные строки попыток (id, task_id, student_id, answer, status, system_grade, teacher_grade),
+    # updates — словари {"id": ..., изменённые поля}, teacher_ids — task_id -> автор задачи.
+    # Событие stamp_change_seqs при этом не вызывается, поэтому номера изменений резервируются
+    # одним блоком, а счётчики статистики меняются одной дельтой на задачу. Commit — за вызывающим.
+    if not updates:
+        return []
+    by_id = {row.id: row for row in rows}
+    deltas = {}
+    first_seq = models.reserve_change_seqs(db.connection(), len(updates))
+    now = datetime.now(timezone.utc)
+    attempts = []
+    for offset, values in enumerate(updates):
+        row = by_id[values["id"]]
+        values.update(change_seq=first_seq + offset, updated_at=now)
+        attempt = models.Attempt(
+            id=row.id,
+            task_id=row.task_id,
+            student_id=row.student_id,
+            answer=row.answer,
+            status=values.get("status", row.status),
+            system_grade=values.get("system_grade", row.system_grade),
+            teacher_grade=values.get("teacher_grade", row.teacher_grade),
+            change_seq=values["change_seq"],
+        )
+        before = stats.contribution(row.status, row.teacher_grade)
+        after = stats.contribution(attempt.status, attempt.teacher_grade)
+        delta = deltas.setdefault(row.task_id, dict.fromkeys(stats.COUNTERS, 0))
+        for name in stats.COUNTERS:
+            delta[name] += after[name] - before[name]
+        attempts.append(attempt)
+
+    db.execute(update(models.Attempt), updates)
+    for task_id, delta in deltas.items():
+        stats.apply_delta(db, task_id, teacher_ids[task_id], delta)
+    # Объекты не добавлены в сессию: они только для рассылки событий
+    return attempts
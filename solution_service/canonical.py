@@ -0,0 +1,204 @@
+import hashlib
+import math
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+from config import ANSWER_REL_TOLERANCE, ANSWER_CACHE_SIZE
+
+# Версия формата: при изменении разбора старые формы пересобираются из текста
+CANONICAL_VERSION = 1
+
+# Единица -> (множитель к СИ, размерность (длина, время, масса))
+UNITS = {
+    "m": (1, (1, 0, 0)), "km": (1000, (1, 0, 0)), "cm": (0.01, (1, 0, 0)), "mm": (0.001, (1, 0, 0)),
+    "s": (1, (0, 1, 0)), "sec": (1, (0, 1, 0)), "ms": (0.001, (0, 1, 0)), "min": (60, (0, 1, 0)), "h": (3600, (0, 1, 0)),
+    "kg": (1, (0, 0, 1)), "g": (0.001, (0, 0, 1)), "t": (1000, (0, 0, 1)),
+    "N": (1, (1, -2, 1)), "kN": (1000, (1, -2, 1)),
+    "J": (1, (2, -2, 1)), "kJ": (1000, (2, -2, 1)),
+    "W": (1, (2, -3, 1)), "kW": (1000, (2, -3, 1)),
+    "Hz": (1, (0, -1, 0)),
+    "rad": (1, (0, 0, 0)), "deg": (math.pi / 180, (0, 0, 0)), "°": (math.pi / 180, (0, 0, 0)),
+    "м": (1, (1, 0, 0)), "км": (1000, (1, 0, 0)), "см": (0.01, (1, 0, 0)), "мм": (0.001, (1, 0, 0)),
+    "с": (1, (0, 1, 0)), "сек": (1, (0, 1, 0)), "мс": (0.001, (0, 1, 0)), "мин": (60, (0, 1, 0)),
+    "ч": (3600, (0, 1, 0)), "час": (3600, (0, 1, 0)),
+    "кг": (1, (0, 0, 1)), "г": (0.001, (0, 0, 1)), "т": (1000, (0, 0, 1)),
+    "Н": (1, (1, -2, 1)), "кН": (1000, (1, -2, 1)),
+    "Дж": (1, (2, -2, 1)), "кДж": (1000, (2, -2, 1)),
+    "Вт": (1, (2, -3, 1)), "кВт": (1000, (2, -3, 1)),
+    "Гц": (1, (0, -1, 0)),
+    "рад": (1, (0, 0, 0)), "град": (math.pi / 180, (0, 0, 0)),
+}
+
+NUMBER = r"[-+]?\d+(?:[.,]\d+)?(?:\s*(?:[eE]|[*×·xх]\s*10\s*\^)\s*[-+]?\d+)?"
+TOLERANCE = rf"(?:±|\+-|\+/-)\s*(?P<{{name}}>{NUMBER})"
+# Допуск можно указать до или после единиц: "1500 ± 10 м" или "1500 м ± 10"
+VALUE_RE = re.compile(
+    rf"^\s*(?P<number>{NUMBER})\s*(?:{TOLERANCE.format(name='tolerance')})?\s*(?P<unit>.*?)\s*"
+    rf"(?:{TOLERANCE.format(name='unit_tolerance')})?\s*$"
+)
+FACTOR_RE = re.compile(r"^(?P<name>[^\W\d_]+|°)\^?(?P<power>-?\d+)?$")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.strip().lower().split())
+
+
+def parse_number(text: str) -> float:
+    # "2,5", "1.5e3", "1,5·10^3"
+    text = text.replace(" ", "").replace(",", ".")
+    mantissa, exponent = (re.split(r"[eE]|[*×·xх]10\^", text, maxsplit=1) + [""])[:2]
+    return float(mantissa) * 10 ** int(exponent or 0)
+
+
+def parse_unit(text: str) -> tuple[float, tuple] | None:
+    text = text.replace(" ", "").replace("²", "^2").replace("³", "^3")
+    for separator in ("·", "⋅", "×"):
+        text = text.replace(separator, "*")
+    if not text:
+        return 1, (0, 0, 0)
+    factor, dims = 1, [0, 0, 0]
+    for index, segment in enumerate(text.split("/")):
+        sign = 1 if index == 0 else -1
+        for item in segment.split("*"):
+            match = FACTOR_RE.match(item)
+            if not match:
+                return None
+            name = match["name"]
+            unit = UNITS.get(name) or UNITS.get(name.lower())
+            if unit is None:
+                return None
+            power = sign * int(match["power"] or 1)
+            factor *= unit[0] ** power
+            dims = [dim + unit_dim * power for dim, unit_dim in zip(dims, unit[1])]
+    return factor, tuple(dims)
+
+
+def parse_value(text: str) -> dict | None:
+    match = VALUE_RE.match(text.replace("−", "-"))
+    if not match:
+        return None
+    unit = parse_unit(match["unit"])
+    if unit is None:
+        return None
+    scale, dims = unit
+    tolerance = match["tolerance"] or match["unit_tolerance"]
+    return {
+        "value": parse_number(match["number"]) * scale,
+        "scale": scale,
+        "dims": list(dims),
+        "has_unit": bool(match["unit"]),
+        "abs_tol": abs(parse_number(tolerance)) * scale if tolerance else None,
+    }
+
+
+def parse_values(text: str) -> list | None:
+    # Несколько величин в одном ответе разделяются ";"
+    values = [parse_value(part) for part in text.split(";")]
+    if not values or any(value is None for value in values):
+        return None
+    return values
+
+
+def compile_answer(text: str) -> dict:
+    # Разбирается один раз при создании ответа; нечисловые ответы сравниваются как текст
+    return {
+        "v": CANONICAL_VERSION,
+        "text": normalize_text(text),
+        "values": parse_values(text),
+        "rel_tol": ANSWER_REL_TOLERANCE,
+    }
+
+
+def is_current(canonical: dict | None) -> bool:
+    return bool(canonical) and canonical.get("v") == CANONICAL_VERSION
+
+
+def value_matches(expected: dict, submitted: dict, rel_tol: float) -> bool:
+    if submitted["has_unit"]:
+        if submitted["dims"] != expected["dims"]:
+            return False
+        actual = submitted["value"]
+    else:
+        # Число без единиц понимаем в единицах эталона: "2,5" к "2.5 м/с"
+        actual = submitted["value"] * expected["scale"]
+    tolerance = expected["abs_tol"] if expected["abs_tol"] is not None else rel_tol * abs(expected["value"])
+    return abs(actual - expected["value"]) <= tolerance + 1e-12
+
+
+def matches(canonical: dict, submission: str) -> bool:
+    if normalize_text(submission) == canonical["text"]:
+        return True
+    if not canonical["values"]:
+        return False
+    submitted = parse_values(submission)
+    if submitted is None or len(submitted) != len(canonical["values"]):
+        return False
+    return all(
+        value_matches(expected, actual, canonical["rel_tol"])
+        for expected, actual in zip(canonical["values"], submitted)
+    )
+
+
+def fingerprint(text: str) -> str:
+    # Одинаковые по смыслу ответы ("2.5 м/с", "2,50 m/s", "9 км/ч") дают один отпечаток,
+    # чтобы учитель оценивал каждый различный ответ один раз
+    values = parse_values(text)
+    if values:
+        key = ";".join(f"{value['value']:.9g}|{value['dims']}|{int(value['has_unit'])}" for value in values)
+    else:
+        key = "text:" + normalize_text(text)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def matches_batch(canonical: dict, submissions: list) -> np.ndarray:
+    # Для перепроверки тысяч попыток: одинаковые ответы разбираются один раз,
+    # сравнение с эталоном с учётом допуска — одной операцией над массивом
+    unique = {}
+    inverse = np.fromiter((unique.setdefault(submission, len(unique)) for submission in submissions),
+                          dtype=np.intp, count=len(submissions))
+    texts = list(unique)
+    result = np.fromiter((normalize_text(text) == canonical["text"] for text in texts), dtype=bool, count=len(texts))
+    expected = canonical["values"]
+    if expected:
+        actual = np.full((len(texts), len(expected)), np.nan)
+        for row, text in enumerate(texts):
+            submitted = parse_values(text)
+            if submitted is None or len(submitted) != len(expected):
+                continue
+            for column, (reference, value) in enumerate(zip(expected, submitted)):
+                if not value["has_unit"]:
+                    actual[row, column] = value["value"] * reference["scale"]
+                elif value["dims"] == reference["dims"]:
+                    actual[row, column] = value["value"]
+        target = np.array([reference["value"] for reference in expected])
+        tolerance = np.array([
+            reference["abs_tol"] if reference["abs_tol"] is not None else canonical["rel_tol"] * abs(reference["value"])
+            for reference in expected
+        ]) + 1e-12
+        # NaN (не разобрано или другая размерность) сравнение не проходит
+        result |= np.all(np.abs(actual - target) <= tolerance, axis=1)
+    return result[inverse]
+
+
+class CanonicalCache:
+    # LRU по id ответа: эталоны не редактируются, поэтому инвалидация не нужна
+    def __init__(self, size: int):
+        self._size = size
+        self._items = OrderedDict()
+
+    def get(self, answer_id: int) -> dict | None:
+        canonical = self._items.get(answer_id)
+        if canonical is not None:
+            self._items.move_to_end(answer_id)
+        return canonical
+
+    def put(self, answer_id: int, canonical: dict):
+        self._items[answer_id] = canonical
+        self._items.move_to_end(answer_id)
+        while len(self._items) > self._size:
+            self._items.popitem(last=False)
+
+
+cache = CanonicalCache(ANSWER_CACHE_SIZE)
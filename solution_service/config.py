@@ -10,6 +10,15 @@ SOLUTION_PREFIX_API = os.getenv("SOLUTION_PREFIX_API", "/api/solutions")
 
 DATABASE_URL = str(os.getenv("DATABASE_URL"))
 
+# Реплика только для чтения (необязательна). Чтения идут в неё, пока отставание, измеряемое
+# по строке replica_heartbeat раз в DATABASE_REPLICA_CHECK_INTERVAL секунд, не больше
+# DATABASE_REPLICA_MAX_LAG; после записи клиент DATABASE_REPLICA_STICKY_SECONDS читает из основной БД.
+# Локально реплику можно изображать копией файла SQLite: sqlite3 main.db ".backup replica.db"
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or None
+DATABASE_REPLICA_MAX_LAG = float(os.getenv("DATABASE_REPLICA_MAX_LAG", "5"))
+DATABASE_REPLICA_STICKY_SECONDS = float(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "10"))
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", "1"))
+
 AUTH_SERVICE_HOST = os.getenv("AUTH_SERVICE_HOST")
 AUTH_SERVICE_PORT = os.getenv("AUTH_SERVICE_PORT")
 AUTH_SERVICE_AUTH_PREFIX_API = os.getenv("AUTH_SERVICE_AUTH_PREFIX_API")
@@ -22,4 +31,93 @@ TASK_SERVICE_THEME_PREFIX_API=os.getenv("TASK_SERVICE_THEME_PREFIX_API")
 
 MAX_IMAGE_SIZE = 10 * 1024 * 1024
 BASE_DIR = os.getenv("BASE_DIR", "C:\\Users\\azamat\\PycharmProjects\\KinematicsProblemSuite\\solution_service\\public\\attempts")
-UPLOAD_DIR = os.path.join(BASE_DIR, os.getenv("UPLOAD_DIR", "images"))
\ No newline at end of file
+UPLOAD_DIR = os.path.join(BASE_DIR, os.getenv("UPLOAD_DIR", "images"))
+
+# Быстрая сериализация списков (orjson без повторной валидации response_model)
+FAST_LIST_RESPONSES = os.getenv("FAST_LIST_RESPONSES", "false").lower() == "true"
+
+# Размер порции при потоковой выдаче попыток (yield_per)
+ATTEMPTS_STREAM_CHUNK_SIZE = int(os.getenv("ATTEMPTS_STREAM_CHUNK_SIZE", "500"))
+ATTEMPTS_PAGE_MAX_LIMIT = int(os.getenv("ATTEMPTS_PAGE_MAX_LIMIT", "1000"))
+ATTEMPTS_SYNC_LIMIT = int(os.getenv("ATTEMPTS_SYNC_LIMIT", "500"))
+
+# Брокер событий между воркерами: пусто — только в процессе,
+# postgresql://... — LISTEN/NOTIFY, unix:///каталог — датаграммы через Unix-сокеты (один хост)
+EVENT_BROKER_URL = os.getenv("EVENT_BROKER_URL", "")
+EVENT_BROKER_CHANNEL = os.getenv("EVENT_BROKER_CHANNEL", "attempt_events")
+EVENT_BROKER_QUEUE_SIZE = int(os.getenv("EVENT_BROKER_QUEUE_SIZE", "10000"))
+EVENT_BROKER_BATCH_SIZE = int(os.getenv("EVENT_BROKER_BATCH_SIZE", "100"))
+EVENT_BROKER_BATCH_WINDOW_MS = int(os.getenv("EVENT_BROKER_BATCH_WINDOW_MS", "5"))
+# Длина ответа в событии attempt_created: событие должно помещаться в одно сообщение брокера
+# (pg_notify — до 8000 байт); полный ответ клиент получает по attempt_id
+EVENT_ANSWER_MAX_CHARS = int(os.getenv("EVENT_ANSWER_MAX_CHARS", "1000"))
+
+# WebSocket-соединения: очередь отправки на сокет и пинги событием {"event": "ping"} (ответа не требуют,
+# держат соединение через прокси и выявляют оборванные при отправке)
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "25"))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))
+
+# Как часто обновлять локальный кэш задача -> тема (task_refs) из task-сервиса, секунды
+TASK_REFS_TTL = int(os.getenv("TASK_REFS_TTL", "300"))
+
+# Рейтинги: период сохранения снимка (секунды) и максимальный размер страницы
+LEADERBOARD_SNAPSHOT_INTERVAL = float(os.getenv("LEADERBOARD_SNAPSHOT_INTERVAL", "60"))
+LEADERBOARD_PAGE_MAX_LIMIT = int(os.getenv("LEADERBOARD_PAGE_MAX_LIMIT", "100"))
+
+# Автопроверка числовых ответов: относительный допуск и размер кэша разобранных эталонов
+ANSWER_REL_TOLERANCE = float(os.getenv("ANSWER_REL_TOLERANCE", "0.01"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+
+# Перепроверка попыток при смене эталона: размер порции (одна транзакция на порцию)
+REGRADE_CHUNK_SIZE = int(os.getenv("REGRADE_CHUNK_SIZE", "1000"))
+
+# Максимум оценок в одном запросе POST /attempts/grade/bulk
+BULK_GRADE_MAX_ITEMS = int(os.getenv("BULK_GRADE_MAX_ITEMS", "1000"))
+
+# Максимум ответов в одной пакетной отправке теста (POST /attempts/batch)
+ATTEMPT_BATCH_MAX_ITEMS = int(os.getenv("ATTEMPT_BATCH_MAX_ITEMS", "200"))
+
+# Групповая фиксация вставок попыток (по умолчанию выключена): пачка до WRITE_BATCH_SIZE строк
+# или WRITE_BATCH_WINDOW_MS миллисекунд фиксируется одной транзакцией
+WRITE_BATCHING = os.getenv("WRITE_BATCHING", "false").lower() == "true"
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_BATCH_WINDOW_MS = int(os.getenv("WRITE_BATCH_WINDOW_MS", "5"))
+WRITE_BATCH_QUEUE_SIZE = int(os.getenv("WRITE_BATCH_QUEUE_SIZE", "1000"))
+
+# Idempotency-Key: сколько секунд хранится результат запроса и как часто удалять истёкшие ключи
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+
+# Удаление эталонов, на которые не ссылается ни одна задача: период запуска (секунды) и
+# минимальный возраст эталона — свежий эталон может ещё ждать сохранения своей задачи
+ANSWER_GC_INTERVAL = float(os.getenv("ANSWER_GC_INTERVAL", "21600"))
+ANSWER_GC_GRACE = int(os.getenv("ANSWER_GC_GRACE", "3600"))
+ANSWER_GC_CHUNK_SIZE = int(os.getenv("ANSWER_GC_CHUNK_SIZE", "1000"))
+
+# Максимум эталонов в одном запросе POST /create/bulk и GET /answers
+ANSWER_BULK_MAX_ITEMS = int(os.getenv("ANSWER_BULK_MAX_ITEMS", "500"))
+
+# Архивация попыток: проверенные попытки старше ARCHIVE_GRADED_AGE_DAYS и удалённые старше
+# ARCHIVE_INACTIVE_AGE_DAYS (клиенты должны успеть получить надгробие через sync) переносятся
+# в attempts_archive порциями по ARCHIVE_CHUNK_SIZE раз в ARCHIVE_INTERVAL секунд
+ARCHIVE_GRADED_AGE_DAYS = int(os.getenv("ARCHIVE_GRADED_AGE_DAYS", "365"))
+ARCHIVE_INACTIVE_AGE_DAYS = int(os.getenv("ARCHIVE_INACTIVE_AGE_DAYS", "30"))
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", "1000"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "86400"))
+
+# Ограничение нагрузки по группам маршрутов (см. admission.py и main.py): ADMISSION_<ГРУППА>_LIMIT запросов
+# выполняются одновременно, до ADMISSION_<ГРУППА>_QUEUE ждут не дольше ADMISSION_QUEUE_TIMEOUT секунд,
+# остальные получают 503 с Retry-After: ADMISSION_RETRY_AFTER секунд
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_SUBMISSIONS_LIMIT = int(os.getenv("ADMISSION_SUBMISSIONS_LIMIT", "64"))
+ADMISSION_SUBMISSIONS_QUEUE = int(os.getenv("ADMISSION_SUBMISSIONS_QUEUE", "256"))
+ADMISSION_LISTINGS_LIMIT = int(os.getenv("ADMISSION_LISTINGS_LIMIT", "64"))
+ADMISSION_LISTINGS_QUEUE = int(os.getenv("ADMISSION_LISTINGS_QUEUE", "256"))
+# Websocket и SSE-потоки держат слот всё время подключения, поэтому очереди у них нет
+ADMISSION_WEBSOCKETS_LIMIT = int(os.getenv("ADMISSION_WEBSOCKETS_LIMIT", "2000"))
+
+# Частота отправки попыток одним пользователем (POST /attempts и /attempts/batch): в минуту и подряд
+ATTEMPT_RATE_PER_MINUTE = float(os.getenv("ATTEMPT_RATE_PER_MINUTE", "30"))
+ATTEMPT_RATE_BURST = int(os.getenv("ATTEMPT_RATE_BURST", "10"))
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from collections import defaultdict, deque
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+import events
+from config import WS_SEND_QUEUE_SIZE, WS_PING_INTERVAL
+
+# Код закрытия 1013 (Try Again Later): клиент переподключается с last_event_id и догоняется из БД
+WS_RESYNC_CLOSE_CODE = 1013
+
+
+class Connection:
+    def __init__(self, websocket: WebSocket | None, role: str, user_id: int):
+        self.websocket = websocket
+        self.role = role
+        self.user_id = user_id
+        self.watermark = 0
+        self.resume_id = 0
+        self.last_sent_id = 0  # id последнего события, отданного на отправку
+        self.overflowed = False
+        self._queue = deque()
+        self._ready = asyncio.Event()
+
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def enqueue(self, event: dict):
+        if event.get("id", 0) and event["id"] <= self.watermark:
+            return  # Уже отправлено в составе бэклога
+        if event.get("event") == "ping" and (len(self._queue) >= WS_SEND_QUEUE_SIZE or event in self._queue):
+            return  # Ping не копится и не считается переполнением
+        if "attempt_id" in event:
+            # Более новое состояние той же попытки заменяет ещё не отправленное
+            for queued in self._queue:
+                if queued.get("attempt_id") == event["attempt_id"]:
+                    self._queue.remove(queued)
+                    break
+        if len(self._queue) >= WS_SEND_QUEUE_SIZE:
+            # Клиент не успевает читать: выкидываем очередь и просим переподключиться
+            # с id, после которого всё выброшенное снова придёт из БД
+            dropped_ids = [queued["id"] for queued in self._queue if queued.get("id")]
+            if event.get("id"):
+                dropped_ids.append(event["id"])
+            if not self.overflowed:
+                # Без выброшенных событий с id клиент продолжает после последнего отправленного
+                resume_id = min(dropped_ids) - 1 if dropped_ids else self.last_sent_id
+                self.resume_id = max(resume_id, self.watermark)
+            self._queue.clear()
+            self.overflowed = True
+        else:
+            self._queue.append(event)
+        self._ready.set()
+
+    async def next_event(self) -> dict | None:
+        while True:
+            while not self._queue and not self.overflowed:
+                self._ready.clear()
+                await self._ready.wait()
+            if self.overflowed:
+                return None
+            event = self._queue.popleft()
+            # Событие могло прийти, пока загружался бэклог, до того как стал известен watermark
+            if not event.get("id", 0) or event["id"] > self.watermark:
+                self.last_sent_id = max(self.last_sent_id, event.get("id", 0))
+                return event
+
+
+class ConnectionManager:
+    def __init__(self):
+        self._connections = defaultdict(set)  # (role, user_id) -> соединения
+        self._dropped = 0
+        self._heartbeat_task = None
+
+    def start(self):
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+
+    def metrics(self) -> dict:
+        connections = [conn for conns in self._connections.values() for conn in conns]
+        by_role = defaultdict(int)
+        for conn in connections:
+            by_role[conn.role] += 1
+        depths = [conn.queue_depth() for conn in connections]
+        return {
+            "connections": len(connections),
+            "connections_by_role": dict(by_role),
+            "users": len(self._connections),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "overflow_disconnects": self._dropped,
+            "broker_queue_depth": events.broker.queue_depth(),
+        }
+
+    def _register(self, conn: Connection, topic: str):
+        self._connections[(conn.role, conn.user_id)].add(conn)
+        events.bus.subscribe(topic, conn.enqueue)
+
+    def _unregister(self, conn: Connection, topic: str):
+        key = (conn.role, conn.user_id)
+        events.bus.unsubscribe(topic, conn.enqueue)
+        self._connections[key].discard(conn)
+        if not self._connections[key]:
+            del self._connections[key]
+
+    async def serve(self, websocket: WebSocket, role: str, user_id: int, topic: str, load_backlog):
+        conn = Connection(websocket, role, user_id)
+        # Подписываемся до чтения бэклога, чтобы не потерять события между запросом и подпиской
+        self._register(conn, topic)
+        try:
+            backlog, conn.watermark = await asyncio.to_thread(load_backlog)
+            for event in backlog:
+                await websocket.send_json(event)
+            sender = asyncio.create_task(self._send_loop(conn))
+            receiver = asyncio.create_task(self._receive_loop(conn))
+            done, pending = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                if task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                    logging.error(f"WebSocket error: {str(task.exception())}")
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._unregister(conn, topic)
+
+    async def stream(self, role: str, user_id: int, topic: str, load_backlog):
+        # То же для однонаправленных потоков (SSE): события отдаются генератором,
+        # отключение клиента отменяет генератор на стороне StreamingResponse
+        conn = Connection(None, role, user_id)
+        self._register(conn, topic)
+        try:
+            backlog, conn.watermark = await asyncio.to_thread(load_backlog)
+            for event in backlog:
+                yield event
+            while True:
+                event = await conn.next_event()
+                if event is None:
+                    self._dropped += 1
+                    yield {"event": "resync", "id": conn.resume_id}
+                    return
+                yield event
+        finally:
+            self._unregister(conn, topic)
+
+    async def _send_loop(self, conn: Connection):
+        # Медленный клиент блокирует только собственную задачу отправки
+        while True:
+            event = await conn.next_event()
+            if event is None:
+                self._dropped += 1
+                await conn.websocket.send_json({"event": "resync", "id": conn.resume_id})
+                await conn.websocket.close(code=WS_RESYNC_CLOSE_CODE)
+                return
+            await conn.websocket.send_json(event)
+
+    async def _receive_loop(self, conn: Connection):
+        # Молчание клиента не признак обрыва: на пинги клиенты не отвечают. Мёртвое соединение
+        # закрывают протокольные ping сервера (ws_ping_interval в uvicorn) или ошибка отправки,
+        # здесь только ждём отключения, сообщения клиента игнорируются
+        while True:
+            message = await conn.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    async def _heartbeat_loop(self):
+        # Один цикл на воркер вместо таймера на каждый сокет
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            for conns in list(self._connections.values()):
+                for conn in list(conns):
+                    conn.enqueue({"event": "ping"})
+
+
+manager = ConnectionManager()
@@ -0,0 +1,74 @@
+from collections import defaultdict
+
+import models
+from broker import create_broker
+from config import EVENT_ANSWER_MAX_CHARS
+
+
+# Идентификатор события — change_seq попытки: он монотонен, переживает рестарты,
+# и по нему переподключившийся клиент досылается из БД без хранения истории в памяти.
+def attempt_event(attempt: models.Attempt) -> dict:
+    if attempt.status == models.AttemptStatus.PENDING:
+        return {
+            "id": attempt.change_seq,
+            "event": "attempt_created",
+            "attempt_id": attempt.id,
+            "task_id": attempt.task_id,
+            "student_id": attempt.student_id,
+            "answer": attempt.answer[:EVENT_ANSWER_MAX_CHARS],
+            "answer_truncated": len(attempt.answer) > EVENT_ANSWER_MAX_CHARS,
+            "system_grade": attempt.system_grade,
+        }
+    return {
+        "id": attempt.change_seq,
+        "event": "attempt_graded",
+        "attempt_id": attempt.id,
+        "task_id": attempt.task_id,
+        "student_id": attempt.student_id,
+        "status": attempt.status.value,
+        "system_grade": attempt.system_grade,
+        "teacher_grade": attempt.teacher_grade,
+    }
+
+
+def teacher_topic(teacher_id: int) -> str:
+    return f"teacher:{teacher_id}"
+
+
+def student_topic(student_id: int) -> str:
+    return f"student:{student_id}"
+
+
+# Общий топик всех изменений попыток для внутренних подписчиков (кэши агрегатов)
+ATTEMPTS_TOPIC = "attempts"
+
+
+class EventBus:
+    # Подписчик — функция без ожидания (например, постановка в очередь сокета),
+    # поэтому один медленный получатель не задерживает рассылку остальным
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+
+    def publish(self, topic: str, event: dict):
+        for callback in list(self._subscribers.get(topic, ())):
+            callback(event)
+
+    def subscribe(self, topic: str, callback):
+        self._subscribers[topic].add(callback)
+
+    def unsubscribe(self, topic: str, callback):
+        self._subscribers[topic].discard(callback)
+        if not self._subscribers[topic]:
+            del self._subscribers[topic]
+
+
+bus = EventBus()
+# Все события идут через брокер, в том числе до подписчиков этого же воркера
+broker = create_broker()
+
+
+async def publish_attempt(attempt: models.Attempt, teacher_id: int):
+    event = attempt_event(attempt)
+    await broker.publish(teacher_topic(teacher_id), event)
+    await broker.publish(student_topic(attempt.student_id), event)
+    await broker.publish(ATTEMPTS_TOPIC, {**event, "teacher_id": teacher_id})
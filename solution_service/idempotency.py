@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+import orjson
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+import models
+import database
+from config import IDEMPOTENCY_KEY_TTL, IDEMPOTENCY_PURGE_INTERVAL
+
+# Ограничение длины самого заголовка; в базе хранится только хэш
+MAX_KEY_LENGTH = 255
+
+_tasks = []
+
+
+def key_hash(scope: str, user_id: int, key: str) -> str:
+    # В хэше id пользователя, а не токен: повтор после обновления токена находит тот же ключ,
+    # а ключ одного пользователя не совпадёт с ключом другого
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+    return hashlib.sha256(f"{scope}\n{user_id}\n{key}".encode()).hexdigest()
+
+
+def request_hash(*parts) -> str:
+    return hashlib.sha256(orjson.dumps(parts)).hexdigest()
+
+
+def lookup(db: Session, hashed: str, request_fingerprint: str) -> int | None:
+    row = db.get(models.IdempotencyKey, hashed)
+    if row is None:
+        return None
+    if row.expires_at <= time.time():
+        # Истёкший ключ удаляется вместе с новой записью, иначе она не вставится
+        db.delete(row)
+        return None
+    if row.request_hash != request_fingerprint:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Idempotency-Key was already used with a different request")
+    return row.resource_id
+
+
+def make_key(hashed: str, request_fingerprint: str) -> models.IdempotencyKey:
+    # resource_id заполняет вызывающий код после flush, запись фиксируется вместе с ресурсом
+    return models.IdempotencyKey(key_hash=hashed, request_hash=request_fingerprint,
+                                 expires_at=int(time.time()) + IDEMPOTENCY_KEY_TTL)
+
+
+def forget(db: Session, hashed: str):
+    db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key_hash == hashed).delete()
+
+
+def purge_expired() -> int:
+    db = database.SessionLocal()
+    try:
+        deleted = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.expires_at <= int(time.time())).delete()
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+async def _purge_loop():
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
+        try:
+            deleted = await asyncio.to_thread(purge_expired)
+            if deleted:
+                logging.info(f"Purged {deleted} expired idempotency keys")
+        except Exception as e:
+            logging.error(f"Idempotency key purge failed: {str(e)}")
+
+
+def start():
+    _tasks.append(asyncio.create_task(_purge_loop()))
+
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
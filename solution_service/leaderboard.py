@@ -0,0 +1,308 @@
+import asyncio
+import logging
+from bisect import bisect_left, insort
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import case, func, tuple_, update
+from sqlalchemy.orm import Session
+
+import models
+import database
+import events
+from attempt import get_user_data
+from config import LEADERBOARD_SNAPSHOT_INTERVAL, LEADERBOARD_PAGE_MAX_LIMIT
+from utils import oauth2_scheme
+
+router = APIRouter()
+
+CLASS_SCOPE = "class"
+SNAPSHOT_COUNTER = "leaderboard"
+REFRESH_CHUNK_SIZE = 500
+
+
+def theme_scope(theme_id: int) -> str:
+    return f"theme:{theme_id}"
+
+
+class Ranking:
+    # Два отсортированных списка ключей (по решённым и по сумме оценок):
+    # место ищется bisect за O(log n), страница топа — срез списка
+    def __init__(self):
+        self.scores = {}  # student_id -> (solved, total_grade)
+        self._keys = {"solved": [], "grade": []}
+
+    @staticmethod
+    def _key(metric: str, student_id: int, solved: int, total_grade: int) -> tuple:
+        if metric == "solved":
+            return -solved, -total_grade, student_id
+        return -total_grade, -solved, student_id
+
+    def add(self, student_id: int, solved: int, total_grade: int):
+        old = self.scores.get(student_id, (0, 0))
+        new = (old[0] + solved, old[1] + total_grade)
+        if new == old:
+            return
+        for metric, keys in self._keys.items():
+            if student_id in self.scores:
+                keys.pop(bisect_left(keys, self._key(metric, student_id, *old)))
+            if new != (0, 0):
+                insort(keys, self._key(metric, student_id, *new))
+        if new == (0, 0):
+            self.scores.pop(student_id, None)
+        else:
+            self.scores[student_id] = new
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def rank(self, student_id: int, metric: str) -> int | None:
+        if student_id not in self.scores:
+            return None
+        # Равные результаты делят место: считаем только строго лучших
+        primary = self._key(metric, student_id, *self.scores[student_id])[0]
+        return bisect_left(self._keys[metric], (primary,)) + 1
+
+    def top(self, metric: str, offset: int, limit: int) -> list:
+        entries = []
+        for key in self._keys[metric][offset:offset + limit]:
+            student_id = key[2]
+            solved, total_grade = self.scores[student_id]
+            entries.append({
+                "rank": self.rank(student_id, metric),
+                "student_id": student_id,
+                "solved": solved,
+                "total_grade": total_grade,
+            })
+        return entries
+
+
+class Leaderboard:
+    # Вклад пары студент/задача: решена ли задача и лучшая оценка учителя за неё.
+    # Рейтинги — суммы вкладов по классу и по теме, меняются на разницу при каждом событии.
+    def __init__(self):
+        self.rankings = {CLASS_SCOPE: Ranking()}
+        self._contributions = {}  # (student_id, task_id) -> (theme_id, solved, best_grade)
+        self._dirty_pairs = set()
+        self._wakeup = None
+        self._tasks = []
+        self._snapshot_seq = 0
+        self.ready = False
+
+    def ranking(self, scope: str) -> Ranking:
+        return self.rankings.get(scope) or Ranking()
+
+    def apply(self, student_id: int, task_id: int, contribution: tuple | None):
+        old = self._contributions.pop((student_id, task_id), None)
+        if old is not None:
+            self._add(student_id, *old, sign=-1)
+        if contribution is not None and (contribution[1] or contribution[2]):
+            self._contributions[(student_id, task_id)] = contribution
+            self._add(student_id, *contribution, sign=1)
+
+    def _add(self, student_id: int, theme_id: int | None, solved: bool, best_grade: int, sign: int):
+        scopes = [CLASS_SCOPE] if theme_id is None else [CLASS_SCOPE, theme_scope(theme_id)]
+        for scope in scopes:
+            ranking = self.rankings.setdefault(scope, Ranking())
+            ranking.add(student_id, sign * int(solved), sign * best_grade)
+
+    def on_event(self, event: dict):
+        # Вызывается из шины: только отмечаем пару, пересчёт из БД — в фоновой задаче
+        self._dirty_pairs.add((event["student_id"], event["task_id"]))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        events.bus.subscribe(events.ATTEMPTS_TOPIC, self.on_event)
+        contributions, pairs, self._snapshot_seq = await asyncio.to_thread(load_state)
+        for (student_id, task_id), contribution in contributions.items():
+            self.apply(student_id, task_id, contribution)
+        self._dirty_pairs.update(pairs)
+        self.ready = True
+        self._wakeup.set()
+        self._tasks = [asyncio.create_task(self._refresh_loop()), asyncio.create_task(self._snapshot_loop())]
+
+    async def stop(self):
+        events.bus.unsubscribe(events.ATTEMPTS_TOPIC, self.on_event)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.ready:
+            await self.save_snapshot()
+
+    async def _refresh_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            pairs, self._dirty_pairs = self._dirty_pairs, set()
+            if not pairs:
+                continue
+            try:
+                contributions = await asyncio.to_thread(load_contributions, pairs)
+            except Exception as e:
+                logging.error(f"Leaderboard refresh failed: {str(e)}")
+                self._dirty_pairs.update(pairs)
+                await asyncio.sleep(1)
+                self._wakeup.set()
+                continue
+            # Применяем в цикле событий, чтобы чтения не видели наполовину обновлённые списки
+            for student_id, task_id in pairs:
+                self.apply(student_id, task_id, contributions.get((student_id, task_id)))
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(LEADERBOARD_SNAPSHOT_INTERVAL)
+            try:
+                await self.save_snapshot()
+            except Exception as e:
+                logging.error(f"Leaderboard snapshot failed: {str(e)}")
+
+    async def save_snapshot(self):
+        # События о части изменений могут ещё идти через брокер, поэтому пары, изменённые
+        # после прошлого снимка, перечитываются из БД: снимок точен до своего watermark
+        watermark, pairs, contributions = await asyncio.to_thread(load_changed_since, self._snapshot_seq)
+        if not pairs and watermark == self._snapshot_seq:
+            return
+        for student_id, task_id in pairs:
+            self.apply(student_id, task_id, contributions.get((student_id, task_id)))
+        rows = [
+            {"student_id": student_id, "task_id": task_id, "theme_id": theme_id,
+             "solved": solved, "best_grade": best_grade}
+            for (student_id, task_id), (theme_id, solved, best_grade) in self._contributions.items()
+        ]
+        await asyncio.to_thread(write_snapshot, rows, watermark)
+        self._snapshot_seq = watermark
+
+
+def changed_pairs(db: Session, since: int, until: int | None = None) -> set:
+    query = db.query(models.Attempt.student_id, models.Attempt.task_id).filter(models.Attempt.change_seq > since)
+    if until is not None:
+        query = query.filter(models.Attempt.change_seq <= until)
+    return {tuple(pair) for pair in query.distinct().all()}
+
+
+def load_changed_since(since: int) -> tuple[int, set, dict]:
+    db = database.SessionLocal()
+    try:
+        watermark = models.current_change_seq(db.connection())
+        pairs = changed_pairs(db, since, watermark)
+    finally:
+        db.close()
+    return watermark, pairs, load_contributions(pairs)
+
+
+def load_contributions(pairs) -> dict:
+    db = database.SessionLocal()
+    try:
+        contributions = {}
+        pairs = list(pairs)
+        for start in range(0, len(pairs), REFRESH_CHUNK_SIZE):
+            chunk = pairs[start:start + REFRESH_CHUNK_SIZE]
+            attempts = models.scored_attempts()
+            rows = contribution_query(db, attempts).filter(
+                tuple_(attempts.c.student_id, attempts.c.task_id).in_(chunk)
+            )
+            for student_id, task_id, theme_id, solved, best_grade in rows:
+                contributions[(student_id, task_id)] = (theme_id, bool(solved), best_grade or 0)
+        return contributions
+    finally:
+        db.close()
+
+
+def contribution_query(db: Session, attempts=None):
+    # attempts — models.scored_attempts(): архивные решения тоже входят в рейтинг
+    if attempts is None:
+        attempts = models.scored_attempts()
+    return db.query(
+        attempts.c.student_id,
+        attempts.c.task_id,
+        models.TaskRef.theme_id,
+        func.max(case((attempts.c.status == models.AttemptStatus.CORRECT, 1), else_=0)),
+        func.max(attempts.c.teacher_grade),
+    ).outerjoin(
+        models.TaskRef, models.TaskRef.task_id == attempts.c.task_id
+    ).group_by(attempts.c.student_id, attempts.c.task_id, models.TaskRef.theme_id)
+
+
+def load_state() -> tuple[dict, set, int]:
+    # Есть снимок — читаем его и догоняем пары, изменившиеся после watermark;
+    # нет — полный пересчёт одним GROUP BY по attempts и архиву
+    db = database.SessionLocal()
+    try:
+        watermark = models.current_change_seq(db.connection(), SNAPSHOT_COUNTER)
+        if not watermark:
+            watermark = models.current_change_seq(db.connection())
+            rows = contribution_query(db).all()
+            logging.info(f"Leaderboard rebuilt from {len(rows)} student/task pairs")
+            return {
+                (student_id, task_id): (theme_id, bool(solved), best_grade or 0)
+                for student_id, task_id, theme_id, solved, best_grade in rows
+            }, set(), watermark
+        contributions = {
+            (row.student_id, row.task_id): (row.theme_id, row.solved, row.best_grade)
+            for row in db.query(models.LeaderboardSnapshot).all()
+        }
+        pairs = changed_pairs(db, watermark)
+        logging.info(f"Leaderboard loaded from snapshot, {len(pairs)} pairs to catch up")
+        return contributions, pairs, watermark
+    finally:
+        db.close()
+
+
+def write_snapshot(rows: list, watermark: int):
+    db = database.SessionLocal()
+    try:
+        db.query(models.LeaderboardSnapshot).delete()
+        if rows:
+            db.execute(models.LeaderboardSnapshot.__table__.insert(), rows)
+        counter = models.ChangeCounter.__table__
+        result = db.execute(update(counter).where(counter.c.name == SNAPSHOT_COUNTER).values(value=watermark))
+        if result.rowcount == 0:
+            db.execute(counter.insert().values(name=SNAPSHOT_COUNTER, value=watermark))
+        db.commit()
+    finally:
+        db.close()
+
+
+board = Leaderboard()
+
+
+@router.get("/leaderboard")
+async def get_leaderboard(
+        metric: Literal["solved", "grade"] = "solved",
+        theme_id: int | None = None,
+        offset: int = Query(0, ge=0),
+        limit: int = Query(20, ge=1, le=LEADERBOARD_PAGE_MAX_LIMIT),
+        token: str = Depends(oauth2_scheme),
+):
+    await get_user_data(token)
+    if not board.ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Leaderboard is loading")
+
+    ranking = board.ranking(CLASS_SCOPE if theme_id is None else theme_scope(theme_id))
+    return {"total": len(ranking), "entries": ranking.top(metric, offset, limit)}
+
+
+@router.get("/leaderboard/me")
+async def get_my_rank(
+        theme_id: int | None = None,
+        token: str = Depends(oauth2_scheme),
+):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only students have a rank")
+    if not board.ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Leaderboard is loading")
+
+    ranking = board.ranking(CLASS_SCOPE if theme_id is None else theme_scope(theme_id))
+    solved, total_grade = ranking.scores.get(user_data["id"], (0, 0))
+    return {
+        "student_id": user_data["id"],
+        "solved": solved,
+        "total_grade": total_grade,
+        "rank_by_solved": ranking.rank(user_data["id"], "solved"),
+        "rank_by_grade": ranking.rank(user_data["id"], "grade"),
+        "total": len(ranking),
+    }
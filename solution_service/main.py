@@ -1,18 +1,66 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import re
 import uvicorn
 import logging
 
+import admission
 import attempt
 import answer
+import answer_gc
+import archive
+import batching
+import connections
+import events
+import idempotency
+import leaderboard
+import migrations
+import progress
+import regrade
+import replica
 from database import engine, Base
-from config import HOST, PORT, SOLUTION_PREFIX_API
+from config import HOST, PORT, SOLUTION_PREFIX_API, ANSWER_GC_INTERVAL, ARCHIVE_INTERVAL, \
+    ADMISSION_SUBMISSIONS_LIMIT, ADMISSION_SUBMISSIONS_QUEUE, ADMISSION_LISTINGS_LIMIT, ADMISSION_LISTINGS_QUEUE, \
+    ADMISSION_WEBSOCKETS_LIMIT
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Startup
+    await events.broker.start(events.bus.publish)
+    logging.info(f"Event broker started: {type(events.broker).__name__}")
+    connections.manager.start()
+    progress.subscribe()
+    await leaderboard.board.start()
+    await batching.writer.start()
+    idempotency.start()
+    replica.start()
+
+    scheduler = AsyncIOScheduler()
+    scheduler.add_job(answer_gc.collect, "interval", seconds=ANSWER_GC_INTERVAL)
+    scheduler.add_job(archive.run, "interval", seconds=ARCHIVE_INTERVAL)
+    scheduler.start()
+
+    yield
+
+    # Shutdown
+    scheduler.shutdown(wait=False)
+    await batching.writer.stop()
+    await idempotency.stop()
+    await replica.stop()
+    await regrade.stop()
+    await leaderboard.board.stop()
+    await connections.manager.stop()
+    await events.broker.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 Base.metadata.create_all(bind=engine)
+migrations.upgrade(engine)
 
 origins = [
     "http://localhost:3000",
@@ -23,22 +71,42 @@ origins = [
     "http://localhost:8002",
 ]
 
+# Группы маршрутов с отдельными лимитами; проверяются по порядку, первая подходящая занимает слот.
+# Добавляется раньше CORS, чтобы ответ 503 тоже получал CORS-заголовки
+prefix = re.escape(SOLUTION_PREFIX_API)
+app.add_middleware(admission.AdmissionMiddleware, groups=[
+    admission.RouteGroup("websockets", ("WEBSOCKET", "GET"), rf"{prefix}/(ws/teacher/|attempts/student/events)",
+                         ADMISSION_WEBSOCKETS_LIMIT, 0),
+    admission.RouteGroup("submissions", ("POST",), rf"{prefix}/attempts(/batch)?$",
+                         ADMISSION_SUBMISSIONS_LIMIT, ADMISSION_SUBMISSIONS_QUEUE),
+    admission.RouteGroup("listings", ("GET",), rf"{prefix}/(attempts|progress|leaderboard|teacher)",
+                         ADMISSION_LISTINGS_LIMIT, ADMISSION_LISTINGS_QUEUE),
+])
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_headers=["Content-Type", "Authorization", "Idempotency-Key"],
 )
 
+app.middleware("http")(replica.track_writes)
+
 app.include_router(router=attempt.router, prefix=SOLUTION_PREFIX_API)
 app.include_router(router=answer.router, prefix=SOLUTION_PREFIX_API)
+app.include_router(router=progress.router, prefix=SOLUTION_PREFIX_API)
+app.include_router(router=leaderboard.router, prefix=SOLUTION_PREFIX_API)
+app.include_router(router=regrade.router, prefix=SOLUTION_PREFIX_API)
+app.include_router(router=archive.router, prefix=SOLUTION_PREFIX_API)
+app.include_router(router=admission.router)
 
 logging.basicConfig(level=logging.INFO)
 
 @app.middleware("http")
 async def log_requests(request, call_next):
-    logging.info(f"Request: {request.method} {request.url}")
+    # Токен из параметра access_token (поток событий ученика) в лог не пишем
+    logging.info(f"Request: {request.method} {request.url.remove_query_params('access_token')}")
     try:
         response = await call_next(request)
         logging.info(f"Response status: {response.status_code}")
@@ -0,0 +1,56 @@
+import logging
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+import models
+from database import Base
+
+
+def backfill_change_seq(conn: Connection):
+    # Старые попытки получают номера в порядке id, счётчик продолжается после них.
+    # Без ORM-обновления: updated_at старых попыток не меняется
+    conn.execute(text("UPDATE attempts SET change_seq = id"))
+    last = conn.execute(select(func.max(models.Attempt.id))).scalar() or 0
+    current = models.current_change_seq(conn)
+    if last > current:
+        models.reserve_change_seqs(conn, last - current)
+
+
+# Колонки, добавленные в уже существующие таблицы: create_all их не добавляет.
+# (колонка модели, ограничения в DDL, заполнение старых строк или None)
+ADDED_COLUMNS = [
+    (models.Attempt.__table__.c.change_seq, "NOT NULL DEFAULT 0", backfill_change_seq),
+    # Старые эталоны разбираются при первом чтении, см. attempt.get_answer_canonicals
+    (models.Answer.__table__.c.canonical, "", None),
+    # Отпечатки непроверенных попыток заполняются при группировке, см. attempt.backfill_fingerprints
+    (models.Attempt.__table__.c.answer_fingerprint, "", None),
+    # Старые эталоны остаются без задачи и хэша: текущий эталон задачи узнаётся по current_answer_id
+    (models.Answer.__table__.c.task_id, "", None),
+    (models.Answer.__table__.c.content_hash, "", None),
+]
+
+
+def add_column(conn: Connection, column, constraints: str):
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {column.table.name} ADD COLUMN {column.name} {column_type} {constraints}".rstrip()))
+
+
+def upgrade(engine: Engine):
+    # Вызывается при старте сразу после create_all; повторный запуск ничего не меняет
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for column, constraints, backfill in ADDED_COLUMNS:
+            if column.name in {existing["name"] for existing in inspector.get_columns(column.table.name)}:
+                continue
+            logging.info(f"Migration: adding {column.table.name}.{column.name}")
+            add_column(conn, column, constraints)
+            if backfill is not None:
+                backfill(conn)
+        # Индексы по новым колонкам — после самих колонок
+        for table in Base.metadata.sorted_tables:
+            existing = {index["name"] for index in inspect(conn).get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    logging.info(f"Migration: creating index {index.name}")
+                    index.create(conn)
@@ -1,8 +1,15 @@
 import datetime
 import enum
-from sqlalchemy import Column, Integer, String, Enum, Boolean, DateTime, Text
+from sqlalchemy import Column, Integer, String, Enum, Boolean, DateTime, Text, BigInteger, Index, JSON, event, select, \
+    union_all, update
+from sqlalchemy.orm import Session
 from database import Base
 
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
 class AttemptStatus(enum.Enum):
     PENDING = "pending"
     CORRECT = "correct"
@@ -10,25 +17,190 @@ class AttemptStatus(enum.Enum):
 
 class Attempt(Base):
     __tablename__ = "attempts"
+    __table_args__ = (
+        Index("ix_attempts_student_change_seq", "student_id", "change_seq"),
+        Index("ix_attempts_task_change_seq", "task_id", "change_seq"),
+        Index("ix_attempts_change_seq", "change_seq"),
+        Index("ix_attempts_task_id_id", "task_id", "id"),
+        Index("ix_attempts_task_status_fingerprint", "task_id", "status", "answer_fingerprint"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     task_id = Column(Integer, nullable=False)  # Без ForeignKey, проверяется через API
     student_id = Column(Integer, nullable=False)  # Без ForeignKey, проверяется через API
     answer = Column(Text, nullable=False)
+    answer_fingerprint = Column(String(40), nullable=True)  # Нормализованный ответ, см. canonical.fingerprint
+    status = Column(Enum(AttemptStatus), nullable=False)
+    system_grade = Column(Integer, nullable=True)
+    teacher_grade = Column(Integer, nullable=True)
+    image_path = Column(Text, nullable=True)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+    change_seq = Column(BigInteger, nullable=False, default=0)  # Номер последнего изменения, см. ChangeCounter
+
+class ArchivedAttempt(Base):
+    # Старые проверенные и удалённые попытки, перенесённые из attempts, см. archive.py; id сохраняется
+    __tablename__ = "attempts_archive"
+    __table_args__ = (
+        Index("ix_attempts_archive_task_id_id", "task_id", "id"),
+        Index("ix_attempts_archive_student_task", "student_id", "task_id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    task_id = Column(Integer, nullable=False)
+    student_id = Column(Integer, nullable=False)
+    answer = Column(Text, nullable=False)
+    answer_fingerprint = Column(String(40), nullable=True)
     status = Column(Enum(AttemptStatus), nullable=False)
     system_grade = Column(Integer, nullable=True)
     teacher_grade = Column(Integer, nullable=True)
     image_path = Column(Text, nullable=True)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc))
-    updated_at = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc))
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+    change_seq = Column(BigInteger, nullable=False, default=0)
+    archived_at = Column(DateTime, default=utcnow)
+
+
+def scored_attempts():
+    # Активные попытки вместе с архивными: полные пересчёты статистики, рейтинга и прогресса
+    # должны видеть и перенесённые в архив решения
+    columns = ("id", "task_id", "student_id", "status", "teacher_grade")
+    return union_all(
+        select(*(getattr(Attempt, name) for name in columns)).where(Attempt.is_active),
+        select(*(getattr(ArchivedAttempt, name) for name in columns)).where(ArchivedAttempt.is_active),
+    ).subquery("scored_attempts")
+
 
 class Answer(Base):
     __tablename__ = "answers"
+    __table_args__ = (
+        Index("ix_answers_task_content_hash", "task_id", "content_hash"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     text = Column(Text, nullable=False)
     user_id = Column(Integer, nullable=False)  # Без ForeignKey, для учителя
+    task_id = Column(Integer, nullable=True)  # Задача, при изменении которой создан эталон; при создании задачи ещё неизвестна
+    content_hash = Column(String(64), nullable=True)  # sha256 текста, для повторного использования эталона
+    canonical = Column(JSON, nullable=True)  # Разобранный эталон для автопроверки, см. canonical.py
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+
+class ChangeCounter(Base):
+    __tablename__ = "change_counters"
+
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+def reserve_change_seqs(connection, count: int, name: str = "attempts") -> int:
+    # UPDATE блокирует строку счётчика до конца транзакции, поэтому номера
+    # видны читателям строго в порядке фиксации: всё, что <= прочитанного значения, уже закоммичено.
+    # Возвращает первый из count зарезервированных подряд номеров.
+    result = connection.execute(
+        update(ChangeCounter).where(ChangeCounter.name == name).values(value=ChangeCounter.value + count)
+    )
+    if result.rowcount == 0:
+        connection.execute(ChangeCounter.__table__.insert().values(name=name, value=count))
+    last = connection.execute(select(ChangeCounter.value).where(ChangeCounter.name == name)).scalar_one()
+    return last - count + 1
+
+
+def current_change_seq(connection, name: str = "attempts") -> int:
+    value = connection.execute(select(ChangeCounter.value).where(ChangeCounter.name == name)).scalar()
+    return value or 0
+
+
+@event.listens_for(Session, "before_flush")
+def stamp_change_seqs(session, flush_context, instances):
+    # Один блок номеров на flush, а не UPDATE + SELECT счётчика на каждую строку
+    changed = [obj for obj in session.new if isinstance(obj, Attempt)]
+    changed += [obj for obj in session.dirty if isinstance(obj, Attempt) and session.is_modified(obj)]
+    if not changed:
+        return
+    first_seq = reserve_change_seqs(session.connection(), len(changed))
+    for offset, attempt in enumerate(changed):
+        attempt.change_seq = first_seq + offset
+
+
+class TaskStats(Base):
+    __tablename__ = "task_stats"
+
+    task_id = Column(Integer, primary_key=True)
+    teacher_id = Column(Integer, nullable=False, index=True)  # Автор задачи
+    attempts = Column(Integer, nullable=False, default=0)
+    solved = Column(Integer, nullable=False, default=0)
+    pending = Column(Integer, nullable=False, default=0)
+    grade_sum = Column(BigInteger, nullable=False, default=0)
+    graded_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+
+
+class TaskRef(Base):
+    # Локальная копия связи задача -> тема/автор из task-сервиса для агрегатов без сетевых вызовов
+    __tablename__ = "task_refs"
+
+    task_id = Column(Integer, primary_key=True)
+    theme_id = Column(Integer, nullable=False, index=True)
+    author_id = Column(Integer, nullable=False, index=True)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc))
-    updated_at = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc))
\ No newline at end of file
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+
+
+class LeaderboardSnapshot(Base):
+    # Снимок вклада каждой пары студент/задача в рейтинги; watermark снимка — ChangeCounter "leaderboard"
+    __tablename__ = "leaderboard_snapshots"
+
+    student_id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, primary_key=True)
+    theme_id = Column(Integer, nullable=True)
+    solved = Column(Boolean, nullable=False, default=False)
+    best_grade = Column(Integer, nullable=False, default=0)
+
+
+class RegradeStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    SUPERSEDED = "superseded"
+
+
+class RegradeJob(Base):
+    # Перепроверка попыток задачи после смены эталона; прогресс виден из любого воркера
+    __tablename__ = "regrade_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, nullable=False, index=True)
+    answer_id = Column(Integer, nullable=False)
+    requested_by = Column(Integer, nullable=False)
+    status = Column(Enum(RegradeStatus), nullable=False, default=RegradeStatus.QUEUED)
+    max_attempt_id = Column(Integer, nullable=False, default=0)  # Попытки новее проверены уже по новому эталону
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    changed = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class IdempotencyKey(Base):
+    # Ответ на повтор запроса с тем же Idempotency-Key берётся из ресурса resource_id, см. idempotency.py
+    __tablename__ = "idempotency_keys"
+
+    key_hash = Column(String(64), primary_key=True)  # sha256(операция, id пользователя, ключ)
+    request_hash = Column(String(64), nullable=False)  # Тот же ключ с другим телом запроса — ошибка
+    resource_id = Column(Integer, nullable=False)
+    expires_at = Column(BigInteger, nullable=False, index=True)  # Unix-время, секунды
+
+
+class ReplicaHeartbeat(Base):
+    # Отметка времени, которую основная БД пишет, а реплика догоняет; по ней меряется отставание, см. replica.py
+    __tablename__ = "replica_heartbeat"
+
+    id = Column(Integer, primary_key=True)
+    written_at = Column(BigInteger, nullable=False)  # Unix-время, миллисекунды
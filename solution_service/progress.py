@@ -0,0 +1,124 @@
+from collections import defaultdict
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+import models
+import database
+import events
+import task_refs
+from attempt import get_user_data
+from utils import oauth2_scheme
+
+router = APIRouter()
+
+# Кэш прогресса: student_id -> темы, teacher_id -> класс; сбрасывается событиями попыток
+_student_cache = {}
+_teacher_cache = {}
+
+
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def invalidate(event: dict):
+    _student_cache.pop(event.get("student_id"), None)
+    _teacher_cache.pop(event.get("teacher_id"), None)
+
+
+def invalidate_all():
+    _student_cache.clear()
+    _teacher_cache.clear()
+
+
+def subscribe():
+    events.bus.subscribe(events.ATTEMPTS_TOPIC, invalidate)
+    task_refs.on_refresh(invalidate_all)
+
+
+def theme_totals(db: Session, author_id: int | None = None) -> dict:
+    query = db.query(models.TaskRef.theme_id, func.count(models.TaskRef.task_id)).filter(
+        models.TaskRef.is_active
+    )
+    if author_id is not None:
+        query = query.filter(models.TaskRef.author_id == author_id)
+    return dict(query.group_by(models.TaskRef.theme_id).all())
+
+
+def progress_query(db: Session, attempts, *group_by):
+    # Один GROUP BY по попыткам (attempts — models.scored_attempts(), вместе с архивом),
+    # соединённым с локальной копией задача -> тема
+    return db.query(
+        *group_by,
+        func.count(func.distinct(case((attempts.c.status == models.AttemptStatus.CORRECT, attempts.c.task_id)))),
+        func.count(func.distinct(attempts.c.task_id)),
+        func.count(func.distinct(case((attempts.c.status == models.AttemptStatus.PENDING, attempts.c.task_id)))),
+    ).join(
+        models.TaskRef, models.TaskRef.task_id == attempts.c.task_id
+    ).filter(
+        models.TaskRef.is_active,
+    ).group_by(*group_by)
+
+
+def theme_progress(totals: dict, rows) -> list:
+    by_theme = {theme_id: (solved, attempted, pending) for theme_id, solved, attempted, pending in rows}
+    return [
+        {
+            "theme_id": theme_id,
+            "total": total,
+            "solved": by_theme.get(theme_id, (0, 0, 0))[0],
+            "attempted": by_theme.get(theme_id, (0, 0, 0))[1],
+            "pending": by_theme.get(theme_id, (0, 0, 0))[2],
+        }
+        for theme_id, total in sorted(totals.items())
+    ]
+
+
+def student_progress(db: Session, student_id: int) -> list:
+    if student_id not in _student_cache:
+        attempts = models.scored_attempts()
+        rows = progress_query(db, attempts, models.TaskRef.theme_id).filter(attempts.c.student_id == student_id)
+        _student_cache[student_id] = theme_progress(theme_totals(db), rows)
+    return _student_cache[student_id]
+
+
+def class_progress(db: Session, teacher_id: int) -> list:
+    if teacher_id not in _teacher_cache:
+        attempts = models.scored_attempts()
+        rows = progress_query(db, attempts, attempts.c.student_id, models.TaskRef.theme_id).filter(
+            models.TaskRef.author_id == teacher_id
+        )
+        by_student = defaultdict(list)
+        for student_id, theme_id, solved, attempted, pending in rows:
+            by_student[student_id].append((theme_id, solved, attempted, pending))
+        totals = theme_totals(db, teacher_id)
+        _teacher_cache[teacher_id] = [
+            {"student_id": student_id, "themes": theme_progress(totals, student_rows)}
+            for student_id, student_rows in sorted(by_student.items())
+        ]
+    return _teacher_cache[teacher_id]
+
+
+@router.get("/progress/student")
+async def get_student_progress(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only students can view their progress")
+
+    await task_refs.ensure_fresh(db)
+    return student_progress(db, user_data["id"])
+
+
+@router.get("/progress/teacher")
+async def get_class_progress(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+    user_data = await get_user_data(token)
+    if user_data["role"] != "teacher":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can view class progress")
+
+    await task_refs.ensure_fresh(db)
+    return class_progress(db, user_data["id"])
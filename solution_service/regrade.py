@@ -0,0 +1,211 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import bulk
+import canonical
+import models
+import database
+import events
+from attempt import get_user_data, get_task_data, get_answer_canonical
+from config import REGRADE_CHUNK_SIZE
+from utils import oauth2_scheme
+
+router = APIRouter()
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора и их можно было отменить при остановке
+_running = set()
+
+
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def job_response(job: models.RegradeJob) -> dict:
+    return {
+        "id": job.id,
+        "task_id": job.task_id,
+        "answer_id": job.answer_id,
+        "status": job.status.value,
+        "total": job.total,
+        "processed": job.processed,
+        "changed": job.changed,
+        "progress": job.processed / job.total if job.total else (1.0 if job.status == models.RegradeStatus.DONE else 0.0),
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def start_job(job_id: int) -> dict:
+    db = database.SessionLocal()
+    try:
+        job = db.get(models.RegradeJob, job_id)
+        answer_form = get_answer_canonical(db, job.answer_id)
+        # Попытки новее max_id уже проверены по новому эталону при создании
+        job.max_attempt_id = db.query(func.coalesce(func.max(models.Attempt.id), 0)).filter(
+            models.Attempt.task_id == job.task_id
+        ).scalar()
+        job.total = db.query(func.count(models.Attempt.id)).filter(
+            models.Attempt.task_id == job.task_id,
+            models.Attempt.is_active,
+            models.Attempt.id <= job.max_attempt_id,
+        ).scalar()
+        job.status = models.RegradeStatus.RUNNING
+        db.commit()
+        return answer_form
+    finally:
+        db.close()
+
+
+def finish_job(job_id: int, job_status: models.RegradeStatus, error: str | None = None):
+    db = database.SessionLocal()
+    try:
+        job = db.get(models.RegradeJob, job_id)
+        job.status = job_status
+        job.error = error
+        job.finished_at = datetime.now(timezone.utc)
+        db.commit()
+    finally:
+        db.close()
+
+
+def is_superseded(job_id: int, task_id: int) -> bool:
+    # Эталон сменили ещё раз — эту работу доделает более новая
+    db = database.SessionLocal()
+    try:
+        return db.query(models.RegradeJob.id).filter(
+            models.RegradeJob.task_id == task_id,
+            models.RegradeJob.id > job_id,
+        ).first() is not None
+    finally:
+        db.close()
+
+
+def regrade_chunk(job_id: int, task_id: int, teacher_id: int, answer_form: dict, after_id: int) -> tuple[int | None, list]:
+    db = database.SessionLocal()
+    try:
+        job = db.get(models.RegradeJob, job_id)
+        rows = db.query(
+            models.Attempt.id,
+            models.Attempt.task_id,
+            models.Attempt.student_id,
+            models.Attempt.answer,
+            models.Attempt.status,
+            models.Attempt.system_grade,
+            models.Attempt.teacher_grade,
+        ).filter(
+            models.Attempt.task_id == task_id,
+            models.Attempt.is_active,
+            models.Attempt.id > after_id,
+            models.Attempt.id <= job.max_attempt_id,
+        ).order_by(models.Attempt.id).limit(REGRADE_CHUNK_SIZE).all()
+        if not rows:
+            return None, []
+
+        correct = canonical.matches_batch(answer_form, [row.answer for row in rows])
+        pending = np.array([row.status == models.AttemptStatus.PENDING for row in rows])
+        system_grade = np.array([row.system_grade if row.system_grade is not None else -1 for row in rows])
+        teacher_grade = np.array([row.teacher_grade if row.teacher_grade is not None else -1 for row in rows])
+        graded = np.array([row.status == models.AttemptStatus.GRADED for row in rows])
+        # Меняем только решения системы: ожидающие проверки и автоматически отклонённые.
+        # Оценки учителя сохраняются, у таких попыток обновляется только system_grade.
+        auto_rejected = graded & (system_grade == 0) & (teacher_grade == 0)
+        to_pending = auto_rejected & correct
+        to_rejected = pending & ~correct
+        new_system_grade = np.where(correct, 100, 0)
+        changed = to_pending | to_rejected | (system_grade != new_system_grade)
+
+        updates = []
+        for index in np.flatnonzero(changed):
+            values = {"id": rows[index].id, "system_grade": int(new_system_grade[index])}
+            if to_pending[index]:
+                values.update(status=models.AttemptStatus.PENDING, teacher_grade=None)
+            elif to_rejected[index]:
+                values.update(status=models.AttemptStatus.GRADED, teacher_grade=0)
+            updates.append(values)
+        attempts = bulk.apply_attempt_updates(db, rows, updates, {task_id: teacher_id})
+
+        job.processed += len(rows)
+        job.changed += len(updates)
+        db.commit()
+        return rows[-1].id, attempts
+    finally:
+        db.close()
+
+
+async def run_job(job_id: int, task_id: int, teacher_id: int):
+    try:
+        answer_form = await asyncio.to_thread(start_job, job_id)
+        after_id = 0
+        while True:
+            if await asyncio.to_thread(is_superseded, job_id, task_id):
+                await asyncio.to_thread(finish_job, job_id, models.RegradeStatus.SUPERSEDED)
+                return
+            after_id, attempts = await asyncio.to_thread(regrade_chunk, job_id, task_id, teacher_id, answer_form, after_id)
+            if after_id is None:
+                break
+            for attempt in attempts:
+                await events.publish_attempt(attempt, teacher_id)
+        await asyncio.to_thread(finish_job, job_id, models.RegradeStatus.DONE)
+        logging.info(f"Regrade job {job_id} for task {task_id} finished")
+    except asyncio.CancelledError:
+        await asyncio.to_thread(finish_job, job_id, models.RegradeStatus.FAILED, "Interrupted by shutdown")
+        raise
+    except Exception as e:
+        logging.error(f"Regrade job {job_id} failed: {str(e)}")
+        await asyncio.to_thread(finish_job, job_id, models.RegradeStatus.FAILED, str(e))
+
+
+def spawn(job_id: int, task_id: int, teacher_id: int):
+    job = asyncio.create_task(run_job(job_id, task_id, teacher_id))
+    _running.add(job)
+    job.add_done_callback(_running.discard)
+
+
+async def stop():
+    for job in list(_running):
+        job.cancel()
+    await asyncio.gather(*_running, return_exceptions=True)
+
+
+async def check_task_access(task_id: int, token: str) -> tuple[dict, dict]:
+    user_data = await get_user_data(token)
+    if user_data["role"] not in ("teacher", "admin"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers or admins can regrade attempts")
+    task_data = await get_task_data(task_id)
+    if user_data["role"] == "teacher" and task_data["user_id"] != user_data["id"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Teachers can only regrade attempts for their own tasks")
+    return user_data, task_data
+
+
+@router.post("/regrade/tasks/{task_id}", status_code=status.HTTP_202_ACCEPTED)
+async def regrade_task(task_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+    user_data, task_data = await check_task_access(task_id, token)
+
+    job = models.RegradeJob(task_id=task_id, answer_id=task_data["answer_id"], requested_by=user_data["id"])
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    spawn(job.id, task_id, task_data["user_id"])
+    return job_response(job)
+
+
+@router.get("/regrade/jobs/{job_id}")
+async def get_regrade_job(job_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+    job = db.get(models.RegradeJob, job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Regrade job not found")
+    await check_task_access(job.task_id, token)
+    return job_response(job)
@@ -0,0 +1,16 @@
+from typing import List
+
+from fastapi.responses import ORJSONResponse
+
+from config import FAST_LIST_RESPONSES
+
+
+def list_response(rows: List[dict], fast: bool | None = None):
+    # Строки собираются из типизированных колонок БД, поэтому на быстром пути
+    # повторная валидация через response_model не нужна: отдаём ORJSONResponse,
+    # и FastAPI пропускает serialize_response целиком.
+    if fast is None:
+        fast = FAST_LIST_RESPONSES
+    if fast:
+        return ORJSONResponse(content=rows)
+    return rows
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import List
 
 from pydantic import BaseModel
 from enum import Enum
@@ -17,6 +18,19 @@ class AttemptCreate(BaseModel):
     answer: str
     image_data: ImageData = None
 
+class AttemptBatchItem(BaseModel):
+    task_id: int
+    answer: str
+
+class AttemptBatch(BaseModel):
+    answers: List[AttemptBatchItem]
+
+class AttemptBatchResult(BaseModel):
+    id: int
+    task_id: int
+    status: AttemptStatus
+    system_grade: int
+
 class AttemptResponse(BaseModel):
     id: int
     task_id: int
@@ -36,13 +50,13 @@ class AttemptsResponse(BaseModel):
     id: int
     task_id: int
     task_name: str
-    theme_id: int
+    theme_id: int | None
     theme_name: str
     student_id: int | None
     student_username: str | None
     task_author_id: int | None
     task_author_username: str | None
-    system_answer: str
+    system_answer: str | None
     answer: str
     status: AttemptStatus
     system_grade: int | None
@@ -53,16 +67,63 @@ class AttemptsResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class AttemptsSync(BaseModel):
+    cursor: int
+    has_more: bool
+    attempts: List[AttemptsResponse]
+    deleted: List[int]
+
 class GradeAttempt(BaseModel):
     teacher_grade: int
 
+class BulkGradeItem(BaseModel):
+    attempt_id: int
+    teacher_grade: int
+
+class BulkGrade(BaseModel):
+    grades: List[BulkGradeItem]
+
+class BulkGradeResult(BaseModel):
+    attempt_id: int
+    status: AttemptStatus | None = None
+    teacher_grade: int | None = None
+    error: str | None = None  # not_found или forbidden; такие попытки не меняются
+
+class BulkGradeResponse(BaseModel):
+    results: List[BulkGradeResult]
+
+class AttemptCluster(BaseModel):
+    task_id: int
+    answer_fingerprint: str
+    sample_answer: str
+    count: int
+    first_attempt_id: int
+    last_attempt_id: int
+
+class GradeCluster(BaseModel):
+    task_id: int
+    answer_fingerprint: str
+    teacher_grade: int
+    max_attempt_id: int | None = None  # Не оценивать попытки, пришедшие после просмотра кластера
+
+class GradeClusterResponse(BaseModel):
+    graded: int
+    attempt_ids: List[int]
+
 class AnswerCreate(BaseModel):
     answer: str
+    # При изменении задачи: тот же текст, что у текущего эталона задачи, не создаёт новую запись
+    task_id: int | None = None
+    current_answer_id: int | None = None
+
+class AnswerBulkCreate(BaseModel):
+    answers: List[str]
 
 class AnswerResponse(BaseModel):
     id: int
     text: str
     user_id: int
+    canonical: dict | None = None
 
     class Config:
         from_attributes = True
\ No newline at end of file
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import sys
+
+import httpx
+from sqlalchemy import case, func, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+import database
+from config import TASK_SERVICE_HOST, TASK_SERVICE_PORT, TASK_SERVICE_TASK_PREFIX_API
+
+COUNTERS = ("attempts", "solved", "pending", "grade_sum", "graded_count")
+
+
+# Вклад одной попытки в счётчики задачи; None — попытки нет (ещё не создана или удалена)
+def contribution(status: models.AttemptStatus | None, teacher_grade: int | None) -> dict:
+    if status is None:
+        return dict.fromkeys(COUNTERS, 0)
+    return {
+        "attempts": 1,
+        "solved": int(status == models.AttemptStatus.CORRECT),
+        "pending": int(status == models.AttemptStatus.PENDING),
+        "grade_sum": teacher_grade or 0,
+        "graded_count": int(teacher_grade is not None),
+    }
+
+
+def apply_delta(db: Session, task_id: int, teacher_id: int, delta: dict):
+    # Вызывается до commit вызывающего кода, поэтому счётчики меняются в той же транзакции, что и попытка
+    delta = {name: value for name, value in delta.items() if value}
+    if not delta:
+        return
+    values = {name: getattr(models.TaskStats, name) + value for name, value in delta.items()}
+    result = db.execute(update(models.TaskStats).where(models.TaskStats.task_id == task_id).values(**values))
+    if result.rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.add(models.TaskStats(task_id=task_id, teacher_id=teacher_id, **{**dict.fromkeys(COUNTERS, 0), **delta}))
+    except IntegrityError:
+        # Строку успела вставить параллельная транзакция
+        db.execute(update(models.TaskStats).where(models.TaskStats.task_id == task_id).values(**values))
+
+
+def record_change(db: Session, task_id: int, teacher_id: int, old: tuple | None, new: tuple | None):
+    # old/new — (status, teacher_grade) до и после изменения попытки
+    before = contribution(*(old or (None, None)))
+    after = contribution(*(new or (None, None)))
+    apply_delta(db, task_id, teacher_id, {name: after[name] - before[name] for name in COUNTERS})
+
+
+def teacher_totals(db: Session, teacher_id: int) -> dict:
+    row = db.query(
+        func.coalesce(func.sum(models.TaskStats.attempts), 0),
+        func.coalesce(func.sum(models.TaskStats.solved), 0),
+        func.coalesce(func.sum(models.TaskStats.pending), 0),
+        func.coalesce(func.sum(models.TaskStats.grade_sum), 0),
+        func.coalesce(func.sum(models.TaskStats.graded_count), 0),
+    ).filter(models.TaskStats.teacher_id == teacher_id).one()
+    attempts, solved, pending, grade_sum, graded_count = (int(value) for value in row)
+    return {
+        "attempts": attempts,
+        "solved": solved,
+        "pending": pending,
+        "average_teacher_grade": grade_sum / graded_count if graded_count else None,
+    }
+
+
+async def fetch_task_authors() -> dict:
+    async with httpx.AsyncClient() as client:
+        response = await client.get(f"http://{TASK_SERVICE_HOST}:{TASK_SERVICE_PORT}/{TASK_SERVICE_TASK_PREFIX_API}/")
+        response.raise_for_status()
+        return {task["id"]: task["user_id"] for task in response.json()}
+
+
+def lock_task_stats(db: Session):
+    # Первым запросом транзакции пересчёта: начатые apply_delta успевают зафиксироваться и попадают
+    # в агрегат, новые ждут commit пересчёта и применяются уже к пересчитанным строкам
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        db.execute(text("LOCK TABLE task_stats IN EXCLUSIVE MODE"))
+    elif dialect == "mysql":
+        # InnoDB: блокирующее чтение всей таблицы запрещает и вставку новых строк;
+        # снимок для агрегата создаётся уже после блокировки
+        db.query(models.TaskStats.task_id).with_for_update().all()
+    else:
+        # SQLite: пустой UPDATE берёт блокировку записи на всю базу
+        db.execute(text("UPDATE task_stats SET attempts = attempts WHERE 1 = 0"))
+
+
+def rebuild_task_stats(db: Session, task_authors: dict) -> int:
+    # Полный пересчёт из attempts и архива в одной транзакции под блокировкой task_stats;
+    # автор задачи берётся из task-сервиса, для задач, которых там уже нет, — из прежней строки статистики
+    lock_task_stats(db)
+    known_authors = dict(db.query(models.TaskStats.task_id, models.TaskStats.teacher_id).all())
+    known_authors.update(task_authors)
+
+    attempts = models.scored_attempts()
+    rows = db.query(
+        attempts.c.task_id,
+        func.count(attempts.c.id),
+        func.sum(case((attempts.c.status == models.AttemptStatus.CORRECT, 1), else_=0)),
+        func.sum(case((attempts.c.status == models.AttemptStatus.PENDING, 1), else_=0)),
+        func.coalesce(func.sum(attempts.c.teacher_grade), 0),
+        func.count(attempts.c.teacher_grade),
+    ).group_by(attempts.c.task_id).all()
+
+    db.query(models.TaskStats).delete()
+    rebuilt = 0
+    for task_id, attempts, solved, pending, grade_sum, graded_count in rows:
+        if task_id not in known_authors:
+            logging.warning(f"Skipping stats for task {task_id}: author unknown")
+            continue
+        db.add(models.TaskStats(
+            task_id=task_id,
+            teacher_id=known_authors[task_id],
+            attempts=attempts,
+            solved=solved or 0,
+            pending=pending or 0,
+            grade_sum=grade_sum,
+            graded_count=graded_count,
+        ))
+        rebuilt += 1
+    db.commit()
+    return rebuilt
+
+
+async def rebuild():
+    task_authors = await fetch_task_authors()
+    db = database.SessionLocal()
+    try:
+        rebuilt = rebuild_task_stats(db, task_authors)
+        logging.info(f"Task stats rebuilt for {rebuilt} tasks")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # python stats.py rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python stats.py rebuild")
+        sys.exit(1)
+    database.Base.metadata.create_all(bind=database.engine)
+    asyncio.run(rebuild())
@@ -0,0 +1,77 @@
+import logging
+import time
+
+import httpx
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+from config import TASK_SERVICE_HOST, TASK_SERVICE_PORT, TASK_SERVICE_TASK_PREFIX_API, TASK_REFS_TTL
+
+_refreshed_at = 0.0
+_listeners = []
+
+
+def on_refresh(callback):
+    # Вызывается после того, как каталог задач реально изменился (например, сброс кэшей прогресса)
+    _listeners.append(callback)
+
+
+def remember_task(db: Session, task_data: dict):
+    # Задача только что получена из task-сервиса — обновляем запись без отдельного запроса
+    values = {"theme_id": task_data["theme_id"], "author_id": task_data["user_id"], "is_active": True}
+    result = db.execute(update(models.TaskRef).where(models.TaskRef.task_id == task_data["id"]).values(**values))
+    if result.rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.add(models.TaskRef(task_id=task_data["id"], **values))
+    except IntegrityError:
+        # Строку успела вставить параллельная транзакция (первые ответы на задачу одновременно)
+        db.execute(update(models.TaskRef).where(models.TaskRef.task_id == task_data["id"]).values(**values))
+
+
+async def fetch_active_tasks() -> list:
+    async with httpx.AsyncClient() as client:
+        # Нужны только id, тема и автор — условия задач не передаём
+        response = await client.get(f"http://{TASK_SERVICE_HOST}:{TASK_SERVICE_PORT}/{TASK_SERVICE_TASK_PREFIX_API}/",
+                                    params={"view": "summary"})
+        response.raise_for_status()
+        return response.json()
+
+
+def sync_task_refs(db: Session, tasks: list) -> bool:
+    refs = {ref.task_id: ref for ref in db.query(models.TaskRef).all()}
+    changed = False
+    for task in tasks:
+        ref = refs.pop(task["id"], None)
+        if ref is None:
+            db.add(models.TaskRef(task_id=task["id"], theme_id=task["theme_id"], author_id=task["user_id"]))
+            changed = True
+        elif (ref.theme_id, ref.author_id, ref.is_active) != (task["theme_id"], task["user_id"], True):
+            ref.theme_id, ref.author_id, ref.is_active = task["theme_id"], task["user_id"], True
+            changed = True
+    # Задач, которых task-сервис больше не отдаёт, нет среди активных
+    for ref in refs.values():
+        if ref.is_active:
+            ref.is_active = False
+            changed = True
+    db.commit()
+    return changed
+
+
+async def ensure_fresh(db: Session, force: bool = False):
+    global _refreshed_at
+    if not force and time.monotonic() - _refreshed_at < TASK_REFS_TTL:
+        return
+    try:
+        tasks = await fetch_active_tasks()
+    except httpx.HTTPError as e:
+        # Работаем на прежней копии, повторим при следующем запросе
+        logging.error(f"Failed to refresh task refs: {str(e)}")
+        return
+    _refreshed_at = time.monotonic()
+    if sync_task_refs(db, tasks):
+        for callback in _listeners:
+            callback()
@@ -0,0 +1,143 @@
+import hashlib
+import secrets
+from typing import cast
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+import httpx
+
+import catalog
+import models
+import database
+import utils
+import schemas
+from config import AUTH_SERVICE_HOST, AUTH_SERVICE_PORT, AUTH_SERVICE_POSSIBILITY_PREFIX_URL, TEST_MAX_TASKS_PER_THEME
+
+router = APIRouter()
+
+
+def get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_user_data(token: str) -> dict:
+    async with httpx.AsyncClient() as client:
+        response = await client.get(
+            f"http://{AUTH_SERVICE_HOST}:{AUTH_SERVICE_PORT}/{AUTH_SERVICE_POSSIBILITY_PREFIX_URL}/user",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        if response.status_code != status.HTTP_200_OK:
+            raise HTTPException(status_code=response.status_code,
+                                detail=response.json().get("detail", "Failed to fetch user data"))
+        return response.json()
+
+
+def load_pools(db: Session) -> dict:
+    # theme_id -> id активных задач типа test; один проход по таблице на обновление каталога
+    pools = {}
+    rows = db.query(models.Task.theme_id, models.Task.id).filter(
+        cast("ColumnElement[bool]", models.Task.is_active),
+        cast("ColumnElement[bool]", models.Task.type == models.ProblemType.test),
+    ).order_by(models.Task.theme_id, models.Task.id)
+    for theme_id, task_id in rows:
+        pools.setdefault(theme_id, []).append(task_id)
+    return {theme_id: tuple(task_ids) for theme_id, task_ids in pools.items()}
+
+
+def get_pools(db: Session) -> dict:
+    # Хранятся в кэше каталога: любая запись задач или тем пересобирает пулы
+    return catalog.cache.get("test_pools", lambda: load_pools(db))
+
+
+def sample_tasks(pool: tuple, count: int, seed: str) -> list:
+    # Каждой задаче — псевдослучайный ранг от seed студента, берём count наименьших.
+    # Выбор детерминирован и без повторов; добавление или удаление задачи в пуле
+    # меняет набор студента, только если эта задача в него попадает.
+    ranked = sorted(pool, key=lambda task_id: hashlib.blake2b(f"{seed}:{task_id}".encode(), digest_size=8).digest())
+    return ranked[:count]
+
+
+def test_response(db_test: models.Test) -> dict:
+    return {"id": db_test.id, "title": db_test.title, "themes": db_test.themes, "user_id": db_test.user_id}
+
+
+def get_test_or_404(db: Session, test_id: int) -> models.Test:
+    db_test = db.query(models.Test).filter(cast("ColumnElement[bool]", models.Test.id == test_id),
+                                           cast("ColumnElement[bool]", models.Test.is_active)).first()
+    if not db_test:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Test not found")
+    return db_test
+
+
+@router.post("/tests/create", response_model=schemas.TestResponse)
+async def create_test(test: schemas.TestCreate, db: Session = Depends(get_db),
+                      token: str = Depends(utils.oauth2_scheme)):
+    user_data = await get_user_data(token)
+    if user_data["role"] == "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+
+    theme_ids = [item.theme_id for item in test.themes]
+    if len(set(theme_ids)) != len(theme_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Each theme can appear only once")
+    if any(item.count > TEST_MAX_TASKS_PER_THEME for item in test.themes):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {TEST_MAX_TASKS_PER_THEME} tasks per theme")
+    found = {row.id for row in db.query(models.Theme.id).filter(
+        cast("ColumnElement[bool]", models.Theme.id.in_(theme_ids)),
+        cast("ColumnElement[bool]", models.Theme.is_active),
+    )}
+    missing = [theme_id for theme_id in theme_ids if theme_id not in found]
+    if missing:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Themes not found: {missing}")
+
+    db_test = models.Test(
+        title=test.title,
+        themes=[item.model_dump() for item in test.themes],
+        seed_salt=secrets.token_hex(16),
+        user_id=user_data["id"],
+    )
+    db.add(db_test)
+    db.commit()
+    db.refresh(db_test)
+    return test_response(db_test)
+
+
+@router.get("/tests/{test_id}", response_model=schemas.TestResponse)
+def get_test(test_id: int, db: Session = Depends(get_db)):
+    return test_response(get_test_or_404(db, test_id))
+
+
+@router.get("/tests/{test_id}/package", response_model=schemas.TestPackage)
+async def get_test_package(test_id: int, student_id: int = None, db: Session = Depends(get_db),
+                           token: str = Depends(utils.oauth2_scheme)):
+    # Весь вариант студента одним ответом: выбор по пулам в памяти и один запрос задач по id.
+    # Повторный запрос возвращает тот же вариант; автор контрольной (или администратор)
+    # может посмотреть вариант студента через student_id
+    user_data = await get_user_data(token)
+    db_test = get_test_or_404(db, test_id)
+    if user_data["role"] == "student":
+        student_id = user_data["id"]
+    elif user_data["role"] == "teacher" and db_test.user_id != user_data["id"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Teachers can only view packages of their own tests")
+    elif student_id is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="student_id is required")
+
+    pools = get_pools(db)
+    seed = f"{db_test.id}:{db_test.seed_salt}:{student_id}"
+    task_ids = []
+    for item in db_test.themes:
+        task_ids.extend(sample_tasks(pools.get(item["theme_id"], ()), item["count"], f"{seed}:{item['theme_id']}"))
+
+    rows = {row.id: row for row in db.query(
+        models.Task.id, models.Task.title, models.Task.condition, models.Task.theme_id, models.Task.type
+    ).filter(cast("ColumnElement[bool]", models.Task.id.in_(task_ids)))}
+    return {
+        "test_id": db_test.id,
+        "title": db_test.title,
+        "student_id": student_id,
+        "tasks": [rows[task_id]._asdict() for task_id in task_ids if task_id in rows],
+    }
@@ -0,0 +1,34 @@
+import threading
+import time
+
+from config import CATALOG_CACHE_TTL
+
+
+class CatalogCache:
+    # Темы и счётчики задач читаются на каждой странице каталога, а меняются редко.
+    # Запись в этом воркере сбрасывает кэш сразу, записи других воркеров видны через CATALOG_CACHE_TTL
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._items = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, loader):
+        item = self._items.get(key)
+        if item is not None and item[0] > time.monotonic():
+            return item[1]
+        version = self._version
+        value = loader()
+        with self._lock:
+            # Значение, прочитанное до сброса, могло устареть — не кладём его
+            if version == self._version:
+                self._items[key] = (time.monotonic() + self._ttl, value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._items.clear()
+
+
+cache = CatalogCache(CATALOG_CACHE_TTL)
@@ -10,6 +10,15 @@ THEME_PREFIX_API = os.getenv("THEME_PREFIX_API")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Реплика только для чтения (необязательна). Чтения идут в неё, пока отставание, измеряемое
+# по строке replica_heartbeat раз в DATABASE_REPLICA_CHECK_INTERVAL секунд, не больше
+# DATABASE_REPLICA_MAX_LAG; после записи клиент DATABASE_REPLICA_STICKY_SECONDS читает из основной БД.
+# Локально реплику можно изображать копией файла SQLite: sqlite3 main.db ".backup replica.db"
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or None
+DATABASE_REPLICA_MAX_LAG = float(os.getenv("DATABASE_REPLICA_MAX_LAG", "5"))
+DATABASE_REPLICA_STICKY_SECONDS = float(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "10"))
+DATABASE_REPLICA_CHECK_INTERVAL = float(os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", "1"))
+
 AUTH_SERVICE_HOST = os.getenv("AUTH_SERVICE_HOST")
 AUTH_SERVICE_PORT = os.getenv("AUTH_SERVICE_PORT")
 AUTH_SERVICE_AUTH_PREFIX_API = os.getenv("AUTH_SERVICE_AUTH_PREFIX_API")
@@ -17,4 +26,35 @@ AUTH_SERVICE_POSSIBILITY_PREFIX_URL = os.getenv("AUTH_SERVICE_POSSIBILITY_PREFIX
 
 SOLUTION_SERVICE_HOST=os.getenv("SOLUTION_SERVICE_HOST")
 SOLUTION_SERVICE_PORT=os.getenv("SOLUTION_SERVICE_PORT")
-SOLUTION_SERVICE_SOLUTION_PREFIX_API=os.getenv("SOLUTION_SERVICE_SOLUTION_PREFIX_API")
\ No newline at end of file
+SOLUTION_SERVICE_SOLUTION_PREFIX_API=os.getenv("SOLUTION_SERVICE_SOLUTION_PREFIX_API")
+
+# Быстрая сериализация списков (orjson без повторной валидации response_model)
+FAST_LIST_RESPONSES = os.getenv("FAST_LIST_RESPONSES", "false").lower() == "true"
+
+# Максимум id в одном запросе пакетного получения задач (GET /batch)
+TASK_BATCH_MAX_IDS = int(os.getenv("TASK_BATCH_MAX_IDS", "500"))
+
+# Импорт и экспорт наборов задач: максимум задач в одном импорте и размер порции экспорта
+TASK_IMPORT_MAX_ITEMS = int(os.getenv("TASK_IMPORT_MAX_ITEMS", "500"))
+TASK_EXPORT_CHUNK_SIZE = int(os.getenv("TASK_EXPORT_CHUNK_SIZE", "500"))
+
+# Полнотекстовый поиск задач: конфигурация текстового поиска PostgreSQL и максимальный размер страницы
+TASK_SEARCH_LANGUAGE = os.getenv("TASK_SEARCH_LANGUAGE", "russian")
+TASK_SEARCH_MAX_LIMIT = int(os.getenv("TASK_SEARCH_MAX_LIMIT", "50"))
+
+# Каталог: максимальный размер страницы списка задач и время жизни кэша тем и счётчиков (секунды)
+TASK_PAGE_MAX_LIMIT = int(os.getenv("TASK_PAGE_MAX_LIMIT", "200"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "60"))
+
+# Контрольные: максимум задач из одной темы
+TEST_MAX_TASKS_PER_THEME = int(os.getenv("TEST_MAX_TASKS_PER_THEME", "50"))
+
+# Ограничение нагрузки по группам маршрутов (см. admission.py и main.py): ADMISSION_<ГРУППА>_LIMIT запросов
+# выполняются одновременно, до ADMISSION_<ГРУППА>_QUEUE ждут не дольше ADMISSION_QUEUE_TIMEOUT секунд,
+# остальные получают 503 с Retry-After: ADMISSION_RETRY_AFTER секунд
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_SUBMISSIONS_LIMIT = int(os.getenv("ADMISSION_SUBMISSIONS_LIMIT", "16"))
+ADMISSION_SUBMISSIONS_QUEUE = int(os.getenv("ADMISSION_SUBMISSIONS_QUEUE", "64"))
+ADMISSION_LISTINGS_LIMIT = int(os.getenv("ADMISSION_LISTINGS_LIMIT", "64"))
+ADMISSION_LISTINGS_QUEUE = int(os.getenv("ADMISSION_LISTINGS_QUEUE", "256"))
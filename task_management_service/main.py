@@ -1,19 +1,39 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 import logging
+import re
 import uvicorn
 
+import admission
+import assessment
+import replica
+import search
 import task
 import theme
 from database import engine, Base
-from config import HOST, PORT, TASK_PREFIX_API, THEME_PREFIX_API
+from config import HOST, PORT, TASK_PREFIX_API, THEME_PREFIX_API, \
+    ADMISSION_SUBMISSIONS_LIMIT, ADMISSION_SUBMISSIONS_QUEUE, ADMISSION_LISTINGS_LIMIT, ADMISSION_LISTINGS_QUEUE
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Startup
+    replica.start()
+
+    yield
+
+    # Shutdown
+    await replica.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 
 Base.metadata.create_all(bind=engine)
+search.setup(engine)
 
 origins = [
     "http://localhost:3000",
@@ -25,16 +45,29 @@ origins = [
     "http://127.0.0.1:8003",
 ]
 
+# Группы маршрутов с отдельными лимитами; добавляется раньше CORS, чтобы ответ 503 получал CORS-заголовки
+prefixes = f"({re.escape(TASK_PREFIX_API)}|{re.escape(THEME_PREFIX_API)})"
+app.add_middleware(admission.AdmissionMiddleware, groups=[
+    admission.RouteGroup("submissions", ("POST", "PUT", "DELETE"), rf"{prefixes}/",
+                         ADMISSION_SUBMISSIONS_LIMIT, ADMISSION_SUBMISSIONS_QUEUE),
+    admission.RouteGroup("listings", ("GET",), rf"{prefixes}/",
+                         ADMISSION_LISTINGS_LIMIT, ADMISSION_LISTINGS_QUEUE),
+])
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,  # Список разрешенных источников
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],  # или перечислите нужные заголовки
+    allow_headers=["Content-Type", "Authorization", "Idempotency-Key"],  # или перечислите нужные заголовки
 )
 
+app.middleware("http")(replica.track_writes)
+
 app.include_router(router=task.router, prefix=TASK_PREFIX_API)
+app.include_router(router=assessment.router, prefix=TASK_PREFIX_API)
 app.include_router(router=theme.router, prefix=THEME_PREFIX_API)
+app.include_router(router=admission.router)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -1,7 +1,7 @@
 import datetime
 import enum
 
-from sqlalchemy import Column, Integer, String, Enum, Boolean, DateTime, Text
+from sqlalchemy import Column, Integer, String, Enum, Boolean, DateTime, Text, Index, JSON, BigInteger
 
 from database import Base
 
@@ -12,13 +12,16 @@ class Role(enum.Enum):
     admin = "admin"
 
 
-class ProblemType(enum.Enum):
+class ProblemType(str, enum.Enum):
     problem = "problem"
     test = "test"
 
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index("ix_tasks_theme_id_id", "theme_id", "id"),  # Страницы задач темы по id
+    )
 
     id = Column(Integer(), primary_key=True, index=True)
 
@@ -46,3 +49,28 @@ class Theme(Base):
     is_active = Column(Boolean(), default=True)
     created_at = Column(DateTime(), default=datetime.datetime.now(datetime.timezone.utc))
     updated_at = Column(DateTime(), default=datetime.datetime.now(datetime.timezone.utc))
+
+
+class Test(Base):
+    # Контрольная из задач типа test: сколько задач брать из каждой темы.
+    # Набор задач студента определяется id контрольной, seed_salt и id студента, см. assessment.py
+    __tablename__ = "tests"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    title = Column(String(100), nullable=False)
+    themes = Column(JSON, nullable=False)  # [{"theme_id": ..., "count": ...}]
+    seed_salt = Column(String(32), nullable=False)
+
+    is_active = Column(Boolean(), default=True)
+    created_at = Column(DateTime(), default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+    user_id = Column(Integer(), nullable=False)  # author, i.e. teacher
+
+
+class ReplicaHeartbeat(Base):
+    # Отметка времени, которую основная БД пишет, а реплика догоняет; по ней меряется отставание, см. replica.py
+    __tablename__ = "replica_heartbeat"
+
+    id = Column(Integer(), primary_key=True)
+    written_at = Column(BigInteger(), nullable=False)  # Unix-время, миллисекунды
@@ -1,10 +1,27 @@
-from pydantic import BaseModel
+from enum import Enum
+from typing import List
+
+from pydantic import BaseModel, Field
+
+class ProblemType(str, Enum):
+    problem = "problem"
+    test = "test"
 
 class TaskCreate(BaseModel):
     title: str
     condition: str | None = None
     answer: str
     theme_id: int
+    type: ProblemType = ProblemType.problem
+
+class TaskSummary(BaseModel):
+    # Строка списка задач без условия (GET /?view=summary)
+    id: int
+    title: str
+    answer_id: int
+    theme_id: int
+    user_id: int
+    type: ProblemType = ProblemType.problem
 
 class TaskCreateResponse(BaseModel):
     id: int
@@ -13,10 +30,26 @@ class TaskCreateResponse(BaseModel):
     answer_id: int
     theme_id: int
     user_id: int
+    type: ProblemType = ProblemType.problem
 
     class Config:
         from_attributes = True
 
+class TaskSearchResult(BaseModel):
+    id: int
+    title: str
+    theme_id: int
+    user_id: int
+    type: ProblemType = ProblemType.problem
+    snippet: str | None = None
+    rank: float
+
+class TaskImportItem(BaseModel):
+    title: str
+    condition: str | None = None
+    answer: str
+    type: ProblemType = ProblemType.problem
+
 class ThemeCreate(BaseModel):
     title: str
     description: str | None = None
@@ -27,4 +60,37 @@ class ThemeResponse(BaseModel):
     description: str | None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class ThemeWithCount(ThemeResponse):
+    task_count: int
+
+class TestTheme(BaseModel):
+    theme_id: int
+    count: int = Field(ge=1)
+
+class TestCreate(BaseModel):
+    title: str
+    themes: List[TestTheme] = Field(min_length=1)
+
+class TestResponse(BaseModel):
+    id: int
+    title: str
+    themes: List[TestTheme]
+    user_id: int
+
+    class Config:
+        from_attributes = True
+
+class TestPackageTask(BaseModel):
+    id: int
+    title: str
+    condition: str | None
+    theme_id: int
+    type: ProblemType = ProblemType.test
+
+class TestPackage(BaseModel):
+    test_id: int
+    title: str
+    student_id: int
+    tasks: List[TestPackageTask]
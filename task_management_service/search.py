@@ -0,0 +1,135 @@
+import logging
+import re
+
+from sqlalchemy import case, desc, func, or_, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+from config import TASK_SEARCH_LANGUAGE
+
+# Слова запроса; операторы и кавычки пользователя в синтаксис индекса не попадают
+TOKEN_RE = re.compile(r"\w+")
+MAX_TERMS = 16
+SNIPPET_WIDTH = 160
+
+SQLITE_SETUP = (
+    # Внешнее содержимое: текст хранится только в tasks, индекс обновляют триггеры
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+    "title, condition, content='tasks', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+    "INSERT INTO tasks_fts(rowid, title, condition) VALUES (new.id, new.title, new.condition); END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, title, condition) VALUES ('delete', old.id, old.title, old.condition); END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF title, condition ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, title, condition) VALUES ('delete', old.id, old.title, old.condition); "
+    "INSERT INTO tasks_fts(rowid, title, condition) VALUES (new.id, new.title, new.condition); END",
+)
+
+
+def setup(engine: Engine):
+    # Индекс создаётся при старте рядом с create_all и дальше обновляется самой БД
+    # (триггеры, генерируемая колонка, FULLTEXT), поэтому create/update/delete задач не меняются.
+    # Удалённые задачи остаются в индексе и отсекаются по is_active при поиске.
+    dialect = engine.dialect.name
+    with engine.begin() as conn:
+        if dialect == "sqlite":
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'")).first()
+            for statement in SQLITE_SETUP:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')"))
+        elif dialect == "postgresql":
+            if not re.fullmatch(r"\w+", TASK_SEARCH_LANGUAGE):
+                raise ValueError(f"Invalid TASK_SEARCH_LANGUAGE: {TASK_SEARCH_LANGUAGE}")
+            conn.execute(text(
+                "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+                f"setweight(to_tsvector('{TASK_SEARCH_LANGUAGE}', coalesce(title, '')), 'A') || "
+                f"setweight(to_tsvector('{TASK_SEARCH_LANGUAGE}', coalesce(\"condition\", '')), 'B')) STORED"
+            ))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_search_vector ON tasks USING GIN (search_vector)"))
+        elif dialect == "mysql":
+            exists = conn.execute(text(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = 'tasks' AND index_name = 'ix_tasks_fulltext'"
+            )).first()
+            if not exists:
+                conn.execute(text("CREATE FULLTEXT INDEX ix_tasks_fulltext ON tasks (title, `condition`)"))
+        else:
+            logging.warning(f"Full-text index is not supported for {dialect}, task search falls back to LIKE")
+
+
+def make_snippet(condition: str | None, tokens: list) -> str | None:
+    # Фрагмент условия вокруг первого найденного слова вместо всего текста
+    if not condition:
+        return None
+    lowered = condition.lower()
+    positions = [position for position in (lowered.find(token) for token in tokens) if position >= 0]
+    start = max(0, min(positions) - SNIPPET_WIDTH // 4) if positions else 0
+    snippet = condition[start:start + SNIPPET_WIDTH]
+    return ("…" if start else "") + snippet + ("…" if start + SNIPPET_WIDTH < len(condition) else "")
+
+
+def search_tasks(db: Session, query: str, theme_id: int | None, offset: int, limit: int) -> list:
+    tokens = TOKEN_RE.findall(query.lower())[:MAX_TERMS]
+    if not tokens:
+        return []
+    dialect = db.get_bind().dialect.name
+    params = {"theme_id": theme_id, "offset": offset, "limit": limit}
+    theme_filter = "AND t.theme_id = :theme_id" if theme_id else ""
+
+    if dialect == "sqlite":
+        # Все слова обязательны, каждое — как префикс; bm25 меньше — лучше, совпадение в заголовке весит больше
+        params["match"] = " ".join(f'"{token}"*' for token in tokens)
+        rows = db.execute(text(
+            "SELECT t.id, t.title, t.theme_id, t.user_id, t.type, t.condition, -bm25(tasks_fts, 5.0, 1.0) AS rank "
+            "FROM tasks_fts JOIN tasks t ON t.id = tasks_fts.rowid "
+            f"WHERE tasks_fts MATCH :match AND t.is_active {theme_filter} "
+            "ORDER BY rank DESC, t.id LIMIT :limit OFFSET :offset"
+        ), params)
+    elif dialect == "postgresql":
+        params.update(language=TASK_SEARCH_LANGUAGE, query=" & ".join(f"{token}:*" for token in tokens))
+        rows = db.execute(text(
+            "SELECT t.id, t.title, t.theme_id, t.user_id, t.type, t.\"condition\", ts_rank_cd(t.search_vector, q) AS rank "
+            "FROM tasks t, to_tsquery(CAST(:language AS regconfig), :query) q "
+            f"WHERE t.search_vector @@ q AND t.is_active {theme_filter} "
+            "ORDER BY rank DESC, t.id LIMIT :limit OFFSET :offset"
+        ), params)
+    elif dialect == "mysql":
+        params["query"] = " ".join(f"+{token}*" for token in tokens)
+        rows = db.execute(text(
+            "SELECT t.id, t.title, t.theme_id, t.user_id, t.type, t.`condition`, "
+            "MATCH(t.title, t.`condition`) AGAINST (:query IN BOOLEAN MODE) AS `rank` "
+            "FROM tasks t "
+            f"WHERE MATCH(t.title, t.`condition`) AGAINST (:query IN BOOLEAN MODE) AND t.is_active {theme_filter} "
+            "ORDER BY `rank` DESC, t.id LIMIT :limit OFFSET :offset"
+        ), params)
+    else:
+        # Без индекса: все слова должны встретиться, совпадение в заголовке весит больше
+        rank = 0
+        conditions = []
+        for token in tokens:
+            pattern = "%" + token.replace("_", "\\_") + "%"
+            in_title = func.lower(models.Task.title).like(pattern, escape="\\")
+            conditions.append(or_(in_title, func.lower(models.Task.condition).like(pattern, escape="\\")))
+            rank = rank + case((in_title, 2), else_=1)
+        rows = db.query(
+            models.Task.id, models.Task.title, models.Task.theme_id, models.Task.user_id, models.Task.type,
+            models.Task.condition, rank.label("rank"),
+        ).filter(models.Task.is_active, *conditions)
+        if theme_id:
+            rows = rows.filter(models.Task.theme_id == theme_id)
+        rows = rows.order_by(desc("rank"), models.Task.id).offset(offset).limit(limit)
+
+    return [
+        {
+            "id": row.id,
+            "title": row.title,
+            "theme_id": row.theme_id,
+            "user_id": row.user_id,
+            "type": models.ProblemType[row.type] if isinstance(row.type, str) else row.type,
+            "snippet": make_snippet(row.condition, tokens),
+            "rank": float(row.rank),
+        }
+        for row in rows
+    ]
@@ -1,19 +1,43 @@
+import csv
+import io
 from datetime import datetime, timezone
-from typing import List, cast
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Literal, cast
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 import httpx
+import logging
+import orjson
 
+import catalog
 import models
 import database
+import search
 import utils
 import schemas
+from responses import list_response
+from replica import get_read_db, session_factory
 from config import AUTH_SERVICE_HOST, AUTH_SERVICE_PORT, AUTH_SERVICE_POSSIBILITY_PREFIX_URL, \
     SOLUTION_SERVICE_HOST, SOLUTION_SERVICE_PORT, \
-    SOLUTION_SERVICE_SOLUTION_PREFIX_API
+    SOLUTION_SERVICE_SOLUTION_PREFIX_API, TASK_BATCH_MAX_IDS, TASK_IMPORT_MAX_ITEMS, TASK_EXPORT_CHUNK_SIZE, \
+    TASK_SEARCH_MAX_LIMIT, TASK_PAGE_MAX_LIMIT
 
 router = APIRouter()
 
+# Колонки TaskCreateResponse: списки выбираются проекцией, без загрузки ORM-объектов
+TASK_COLUMNS = (
+    models.Task.id,
+    models.Task.title,
+    models.Task.condition,
+    models.Task.answer_id,
+    models.Task.theme_id,
+    models.Task.user_id,
+    models.Task.type,
+)
+# Облегчённая проекция для страниц каталога: без текста условия
+TASK_SUMMARY_COLUMNS = tuple(column for column in TASK_COLUMNS if column.key != "condition")
+
 
 def get_db():
     db = database.SessionLocal()
@@ -37,15 +61,25 @@ async def get_user_data(token: str) -> dict:
 
 @router.post("/create", response_model=schemas.TaskCreateResponse)
 async def create_task(task: schemas.TaskCreate, db: Session = Depends(get_db),
-                      token: str = Depends(utils.oauth2_scheme)):
+                      token: str = Depends(utils.oauth2_scheme),
+                      idempotency_key: str | None = Header(None, alias="Idempotency-Key")):
     user_data = await get_user_data(token)
     if user_data["role"] == "student":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
 
+    # Сначала локальные проверки: эталон в solution-сервисе создаётся, только если задачу можно сохранить
+    db_theme = db.query(models.Theme).filter(models.Theme.id == task.theme_id, models.Theme.is_active).first()
+    if not db_theme:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Theme not found")
+
+    headers = {"Authorization": f"Bearer {token}"}
+    if idempotency_key:
+        # Повтор запроса получит тот же эталон вместо нового
+        headers["Idempotency-Key"] = idempotency_key
     async with httpx.AsyncClient() as client:
         response = await client.post(
             f"http://{SOLUTION_SERVICE_HOST}:{SOLUTION_SERVICE_PORT}/{SOLUTION_SERVICE_SOLUTION_PREFIX_API}/create",
-            headers={"Authorization": f"Bearer {token}"},
+            headers=headers,
             json={"token": token, "answer": task.answer}
         )
         if response.status_code != status.HTTP_200_OK:
@@ -53,45 +87,101 @@ async def create_task(task: schemas.TaskCreate, db: Session = Depends(get_db),
                                 detail=response.json().get("detail", "Failed to create answer"))
         answer_data = response.json()
 
-    db_theme = db.query(models.Theme).filter(cast("ColumnElement[bool]", models.Theme.id == task.theme_id and models.Theme.is_active)).first()
-    if not db_theme:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Theme not found")
-
     db_task = models.Task(
         title=task.title,
         condition=task.condition,
         theme_id=task.theme_id,
         user_id=user_data["id"],
         answer_id=answer_data["id"],
-        type=models.ProblemType.problem
+        type=models.ProblemType(task.type.value)
     )
     db.add(db_task)
     db.commit()
+    catalog.cache.invalidate()
     db.refresh(db_task)
     return db_task
 
 
-@router.get("/", response_model=List[schemas.TaskCreateResponse])
-def get_tasks(theme_id: int = None, db: Session = Depends(get_db)):
-    query = db.query(models.Task).filter(cast("ColumnElement[bool]", models.Task.is_active))
+@router.get("/", response_model=List[schemas.TaskCreateResponse | schemas.TaskSummary])
+def get_tasks(
+        theme_id: int = None,
+        after_id: int = None,
+        limit: int = Query(None, ge=1, le=TASK_PAGE_MAX_LIMIT),
+        view: Literal["full", "summary"] = "full",
+        db: Session = Depends(get_read_db)
+):
+    # Keyset-пагинация по id: страница начинается строго после after_id (id последней задачи
+    # предыдущей страницы). Без limit возвращаются все задачи, как и раньше.
+    columns = TASK_SUMMARY_COLUMNS if view == "summary" else TASK_COLUMNS
+    query = db.query(*columns).filter(cast("ColumnElement[bool]", models.Task.is_active))
     if theme_id:
         query = query.filter(cast("ColumnElement[bool]", models.Task.theme_id == theme_id))
-    return query.all()
+    if after_id:
+        query = query.filter(cast("ColumnElement[bool]", models.Task.id > after_id))
+    query = query.order_by(models.Task.id)
+    if limit:
+        query = query.limit(limit)
+    return list_response([row._asdict() for row in query])
+
+@router.get("/search", response_model=List[schemas.TaskSearchResult])
+def search_tasks(
+        q: str = Query(..., min_length=1),
+        theme_id: int = None,
+        offset: int = Query(0, ge=0),
+        limit: int = Query(20, ge=1, le=TASK_SEARCH_MAX_LIMIT),
+        db: Session = Depends(get_read_db)
+):
+    # Поиск по заголовку и условию: результаты по релевантности, вместо условия — фрагмент с найденным словом
+    return list_response(search.search_tasks(db, q, theme_id, offset, limit))
+
 
 @router.get("/task/{task_id}", response_model=schemas.TaskCreateResponse)
 def get_task(task_id: int, db: Session = Depends(get_db)):
+    # Основная БД, не реплика: другие сервисы читают задачу сразу после её изменения, без токена пользователя
     query = db.query(models.Task).filter(cast("ColumnElement[bool]", models.Task.is_active)).filter(cast("ColumnElement[bool]", models.Task.id == task_id)).first()
     return query
 
 
+@router.get("/batch", response_model=List[schemas.TaskCreateResponse])
+def get_tasks_batch(ids: List[int] = Query(...), db: Session = Depends(get_db)):
+    # Несколько задач одним запросом (например, все задачи теста при пакетной отправке ответов); основная БД, как в get_task
+    if len(ids) > TASK_BATCH_MAX_IDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {TASK_BATCH_MAX_IDS} ids per request")
+    query = db.query(*TASK_COLUMNS).filter(
+        cast("ColumnElement[bool]", models.Task.is_active),
+        cast("ColumnElement[bool]", models.Task.id.in_(ids)),
+    )
+    return list_response([row._asdict() for row in query])
+
+
+@router.get("/answer-ids", response_model=List[int])
+def get_referenced_answer_ids(db: Session = Depends(get_db)):
+    # Эталоны, на которые ссылаются задачи (включая удалённые); остальные solution-сервис удаляет
+    return list_response([row.answer_id for row in db.query(models.Task.answer_id).distinct()])
+
+
 @router.get("/teacher", response_model=List[schemas.TaskCreateResponse])
-async def get_teacher_tasks(db: Session = Depends(get_db), token: str = Depends(utils.oauth2_scheme)):
+async def get_teacher_tasks(db: Session = Depends(get_read_db), token: str = Depends(utils.oauth2_scheme)):
     user_data = await get_user_data(token)
     if user_data["role"] != "teacher" and user_data["role"] != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can view their tasks")
 
-    tasks = db.query(models.Task).filter(cast("ColumnElement[bool]", models.Task.user_id == user_data["id"] and models.Task.is_active)).all()
-    return tasks
+    tasks = db.query(*TASK_COLUMNS).filter(cast("ColumnElement[bool]", models.Task.user_id == user_data["id"] and models.Task.is_active))
+    return list_response([row._asdict() for row in tasks])
+
+
+async def request_regrade(task_id: int, token: str):
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                f"http://{SOLUTION_SERVICE_HOST}:{SOLUTION_SERVICE_PORT}/{SOLUTION_SERVICE_SOLUTION_PREFIX_API}/regrade/tasks/{task_id}",
+                headers={"Authorization": f"Bearer {token}"}
+            )
+        if response.status_code != status.HTTP_202_ACCEPTED:
+            logging.error(f"Failed to start regrade for task {task_id}: {response.text}")
+    except httpx.HTTPError as e:
+        # Задача уже сохранена; перепроверку можно запустить вручную
+        logging.error(f"Failed to start regrade for task {task_id}: {str(e)}")
 
 
 @router.put("/{task_id}", response_model=schemas.TaskCreateResponse)
@@ -105,35 +195,43 @@ async def update_task(
     if user_data["role"] == "student":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
 
-    db_task = db.query(models.Task).filter(cast("ColumnElement[bool]", models.Task.id == task_id and models.Task.is_active)).first()
+    db_task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.is_active).first()
     if not db_task:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Task not found")
 
     if user_data["role"] == "teacher" and db_task.user_id != user_data["id"]:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Teachers can only update their own tasks")
 
+    db_theme = db.query(models.Theme).filter(models.Theme.id == task.theme_id, models.Theme.is_active).first()
+    if not db_theme:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Theme not found")
+
+    # solution-сервис вернёт текущий эталон, если текст ответа не изменился
     async with httpx.AsyncClient() as client:
         response = await client.post(
             f"http://{SOLUTION_SERVICE_HOST}:{SOLUTION_SERVICE_PORT}/{SOLUTION_SERVICE_SOLUTION_PREFIX_API}/create",
             headers={"Authorization": f"Bearer {token}"},
-            json={"token": token, "answer": task.answer}
+            json={"token": token, "answer": task.answer, "task_id": task_id, "current_answer_id": db_task.answer_id}
         )
         if response.status_code != status.HTTP_200_OK:
             raise HTTPException(status_code=response.status_code,
                                 detail=response.json().get("detail", "Failed to create answer"))
         answer_data = response.json()
-
-    db_theme = db.query(models.Theme).filter(cast("ColumnElement[bool]", models.Theme.id == task.theme_id and models.Theme.is_active)).first()
-    if not db_theme:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Theme not found")
+    answer_changed = answer_data["id"] != db_task.answer_id
 
     db_task.title = task.title
     db_task.condition = task.condition
     db_task.theme_id = task.theme_id
+    db_task.type = models.ProblemType(task.type.value)
     db_task.answer_id = answer_data["id"]
     db_task.updated_at = datetime.now(timezone.utc)
     db.commit()
+    catalog.cache.invalidate()
     db.refresh(db_task)
+
+    # Эталон сменился — старые попытки перепроверяются фоновой задачей в solution-сервисе
+    if answer_changed:
+        await request_regrade(task_id, token)
     return db_task
 
 
@@ -157,11 +255,12 @@ async def delete_task(
     db_task.is_active = False
     db_task.updated_at = datetime.now(timezone.utc)
     db.commit()
+    catalog.cache.invalidate()
     return {"message": "Task deleted"}
 
 
 @router.get("/teacher/stats")
-async def get_teacher_stats(db: Session = Depends(get_db), token: str = Depends(utils.oauth2_scheme)):
+async def get_teacher_stats(db: Session = Depends(get_read_db), token: str = Depends(utils.oauth2_scheme)):
     user_data = await get_user_data(token)
     if user_data["role"] != "teacher":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only teachers can view stats")
@@ -170,7 +269,7 @@ async def get_teacher_stats(db: Session = Depends(get_db), token: str = Depends(
 
     async with httpx.AsyncClient() as client:
         response = await client.get(
-            f"http://{SOLUTION_SERVICE_HOST}:{SOLUTION_SERVICE_PORT}/{SOLUTION_SERVICE_SOLUTION_PREFIX_API}",
+            f"http://{SOLUTION_SERVICE_HOST}:{SOLUTION_SERVICE_PORT}/{SOLUTION_SERVICE_SOLUTION_PREFIX_API}/teacher/stats",
             headers={"Authorization": f"Bearer {token}"}
         )
         attempt_stats = response.json() if response.status_code == 200 else {"attempts": 0, "solved": 0}
@@ -180,3 +279,153 @@ async def get_teacher_stats(db: Session = Depends(get_db), token: str = Depends(
         "attempt_count": attempt_stats["attempts"],
         "solved_count": attempt_stats["solved"]
     }
+
+
+# Колонки файла набора задач: экспорт можно загрузить обратно через импорт
+IMPORT_FIELDS = ("title", "condition", "answer", "type")
+
+
+def parse_import(body: bytes, content_type: str) -> list:
+    try:
+        if "csv" in content_type:
+            rows = list(csv.DictReader(io.StringIO(body.decode("utf-8-sig"))))
+            # Пустые ячейки необязательных колонок — значения по умолчанию
+            rows = [{key: value for key, value in row.items() if value not in (None, "")} for row in rows]
+        else:
+            rows = orjson.loads(body)
+    except (UnicodeDecodeError, csv.Error, orjson.JSONDecodeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Cannot parse problem set: {str(e)}")
+    if not isinstance(rows, list) or not rows:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Problem set must be a non-empty list of tasks")
+    if len(rows) > TASK_IMPORT_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {TASK_IMPORT_MAX_ITEMS} tasks per import")
+
+    items = []
+    errors = []
+    for index, row in enumerate(rows, start=1):
+        try:
+            items.append(schemas.TaskImportItem.model_validate(row))
+        except ValidationError as e:
+            errors.append(f"Task {index}: " + "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()))
+    if errors:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=errors)
+    return items
+
+
+@router.post("/import", response_model=List[schemas.TaskCreateResponse])
+async def import_tasks(
+        request: Request,
+        theme_id: int,
+        db: Session = Depends(get_db),
+        token: str = Depends(utils.oauth2_scheme)
+):
+    # Набор задач темы (JSON-массив или CSV с колонками title, condition, answer, type):
+    # одна проверка токена, один запрос эталонов в solution-сервис и одна транзакция
+    user_data = await get_user_data(token)
+    if user_data["role"] == "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+
+    db_theme = db.query(models.Theme).filter(models.Theme.id == theme_id, models.Theme.is_active).first()
+    if not db_theme:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Theme not found")
+
+    items = parse_import(await request.body(), request.headers.get("content-type", ""))
+
+    async with httpx.AsyncClient() as client:
+        response = await client.post(
+            f"http://{SOLUTION_SERVICE_HOST}:{SOLUTION_SERVICE_PORT}/{SOLUTION_SERVICE_SOLUTION_PREFIX_API}/create/bulk",
+            headers={"Authorization": f"Bearer {token}"},
+            json={"answers": [item.answer for item in items]}
+        )
+        if response.status_code != status.HTTP_200_OK:
+            raise HTTPException(status_code=response.status_code,
+                                detail=response.json().get("detail", "Failed to create answers"))
+        answers_data = response.json()
+
+    db_tasks = [
+        models.Task(
+            title=item.title,
+            condition=item.condition,
+            theme_id=theme_id,
+            user_id=user_data["id"],
+            answer_id=answer_data["id"],
+            type=models.ProblemType(item.type.value)
+        )
+        for item, answer_data in zip(items, answers_data)
+    ]
+    db.add_all(db_tasks)
+    # Объекты не истекают при commit: ответ собирается без перечитывания каждой задачи
+    db.expire_on_commit = False
+    db.commit()
+    catalog.cache.invalidate()
+    return list_response([{column.key: getattr(db_task, column.key) for column in TASK_COLUMNS} for db_task in db_tasks])
+
+
+async def get_answers_data(token: str, answer_ids: list) -> dict:
+    async with httpx.AsyncClient() as client:
+        response = await client.get(
+            f"http://{SOLUTION_SERVICE_HOST}:{SOLUTION_SERVICE_PORT}/{SOLUTION_SERVICE_SOLUTION_PREFIX_API}/answers",
+            headers={"Authorization": f"Bearer {token}"},
+            params={"ids": answer_ids}
+        )
+        if response.status_code != status.HTTP_200_OK:
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch answers")
+        return {answer["id"]: answer["text"] for answer in response.json()}
+
+
+def export_line(item: dict, export_format: str, first: bool) -> bytes:
+    if export_format == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow([item[field] for field in IMPORT_FIELDS])
+        return buffer.getvalue().encode()
+    return (b"" if first else b",") + orjson.dumps(item)
+
+
+async def stream_tasks(token: str, theme_id: int, user_id: int | None, export_format: str, make_session=database.SessionLocal):
+    # Сессия запроса закрывается до отправки тела, поэтому поток открывает свою (make_session — основная БД или реплика).
+    # Задачи читаются порциями по id, эталоны каждой порции — одним запросом в solution-сервис
+    db = make_session()
+    try:
+        yield (",".join(IMPORT_FIELDS).encode() + b"\r\n") if export_format == "csv" else b"["
+        first = True
+        after_id = 0
+        while True:
+            query = db.query(*TASK_COLUMNS).filter(
+                cast("ColumnElement[bool]", models.Task.is_active),
+                cast("ColumnElement[bool]", models.Task.theme_id == theme_id),
+                cast("ColumnElement[bool]", models.Task.id > after_id),
+            )
+            if user_id is not None:
+                query = query.filter(cast("ColumnElement[bool]", models.Task.user_id == user_id))
+            rows = query.order_by(models.Task.id).limit(TASK_EXPORT_CHUNK_SIZE).all()
+            if not rows:
+                break
+            after_id = rows[-1].id
+            answers = await get_answers_data(token, sorted({row.answer_id for row in rows}))
+            for row in rows:
+                item = {"title": row.title, "condition": row.condition, "answer": answers.get(row.answer_id), "type": row.type.value}
+                yield export_line(item, export_format, first)
+                first = False
+        if export_format != "csv":
+            yield b"]"
+    finally:
+        db.close()
+
+
+@router.get("/export")
+async def export_tasks(
+        theme_id: int,
+        request: Request,
+        format: Literal["json", "csv"] = "json",
+        token: str = Depends(utils.oauth2_scheme)
+):
+    # Учитель выгружает свои задачи темы, администратор — все
+    user_data = await get_user_data(token)
+    if user_data["role"] == "student":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
+    user_id = user_data["id"] if user_data["role"] == "teacher" else None
+    return StreamingResponse(
+        stream_tasks(token, theme_id, user_id, format, session_factory(request)),
+        media_type="text/csv" if format == "csv" else "application/json",
+        headers={"Content-Disposition": f'attachment; filename="theme_{theme_id}_tasks.{format}"'},
+    )
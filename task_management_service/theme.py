@@ -1,13 +1,17 @@
 from datetime import datetime, timezone
 from typing import List, cast
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import and_, func
 from sqlalchemy.orm import Session
 import httpx
 
+import catalog
 import models
 import database
 import utils
 import schemas
+from responses import list_response
+from replica import get_read_db
 from config import AUTH_SERVICE_HOST, AUTH_SERVICE_PORT, AUTH_SERVICE_POSSIBILITY_PREFIX_URL
 
 router = APIRouter()
@@ -43,18 +47,37 @@ async def create_theme(theme: schemas.ThemeCreate, db: Session = Depends(get_db)
     db_theme = models.Theme(title=theme.title, description=theme.description)
     db.add(db_theme)
     db.commit()
+    catalog.cache.invalidate()
     db.refresh(db_theme)
     return {"id": db_theme.id, "title": db_theme.title, "description": db_theme.description or ""}
 
 
-@router.get("/", response_model=List[schemas.ThemeResponse])
-def get_themes(db: Session = Depends(get_db)):
+def load_themes(db: Session) -> list:
     db_themes = db.query(models.Theme).filter(cast("ColumnElement[bool]", models.Theme.is_active)).all()
     return [{"id": t.id, "title": t.title, "description": t.description or ""} for t in db_themes]
 
 
+def load_themes_with_counts(db: Session) -> list:
+    # Один GROUP BY вместо выгрузки всех задач клиентом; темы без задач — с нулём
+    task_count = func.count(models.Task.id)
+    rows = db.query(models.Theme.id, models.Theme.title, models.Theme.description, task_count).outerjoin(
+        models.Task, and_(models.Task.theme_id == models.Theme.id, models.Task.is_active)
+    ).filter(cast("ColumnElement[bool]", models.Theme.is_active)).group_by(models.Theme.id).order_by(models.Theme.id)
+    return [{"id": row.id, "title": row.title, "description": row.description or "", "task_count": row[3]} for row in rows]
+
+
+@router.get("/", response_model=List[schemas.ThemeResponse])
+def get_themes(db: Session = Depends(get_db)):
+    return list_response(catalog.cache.get("themes", lambda: load_themes(db)))
+
+
+@router.get("/with-counts", response_model=List[schemas.ThemeWithCount])
+def get_themes_with_counts(db: Session = Depends(get_db)):
+    return list_response(catalog.cache.get("themes_with_counts", lambda: load_themes_with_counts(db)))
+
+
 @router.get("/{theme_id}", response_model=schemas.ThemeResponse)
-def get_theme_by_id(theme_id: int, db: Session = Depends(get_db)):
+def get_theme_by_id(theme_id: int, db: Session = Depends(get_read_db)):
     db_theme = db.query(models.Theme).filter(cast("ColumnElement[bool]", models.Theme.id == theme_id and models.Theme.is_active)).first()
     if not db_theme:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Theme not found")
@@ -80,6 +103,7 @@ async def update_theme(
     db_theme.description = theme.description
     db_theme.updated_at = datetime.now(timezone.utc)
     db.commit()
+    catalog.cache.invalidate()
     db.refresh(db_theme)
     return {"id": db_theme.id, "title": db_theme.title, "description": db_theme.description or ""}
 
@@ -101,4 +125,5 @@ async def delete_theme(
     db_theme.is_active = False
     db_theme.updated_at = datetime.now(timezone.utc)
     db.commit()
+    catalog.cache.invalidate()
     return {"message": "Theme deleted"}
\ No newline at end of file